@@ -0,0 +1,235 @@
+"""
+This module synthesizes 1- and 2-qubit unitaries analytically, for Gatesets made of CNOTGate and U3Gate such as QubitCNOTLinear.
+
+A 1-qubit target is a single U3Gate, whose parameters come from the ZYZ decomposition.  A 2-qubit target is decomposed with the KAK (Cartan) decomposition into U = (A1 x A2) exp(i(a XX + b YY + c ZZ)) (B1 x B2), and the minimal number of CNOTs follows from the coordinates (a, b, c): none if they are all multiples of pi/2, one if the only other coordinate is an odd multiple of pi/4, two if any of them is a multiple of pi/2, and three otherwise.  The nonlocal part is then built from that many CNOTs, and every single-qubit gate is converted to a U3Gate.
+
+This takes microseconds, compared to the seconds spent searching over CNOT counts and solving numerically, so SearchCompiler, LeapCompiler, and LEAPReoptimizing_PostProcessor try it first when the analytic_synthesis option is enabled.
+
+Attributes:
+    supports : Checks whether a Gateset can represent the circuits produced by this module.
+    synthesize : Returns a result dict with "structure" and "parameters" for a 1- or 2-qubit target, or None.
+    synthesize_for : Returns the result of synthesize when it is a valid result for a compilation with the given Options, or None.
+    zyz_parameters : Returns U3Gate parameters for a 1-qubit unitary.
+    kak_decomposition : Returns the KAK decomposition of a 2-qubit unitary.
+    cnot_count : Returns the minimal number of CNOTs needed for a 2-qubit unitary.
+"""
+
+import numpy as np
+
+from .gates import ProductGate, KroneckerGate, CNOTGate, U3Gate
+from .gatesets import QubitCNOTLinear, U3CNOTLinear, QubitCNOTRing, QubitCNOTAdjacencyList, linear_topology
+from .comparison import matrix_distance_squared
+from .objectives import MatrixDistanceObjective
+
+_X = np.array([[0, 1], [1, 0]], dtype='complex128')
+_Y = np.array([[0, -1j], [1j, 0]], dtype='complex128')
+_Z = np.array([[1, 0], [0, -1]], dtype='complex128')
+_I = np.eye(2, dtype='complex128')
+_H = np.array([[1, 1], [1, -1]], dtype='complex128') / np.sqrt(2)
+_S = np.array([[1, 0], [0, 1j]], dtype='complex128')
+_PAULIS = [np.kron(_X, _X), np.kron(_Y, _Y), np.kron(_Z, _Z)]
+
+# the magic basis, in which the nonlocal part of the KAK decomposition is diagonal and local gates are real orthogonal
+_MAGIC = np.array([[1, 0, 0, 1j], [0, 1j, 1, 0], [0, 1j, -1, 0], [1, 0, 0, -1j]], dtype='complex128') / np.sqrt(2)
+# maps the phases of the diagonal of the nonlocal part in the magic basis to (global phase, a, b, c)
+_COORDINATES = np.linalg.inv(np.column_stack([np.ones(4)] + [np.real(np.diag(_MAGIC.conj().T @ P @ _MAGIC)) for P in _PAULIS]))
+
+def _rz(theta):
+    return np.diag([np.exp(-0.5j*theta), np.exp(0.5j*theta)])
+
+def _ry(theta):
+    return np.array([[np.cos(theta/2), -np.sin(theta/2)], [np.sin(theta/2), np.cos(theta/2)]], dtype='complex128')
+
+def _rx(theta):
+    return np.array([[np.cos(theta/2), -1j*np.sin(theta/2)], [-1j*np.sin(theta/2), np.cos(theta/2)]], dtype='complex128')
+
+def _nonlocal(a, b, c):
+    # exp(i(a XX + b YY + c ZZ)), which is diagonal in the magic basis
+    phases = np.real(np.diag(_MAGIC.conj().T @ (a*_PAULIS[0] + b*_PAULIS[1] + c*_PAULIS[2]) @ _MAGIC))
+    return _MAGIC @ np.diag(np.exp(1j*phases)) @ _MAGIC.conj().T
+
+def supports(gateset):
+    """Returns True if gateset is a qubit Gateset with CNOTGate and U3Gate, which can represent the circuits produced by synthesize."""
+    return isinstance(gateset, (QubitCNOTLinear, U3CNOTLinear, QubitCNOTRing, QubitCNOTAdjacencyList)) and isinstance(gateset.single_gate, U3Gate)
+
+def zyz_parameters(U):
+    """Returns the parameters v for which U3Gate().matrix(v) is equal to the 2x2 unitary U, up to a global phase."""
+    U = np.asarray(U, dtype='complex128')
+    theta = 2 * np.arctan2(np.abs(U[1, 0]), np.abs(U[0, 0]))
+    if np.abs(U[0, 0]) > 1e-12:
+        phase = np.angle(U[0, 0])
+        if np.abs(U[1, 0]) > 1e-12:
+            phi = np.angle(U[1, 0]) - phase
+            lam = np.angle(-U[0, 1]) - phase
+        else:
+            phi = 0.0
+            lam = np.angle(U[1, 1]) - phase
+    else:
+        phase = np.angle(U[1, 0])
+        phi = 0.0
+        lam = np.angle(-U[0, 1]) - phase
+    return np.array([theta, phi, lam], dtype='float64') % (2*np.pi)
+
+def kron_factor(U):
+    """Returns 2x2 unitaries A and B such that U is equal to np.kron(A, B), up to a global phase, for a 4x4 unitary U that is a tensor product."""
+    # rearranging the entries of np.kron(A, B) gives the rank one matrix vec(A) vec(B)^T
+    R = np.asarray(U, dtype='complex128').reshape(2, 2, 2, 2).transpose(0, 2, 1, 3).reshape(4, 4)
+    u, s, vh = np.linalg.svd(R)
+    A = u[:, 0].reshape(2, 2) * np.sqrt(s[0])
+    B = vh[0].reshape(2, 2) * np.sqrt(s[0])
+    return (A / np.sqrt(np.abs(np.linalg.det(A))), B / np.sqrt(np.abs(np.linalg.det(B))))
+
+def kak_decomposition(U):
+    """Decomposes a 4x4 unitary U as K1 exp(i(a XX + b YY + c ZZ)) K2, up to a global phase, where K1 and K2 are tensor products of 1-qubit unitaries.
+
+    Returns:
+        tuple : (K1, (a, b, c), K2), where K1 and K2 are 4x4 matrices.
+    """
+    U = np.asarray(U, dtype='complex128')
+    U = U / np.linalg.det(U)**0.25
+    UB = _MAGIC.conj().T @ U @ _MAGIC
+    M2 = UB.T @ UB
+    # M2 is a symmetric unitary, so its real and imaginary parts are commuting real symmetric matrices, which a random combination of diagonalizes with a real orthogonal P
+    rng = np.random.default_rng(0)
+    for _ in range(16):
+        _, P = np.linalg.eigh(np.real(M2) + rng.uniform(0.5, 2) * np.imag(M2))
+        D = P.T @ M2 @ P
+        if np.allclose(D, np.diag(np.diag(D)), atol=1e-10):
+            break
+    if np.linalg.det(P) < 0:
+        P[:, 0] *= -1
+    delta = np.sqrt(np.diag(P.T @ M2 @ P))
+    O1 = np.real(UB @ P @ np.diag(1 / delta))
+    if np.linalg.det(O1) < 0:
+        O1[:, 0] *= -1
+        delta[0] *= -1
+    coordinates = _COORDINATES @ np.angle(delta)
+    K1 = _MAGIC @ O1 @ _MAGIC.conj().T
+    K2 = _MAGIC @ P.T @ _MAGIC.conj().T
+    return (K1, tuple(coordinates[1:]), K2)
+
+def _reduce(coordinates, K2):
+    # shifting a coordinate by a multiple of pi/2 multiplies the nonlocal part by a power of i PP, which is local and gets folded into K2
+    reduced = []
+    for P, x in zip(_PAULIS, coordinates):
+        n = int(np.round(x / (np.pi/2)))
+        reduced.append(x - n * np.pi/2)
+        if n % 2 != 0:
+            K2 = P @ K2
+    return reduced, K2
+
+def _count(reduced, tol):
+    zeros = sum(1 for x in reduced if abs(x) < tol)
+    if zeros == 3:
+        return 0
+    if zeros == 2 and any(abs(abs(x) - np.pi/4) < tol for x in reduced):
+        return 1
+    if zeros >= 1:
+        return 2
+    return 3
+
+def cnot_count(U, tol=1e-7):
+    """Returns the minimal number of CNOTs needed to implement the 4x4 unitary U with arbitrary 1-qubit gates."""
+    _, coordinates, K2 = kak_decomposition(U)
+    return _count(_reduce(coordinates, K2)[0], tol)
+
+def _swap_coordinates(i, j):
+    # a local W with W exp(i(a XX + b YY + c ZZ)) W^dagger equal to the same gate with coordinates i and j swapped
+    if {i, j} == {0, 1}:
+        w = _S
+    elif {i, j} == {1, 2}:
+        w = _rx(np.pi/2)
+    else:
+        w = _ry(np.pi/2)
+    return np.kron(w, w)
+
+def _layers(U, tol):
+    # returns 4x4 local layers L0, ..., Lk with U equal to Lk CNOT ... CNOT L0, up to a global phase
+    K1, coordinates, K2 = kak_decomposition(U)
+    reduced, K2 = _reduce(coordinates, K2)
+    count = _count(reduced, tol)
+    if count == 0:
+        return [K1 @ _nonlocal(*reduced) @ K2]
+    if count == 3:
+        # the three CNOT circuit of Vatan and Williams, with the CNOT of the middle reversed by Hadamards
+        b, a, c = reduced
+        H = np.kron(_H, _H)
+        return [np.kron(_rz(np.pi/2), _I) @ K2,
+                H @ np.kron(_ry(np.pi/2 - 2*b), _I),
+                np.kron(_ry(2*a - np.pi/2), _rz(np.pi/2 - 2*c)) @ H,
+                K1 @ np.kron(_I, _rz(-np.pi/2))]
+    # move the coordinate that is left out of the CNOT construction into position 1, and for a single CNOT the nonzero one into position 0
+    order = sorted(range(3), key=lambda i: abs(reduced[i]), reverse=(count == 1))
+    W = np.eye(4, dtype='complex128')
+    target = [1, 0, 2] if count == 2 else [0, 1, 2]
+    # swap the coordinates into place one pair at a time, keeping track of the local gates that do it
+    current = list(range(3))
+    for position, index in zip(target, order):
+        here = current.index(index)
+        if here != position:
+            swap = _swap_coordinates(here, position)
+            W = W @ swap
+            current[here], current[position] = current[position], current[here]
+    a, b, c = [reduced[current[i]] for i in range(3)]
+    if count == 2:
+        # exp(i(a XX + c ZZ)) is a CNOT on either side of Rx(-2a) and Rz(-2c), because conjugating by a CNOT takes XI to XX and IZ to ZZ
+        return [W.conj().T @ K2, np.kron(_rx(-2*a), _rz(-2*c)), K1 @ W]
+    # exp(+-i pi/4 XX) is a controlled Z in the Hadamard basis, which is a CNOT up to local gates
+    flip = np.kron(_Z, _I) if a < 0 else np.eye(4)
+    H = np.kron(_H, _H)
+    before = np.kron(_I, _H) @ H @ flip
+    after = flip @ H @ np.kron(_rz(-np.pi/2), _rz(-np.pi/2)) @ np.kron(_I, _H)
+    return [before @ W.conj().T @ K2, K1 @ W @ after]
+
+def synthesize(U, gateset, threshold=1e-10, tol=1e-7):
+    """Synthesizes a 1- or 2-qubit unitary U with the minimal number of CNOTs, using the gates of gateset.
+
+    Args:
+        U : The target unitary, as a 2x2 or 4x4 numpy array.
+        gateset : The Gateset to synthesize with, which must be supported according to supports.
+        threshold : The result is only returned if its matrix_distance_squared from U is below this.
+        tol : How close the KAK coordinates of U must be to a multiple of pi/4 to use fewer CNOTs.
+
+    Returns:
+        dict : A result dict with "structure" and "parameters", in the same form as the search compilers, or None if U is too large, the gateset isn't supported, or the result isn't within threshold.
+    """
+    U = np.asarray(U, dtype='complex128')
+    if not supports(gateset) or U.shape not in ((2, 2), (4, 4)):
+        return None
+    if U.shape == (2, 2):
+        structure = ProductGate(gateset.initial_layer(1))
+        parameters = zyz_parameters(U)
+    else:
+        layers = _layers(U, tol)
+        single = gateset.single_gate
+        layer = linear_topology(CNOTGate(), single, 2, 2)[0][0]
+        structure = ProductGate(KroneckerGate(single, single), *[layer]*(len(layers) - 1))
+        parameters = np.concatenate([np.concatenate([zyz_parameters(A) for A in kron_factor(L)]) for L in layers])
+    if matrix_distance_squared(structure.matrix(parameters), U) >= threshold:
+        return None
+    return {"structure": structure, "parameters": parameters}
+
+def synthesize_for(U, options):
+    """Synthesizes U as synthesize does, for a compilation with options, which the compilers use when the analytic_synthesis option is enabled.
+
+    The result is only returned if it is a valid result for that compilation: the objective must be a MatrixDistanceObjective, since other objectives such as the one used for state preparation don't compare the circuit with U, and the weight of the result must be within the weight_limit option, if there is one.
+
+    Args:
+        U : The target unitary, as a 2x2 or 4x4 numpy array.
+        options : The Options of the compilation, which must have gateset, threshold, and objective.
+
+    Returns:
+        dict : A result dict with "structure" and "parameters", or None if the compilation should search instead.
+    """
+    if not isinstance(options.objective, MatrixDistanceObjective):
+        return None
+    result = synthesize(U, options.gateset, options.threshold)
+    if result is None:
+        return None
+    weight_limit = options.weight_limit if "weight_limit" in options else None
+    if weight_limit is not None:
+        cnots = len(result["structure"]._subgates) - 1
+        weight = cnots * min(weight for _, weight in options.gateset.search_layers(2)) if cnots > 0 else 0
+        if weight > weight_limit:
+            return None
+    return result
@@ -0,0 +1,85 @@
+"""
+This module defines BeamController, which decides how many nodes SearchCompiler and LeapCompiler pop from their search queues at a time.
+
+Popping several nodes at once and solving all of their successors together, which is called the beam width, is how the compilers keep every worker of the Parallelizer busy.  FixedBeams pops the same number of nodes every time: the beams option, or as many nodes as there are successors to give each worker one.  That leaves workers idle when the branching factor doesn't divide num_tasks, or when a few slow solves hold up the end of a layer.  AdaptiveBeams measures the solve times of each layer, and picks the number of nodes that is predicted to keep the workers busiest in the next one.
+
+Popping more nodes departs further from best-first order, which can make the search solve nodes that it otherwise would have skipped, so AdaptiveBeams never pops more than max_beams nodes at a time, or nodes whose heuristic values are more than beam_slack above the first node it pops.
+
+The required format for a BeamController is a class that is constructed with an Options object and the branching factor, has beams and slack attributes, and has a record_layer method.  It is passed to the compilers as the beam_controller option.
+
+Attributes:
+    BeamController : The base class, which pops one node at a time.
+    FixedBeams : Pops the same number of nodes every time, which is what the compilers used to do.
+    AdaptiveBeams : Adjusts the number of nodes popped from the measured solve times of each layer.
+"""
+
+import math
+
+
+class BeamController():
+    """Base class for all BeamControllers, which pops one node at a time."""
+    def __init__(self, options, branching_factor):
+        """
+        Args:
+            options : The Options of the compilation, with num_tasks set by the Parallelizer.
+            branching_factor : The number of successors of each node.
+        """
+        self.beams = 1
+        self.slack = None
+
+    def admits(self, first, heuristic):
+        """Returns True if a node with the heuristic value heuristic can be popped along with a node with the heuristic value first."""
+        return self.slack is None or heuristic <= first + self.slack
+
+    def record_layer(self, layer, popped):
+        """Records the parallelizers.LayerStatistics of a layer, which solved the successors of popped nodes, and updates beams for the next layer."""
+        pass
+
+class FixedBeams(BeamController):
+    """Pops the beams option worth of nodes every time, or when beams is less than 1, num_tasks // branching_factor of them, which is at least 1."""
+    def __init__(self, options, branching_factor):
+        super().__init__(options, branching_factor)
+        beams = int(options.beams)
+        if beams < 1 and branching_factor > 0:
+            beams = int(options.num_tasks // branching_factor)
+        self.beams = max(beams, 1)
+
+class AdaptiveBeams(BeamController):
+    """Pops the number of nodes that is predicted to keep the workers busiest, from the solve times measured in each layer.
+
+    The prediction assumes the successors of the popped nodes are handed to the workers in waves of num_tasks, and that the slowest solve of a layer runs past the average one by the same fraction as in the layers so far, while the other workers sit idle.  Among the beam widths up to max_beams, the smallest one whose predicted utilization is within tolerance of the best is picked, so the search stays as close to best-first order as it can.  When the beams option is 1 or more, it is used as is, without the beam_slack limit.
+    """
+    tolerance = 0.05 # the predicted utilization that is given up for staying closer to best-first order
+    smoothing = 0.5 # the weight of the newest layer in the running estimates
+
+    def __init__(self, options, branching_factor):
+        super().__init__(options, branching_factor)
+        self.slack = options.beam_slack if "beam_slack" in options else None
+        self.num_tasks = max(int(options.num_tasks), 1)
+        self.fanout = max(branching_factor, 1) # the number of solves per popped node, which is lower when nodes get full solves or transpositions are dropped
+        self.spread = 0.0 # how far the slowest solve of a layer runs past the average one, as a fraction of the average
+        self.fixed = int(options.beams) >= 1
+        max_beams = options.max_beams if "max_beams" in options else None
+        self.max_beams = max_beams if max_beams is not None else 2 * math.ceil(self.num_tasks / self.fanout)
+        self.beams = int(options.beams) if self.fixed else self._best_beams()
+        if self.fixed:
+            self.slack = None
+
+    def predicted_utilization(self, beams):
+        """Returns the predicted fraction of the time that the workers spend solving during a layer that pops beams nodes."""
+        tasks = beams * self.fanout
+        waves = math.ceil(tasks / self.num_tasks - 1e-9)
+        return tasks / (self.num_tasks * (waves + self.spread * (1 - 1 / self.num_tasks)))
+
+    def _best_beams(self):
+        predictions = [self.predicted_utilization(beams) for beams in range(1, max(self.max_beams, 1) + 1)]
+        best = max(predictions)
+        return next(beams for beams, utilization in enumerate(predictions, 1) if utilization >= best - self.tolerance)
+
+    def record_layer(self, layer, popped):
+        if self.fixed or popped == 0 or layer.tasks == 0:
+            return
+        self.fanout += self.smoothing * (layer.tasks / popped - self.fanout)
+        if layer.mean_time > 0:
+            self.spread += self.smoothing * ((layer.max_time - layer.mean_time) / layer.mean_time - self.spread)
+        self.beams = self._best_beams()
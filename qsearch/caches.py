@@ -0,0 +1,248 @@
+"""
+This module defines SolveCache, which stores the results of Solver.solve_for_unitary so that the same circuit structure does not have to be solved against the same target more than once, and ResultStore, which stores finished compilations so that the same target does not have to be synthesized more than once.
+
+The same structure often gets solved against the same target repeatedly, such as by the windows of LEAPReoptimizing_PostProcessor, by re-running a Project after Project.reset, by BasicSingleQubitReduction_PostProcessor, and by similar compilations in one Project.  To use a cache, pass a SolveCache as the "solve_cache" option.
+
+Small unitaries like QFT blocks and Toffoli also get synthesized over and over in different Projects.  A ResultStore is a directory of finished results, addressed by the target up to a global phase, that can be shared between any number of Projects by passing it as the "result_store" option.
+
+Attributes:
+    SolveCache : An in-memory least recently used cache of solve results, which can also be backed by a directory on disk.
+    ResultStore : A content-addressed store of finished compilations on disk.
+    cached_solve : Solves a circuit using the solve_cache in the options, if there is one.
+    circuit_weight : Counts the multi-qudit gates in a circuit.
+"""
+
+import os
+import pickle
+import re
+import tempfile
+from collections import OrderedDict
+from hashlib import md5
+from time import time
+
+import numpy as np
+
+from . import utils
+from .gates import ProductGate, KroneckerGate
+
+
+class SolveCache():
+    """A cache of the parameters found by Solver.solve_for_unitary, keyed by the structure of the circuit, a digest of the target that ignores its global phase, and the configuration of the Solver.
+
+    Results are kept in memory, where the least recently used ones are evicted once there are more than max_size of them, and can also be written to a directory on disk.  The directory can be shared between processes and between runs, which is how the cache is shared with the worker processes of a Parallelizer: when a SolveCache is pickled, the in-memory results and statistics are left behind.
+
+    The initial guess passed to solve_for_unitary is not part of the key, so a cached result is returned whether or not the circuit was warm started.
+    """
+    def __init__(self, max_size=1024, path=None):
+        """
+        Args:
+            max_size : The maximum number of results to keep in memory.
+            path : A directory to store results in, which is created if it doesn't exist.  The default of None keeps results in memory only.
+        """
+        self.max_size = max_size
+        self.path = path
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def key(self, structure, options):
+        """Returns the key for solving structure with the target and Solver in options."""
+        hasher = md5(structure.structural_digest)
+        hasher.update(utils.phase_invariant_digest(options.target))
+        if "target_state" in options:
+            hasher.update(utils.phase_invariant_digest(options.target_state))
+        hasher.update(solver_config(options).encode())
+        return hasher.hexdigest()
+
+    def get(self, key):
+        """Returns the parameters stored under key, or None if there are none."""
+        x = self._entries.get(key)
+        if x is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return x.copy()
+        if self.path is not None:
+            try:
+                with open(os.path.join(self.path, key), "rb") as f:
+                    x = pickle.load(f)
+            except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+                x = None
+            if x is not None:
+                self._remember(key, x)
+                self.hits += 1
+                self.disk_hits += 1
+                return x.copy()
+        self.misses += 1
+        return None
+
+    def put(self, key, x):
+        """Stores the parameters x under key."""
+        x = np.array(x, dtype='float64')
+        self._remember(key, x)
+        if self.path is not None:
+            # write to a temporary file first so other processes never read a partial result
+            fd, tmp = tempfile.mkstemp(dir=self.path)
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(x, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, os.path.join(self.path, key))
+
+    def _remember(self, key, x):
+        self._entries[key] = x
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """Removes every result from memory, and from disk if there is a path."""
+        self._entries.clear()
+        if self.path is not None:
+            for name in os.listdir(self.path):
+                os.remove(os.path.join(self.path, name))
+
+    @property
+    def hit_rate(self):
+        """The fraction of lookups made by this process that were hits."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    def stats(self):
+        """Returns a dict of the number of "hits", "disk_hits", and "misses" seen by this process, along with the "hit_rate" and the number of results held in memory as "size"."""
+        return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses, "hit_rate": self.hit_rate, "size": len(self._entries)}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_entries'] = OrderedDict()
+        state['hits'] = 0
+        state['disk_hits'] = 0
+        state['misses'] = 0
+        return state
+
+
+def describe(obj):
+    """Returns a string describing an object such as a Solver or a Gateset by its class and public attributes, which stays the same between runs."""
+    # memory addresses in the default repr of objects like multiprocessing contexts would change the description between runs
+    attributes = sorted((name, re.sub(" at 0x[0-9a-fA-F]+", "", repr(value))) for name, value in vars(obj).items() if not name.startswith("_")) if hasattr(obj, "__dict__") else []
+    return repr([type(obj).__qualname__, attributes])
+
+def solver_config(options):
+    """Returns a string describing everything in options, other than the circuit and target, that changes the result of solve_for_unitary."""
+    settings = [describe(options.solver), type(options.objective).__qualname__, options.threshold]
+    settings.append(options.max_quality_optimization if "max_quality_optimization" in options else False)
+    settings.append(options.max_solver_iterations if "max_solver_iterations" in options else None)
+    return repr(settings)
+
+def cached_solve(structure, circuit, options, x0=None):
+    """Solves circuit, which was prepared from structure by the Backend, using options.solver, unless the result is already in options.solve_cache.
+
+    Returns:
+        tuple : (result, cached), where result is the (matrix, parameters) tuple returned by solve_for_unitary, and cached is True if it came from the cache.
+    """
+    cache = options.solve_cache if "solve_cache" in options else None
+    if cache is None:
+        return (options.solver.solve_for_unitary(circuit, options, x0), False)
+    key = cache.key(structure, options)
+    x = cache.get(key)
+    if x is not None:
+        return ((circuit.matrix(x), x), True)
+    result = options.solver.solve_for_unitary(circuit, options, x0)
+    monitor = options.solve_monitor if "solve_monitor" in options else None
+    if monitor is not None and monitor.aborted: # aborted solves depend on their bound or deadline, so they aren't cached
+        return (result, False)
+    deadline = options.deadline if "deadline" in options else None
+    if deadline is not None and time() > deadline: # the solver may have been stopped by the deadline in another process, where the monitor can't record it
+        return (result, False)
+    cache.put(key, result[1])
+    return (result, False)
+
+
+class ResultStore():
+    """A directory of finished compilations that can be shared between Projects, addressed by a digest of the target that ignores its global phase.
+
+    Each entry records the gateset, threshold, weight_limit, and type of objective that it was compiled with, along with the weight of the resulting circuit as counted by circuit_weight.  Objectives such as StateprepObjective also depend on the target_state and initial_state options, so digests of those are recorded as well, since every stateprep target of the same size is the identity.  A lookup only returns results that were compiled with matching settings, and that are confirmed to be within the threshold by the eval_func of the objective, so a digest collision or a rounding difference can never return a wrong circuit.  When there are several matching results, the one with the lowest weight is returned.
+    """
+    def __init__(self, path, decimals=6):
+        """
+        Args:
+            path : The directory to store results in, which is created if it doesn't exist.
+            decimals : The number of decimal places the entries of a target are rounded to before they are hashed.
+        """
+        self.path = path
+        self.decimals = decimals
+        os.makedirs(path, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def _file(self, target):
+        return os.path.join(self.path, utils.phase_invariant_digest(target, self.decimals).hex() + ".pickle")
+
+    def _load(self, target):
+        try:
+            with open(self._file(target), "rb") as f:
+                return pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return []
+
+    def _settings(self, options):
+        settings = {"gateset": describe(options.gateset), "threshold": options.threshold, "weight_limit": options.weight_limit if "weight_limit" in options else None}
+        settings["objective"] = type(options.objective).__qualname__
+        for name in ("target_state", "initial_state"):
+            settings[name] = utils.phase_invariant_digest(options[name], self.decimals).hex() if name in options else None
+        return settings
+
+    def _within_threshold(self, target, structure, parameters, options):
+        eval_func = options.objective.gen_eval_func(structure, options.updated(target=target))
+        return eval_func(parameters) < options.threshold
+
+    def get(self, target, options):
+        """Returns the lowest weight result for target that was compiled with the settings in options, as a dict with "structure" and "parameters", or None if there isn't one."""
+        settings = self._settings(options)
+        best = None
+        for entry in self._load(target):
+            if any(entry.get(name) != value for name, value in settings.items()): # entries written before a setting was recorded don't match it
+                continue
+            if best is not None and entry["weight"] >= best["weight"]:
+                continue
+            if self._within_threshold(target, entry["structure"], entry["parameters"], options):
+                best = entry
+        if best is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return {"structure": best["structure"], "parameters": best["parameters"]}
+
+    def put(self, target, result, options):
+        """Stores a result dict with "structure" and "parameters" for target, unless it isn't within the threshold of target, or there is already a result with the same settings and no greater weight."""
+        if not self._within_threshold(target, result["structure"], result["parameters"], options):
+            return
+        settings = self._settings(options)
+        weight = circuit_weight(result["structure"])
+        entries = self._load(target)
+        for entry in entries:
+            if all(entry.get(name) == value for name, value in settings.items()) and entry["weight"] <= weight:
+                return
+        entry = dict(settings, weight=weight, structure=result["structure"], parameters=np.array(result["parameters"], dtype='float64'))
+        entries.append(entry)
+        # write to a temporary file first so other processes never read a partial file
+        fd, tmp = tempfile.mkstemp(dir=self.path)
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(entries, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self._file(target))
+
+    @property
+    def hit_rate(self):
+        """The fraction of lookups made by this process that were hits."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+def circuit_weight(circuit):
+    """Returns the number of gates in circuit that act on more than one qudit, looking inside of ProductGates and KroneckerGates."""
+    subgates = getattr(circuit, "_subgates", None)
+    if subgates is not None and isinstance(circuit, (ProductGate, KroneckerGate)):
+        return sum(circuit_weight(subgate) for subgate in subgates)
+    return 1 if circuit.qudits > 1 else 0
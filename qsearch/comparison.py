@@ -54,6 +54,38 @@ def matrix_distance_squared_jac(U, M, J):
     jacs = -(np.real(S)*np.real(JUS) + np.imag(S)*np.imag(JUS)) / (U.shape[0] * np.abs(S))
     return (dsq, jacs)
 
+def matrix_distance_squared_batch(A, Bs):
+    """
+    A batched version of matrix_distance_squared, which compares A to each of a stack of matrices at once.
+
+    Args:
+        A : A unitary matrix in the form of a numpy ndarray.
+        Bs : A numpy ndarray of shape (K, D, D), holding K unitaries of the same size as A.
+
+    Returns:
+        np.ndarray : An array of shape (K,) where entry i is matrix_distance_squared(A, Bs[i]).
+    """
+    return np.abs(1 - np.abs(np.sum(np.multiply(A, np.conj(Bs)), axis=(-2,-1))) / A.shape[0])
+
+def matrix_distance_squared_jac_batch(U, M, J):
+    """
+    A batched version of matrix_distance_squared_jac, taking the output of mat_jac_batch.
+
+    Args:
+        U : A constant unitary matrix in the form of a numpy ndarray.
+        M : A numpy ndarray of shape (K, D, D), holding K variable unitaries.
+        J : A numpy ndarray of shape (K, P, D, D), holding the jacobians of each of the matrices in M.
+
+    Returns:
+        dsq : An array of shape (K,) of the matrix distances squared.
+        jacs : An array of shape (K, P) of the derivatives of each distance with respect to each parameter.
+    """
+    S = np.sum(np.multiply(U, np.conj(M)), axis=(-2,-1))
+    dsq = 1 - np.abs(S)/U.shape[0]
+    JUS = np.sum(np.multiply(U, np.conj(J)), axis=(-2,-1))
+    jacs = -(np.real(S)[:, np.newaxis]*np.real(JUS) + np.imag(S)[:, np.newaxis]*np.imag(JUS)) / (U.shape[0] * np.abs(S)[:, np.newaxis])
+    return (dsq, jacs)
+
 def matrix_residuals(A, B, I):
     M = np.matmul(B, np.conj(A.T))
     #M *= np.abs(M[0][0])/M[0][0]
@@ -71,6 +103,18 @@ def matrix_residuals_jac(U, M, J):
     JU = np.array([np.append(np.reshape(np.real(K), (1,-1)), np.reshape(np.imag(K), (1,-1))) for K in JU])
     return JU.T
 
+def matrix_residuals_batch(A, Bs, I):
+    """A batched version of matrix_residuals, where Bs has shape (K, D, D) and the result has shape (K, 2*D*D)."""
+    M = np.matmul(Bs, np.conj(A.T))
+    Re = np.real(M) - I
+    return np.concatenate((np.reshape(Re, (len(M), -1)), np.reshape(np.imag(M), (len(M), -1))), axis=1)
+
+def matrix_residuals_jac_batch(U, M, J):
+    """A batched version of matrix_residuals_jac, where J has shape (K, P, D, D) and the result has shape (K, 2*D*D, P)."""
+    JU = np.matmul(J, np.conj(U.T))
+    JU = np.concatenate((np.reshape(np.real(JU), JU.shape[:2] + (-1,)), np.reshape(np.imag(JU), JU.shape[:2] + (-1,))), axis=2)
+    return np.transpose(JU, (0, 2, 1))
+
 def matrix_residuals_v2(A, B, I):
     # TODO examine how this function behaves compared to the original implementation.  Faster?  Behaves better?  Roughly the same?  Exactly the same?
     M = B - A
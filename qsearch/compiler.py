@@ -5,15 +5,183 @@ The default implementation SearchCompiler is also defined here.  SearchCompiler
 """
 from functools import partial
 from timeit import default_timer as timer
-import heapq
+from time import time
+from collections import deque
+from concurrent.futures import wait, FIRST_COMPLETED
+from warnings import warn
 
 from .gates import *
 
 from . import solvers as scsolver
 from .options import Options
 from .defaults import standard_defaults, standard_smart_defaults
+from .queues import SearchQueue, LOW_FIDELITY, FULL_FIDELITY
+from .caches import cached_solve, circuit_weight
 from . import parallelizers, backends
-from . import utils, heuristics, gates, logging, gatesets
+from . import utils, heuristics, gates, logging, gatesets, analytic
+
+def warm_start_parameters(parent_parameters, layer, index=None):
+    """Builds an initial guess for a child circuit from the optimized parameters of its parent.
+
+    Args:
+        parent_parameters : The optimized parameters of the parent circuit.
+        layer : The Gate that was added to the parent circuit to form the child circuit.
+        index : The offset into parent_parameters at which the parameters for layer are inserted.  The default of None appends them to the end.
+
+    Returns:
+        np.ndarray : The parent parameters, with parameters that set the single-qudit gates of layer near the identity spliced in at index.
+    """
+    parent_parameters = np.asarray(parent_parameters, dtype='float64')
+    if index is None:
+        index = len(parent_parameters)
+    return np.concatenate((parent_parameters[:index], utils.near_identity_parameters(layer), parent_parameters[index:]))
+
+def successor_initial_guess(parent, parent_parameters, child):
+    """Returns the warm start for a successor produced by ProductGate.appending, or None if child was not formed that way."""
+    if not isinstance(child, ProductGate) or len(child._subgates) == 0:
+        return None
+    layer = child._subgates[-1]
+    if layer.num_inputs + len(parent_parameters) != child.num_inputs:
+        return None
+    return warm_start_parameters(parent_parameters, layer)
+
+def successor_step(node, successor, options):
+    """Builds the tuple passed to parallelizers.evaluate_step for a successor of a node popped from the search queue.  The node's value is passed along as the bound for the solve_cutoff option, and the successor gets a low fidelity solve if multifidelity_iterations is set."""
+    x0 = successor_initial_guess(node[5], node[4], successor[0]) if options.warm_start else None
+    fidelity = LOW_FIDELITY if options.multifidelity_iterations is not None else FULL_FIDELITY
+    return (successor[0], node[1], successor[1], x0, {"bound": node[2], "fidelity": fidelity})
+
+def full_fidelity_step(step, depth, weight, x0):
+    """Builds the tuple passed to parallelizers.evaluate_step for the full solve of a node that was evaluated with a low fidelity solve, continuing from its parameters.  Nodes that were pushed with empty parameters, such as the seeds for a lower bound without warm_start, are solved from random parameters instead."""
+    return (step, depth, weight, x0 if len(x0) > 0 else None, {"fidelity": FULL_FIDELITY})
+
+class SolveStatistics():
+    """Keeps track of the time spent solving search nodes, the number of results found in the solve_cache, and estimates how much time was saved by aborting hopeless solves with the solve_cutoff option."""
+    def __init__(self):
+        self.cached = 0
+        self.completed = 0
+        self.completed_time = 0.0
+        self.aborted = 0
+        self.aborted_time = 0.0
+        self.expired = 0
+
+    def record(self, stats):
+        """Records the stats dict returned by parallelizers.evaluate_step."""
+        if stats.get("cached"):
+            self.cached += 1
+            return
+        if stats.get("expired"):
+            self.expired += 1
+        elif stats["aborted"]:
+            self.aborted += 1
+            self.aborted_time += stats["solve_time"]
+        else:
+            self.completed += 1
+            self.completed_time += stats["solve_time"]
+
+    def saved_time(self):
+        """Returns an estimate of the solver time saved by aborts, assuming each aborted solve would have taken as long as the average completed one."""
+        if self.completed == 0:
+            return 0.0
+        return max(0.0, self.aborted * self.completed_time / self.completed - self.aborted_time)
+
+    def log(self, logger):
+        if self.cached > 0:
+            logger.logprint("Found {} of {} results in the solve cache.".format(self.cached, self.cached + self.aborted + self.completed))
+        if self.aborted > 0:
+            logger.logprint("Aborted {} of {} solves early, saving an estimated {} seconds of solver time.".format(self.aborted, self.aborted + self.completed, self.saved_time()))
+        if self.expired > 0:
+            logger.logprint("Stopped {} solves that were still running at the deadline.".format(self.expired))
+
+def compile_deadline(options):
+    """Returns the time, as returned by time.time(), at which a compilation starting now has to stop, which is the earlier of the deadline option and timeout seconds from now, or None if neither is set."""
+    deadline = options.deadline if "deadline" in options else None
+    timeout = options.timeout if "timeout" in options else float('inf')
+    if timeout != float('inf'):
+        deadline = time() + timeout if deadline is None else min(deadline, time() + timeout)
+    return deadline
+
+def deadline_passed(options):
+    """Returns True if the deadline option is set and has passed."""
+    deadline = options.deadline if "deadline" in options else None
+    return deadline is not None and time() > deadline
+
+def check_solver_features(options):
+    """Warns about each option that needs a feature that options.solver doesn't support, as listed by Solver.supported_features, and turns off the options that would otherwise have no effect."""
+    if options.solve_cutoff is not None and not scsolver.supports(options.solver, "solve_cutoff", options):
+        warn("The solve_cutoff option is ignored because {} can't stop a solve early.".format(type(options.solver).__name__))
+        options.solve_cutoff = None
+    if options.multifidelity_iterations is not None and not scsolver.supports(options.solver, "max_iterations", options):
+        warn("The multifidelity_iterations option is ignored because {} can't cap the iterations of a solve.".format(type(options.solver).__name__))
+        options.multifidelity_iterations = None
+    if options.deadline is not None and not scsolver.supports(options.solver, "deadline", options):
+        warn("{} can't stop a solve at the deadline or timeout, so the solves that are running then will run to completion.".format(type(options.solver).__name__))
+
+def seed_structures(root, gateset, weight, max_seeds):
+    """Expands root through the successors from gateset without solving anything, to skip the search depths that a lower bound shows cannot reach the target.
+
+    Args:
+        root : The ProductGate at the root of the search tree.
+        gateset : The Gateset that generates the successors.
+        weight : The weight that every returned structure should reach.
+        max_seeds : The largest number of structures to return.  The expansion stops early, at a lower weight, if the next layer of structures would be larger than this.
+
+    Returns:
+        list : A list of tuples of (structure, weight), with structures that are equivalent up to the order of layers acting on disjoint qudits removed.
+    """
+    frontier = [(root, 0)]
+    while any(depth < weight for _, depth in frontier):
+        expanded = []
+        for structure, depth in frontier:
+            if depth >= weight:
+                expanded.append((structure, depth))
+            else:
+                expanded.extend((successor, depth + successor_weight) for successor, successor_weight in gateset.successors(structure))
+        expanded = drop_transpositions(expanded, set())
+        if len(expanded) > max_seeds:
+            break
+        frontier = expanded
+    return frontier
+
+def seed_parameters(root, root_parameters, structure):
+    """Builds an initial guess for a structure returned by seed_structures from the optimized parameters of root, with the single-qudit gates of every added layer set near the identity."""
+    parameters = root_parameters
+    for layer in structure._subgates[len(root._subgates):]:
+        parameters = warm_start_parameters(parameters, layer)
+    return parameters
+
+def drop_transpositions(steps, table):
+    """Removes the steps whose circuits are equivalent to ones already seen by the search, up to the order of layers that act on disjoint qudits.
+
+    Args:
+        steps : A list of tuples whose first element is a ProductGate, such as the successors returned by a Gateset.
+        table : A set of the gatesets.canonical_hash values of the circuits seen so far, which the new circuits get added to, or None to keep every step.
+
+    Returns:
+        list : The steps whose circuits were not already in table.
+    """
+    if table is None:
+        return steps
+    unique = []
+    for step in steps:
+        key = gatesets.canonical_hash(step[0])
+        if key not in table:
+            table.add(key)
+            unique.append(step)
+    return unique
+
+def result_record(structure, parameters, score, weight, time, nodes):
+    """Builds the dict yielded by Compiler.compile_iter for a new best result.
+
+    Args:
+        structure : The circuit structure of the result.
+        parameters : The parameters of the result.
+        score : The value of the objective for the result, or None if it isn't known.
+        weight : The weight of the result.
+        time : The number of seconds that the compilation has been running for.
+        nodes : The number of circuits that have been solved so far, or None if it isn't known.
+    """
+    return {"structure": structure, "parameters": parameters, "score": score, "weight": weight, "time": time, "nodes": nodes}
 
 class Compiler():
     """This class defines the pattern for compilers that convert a unitary matrix to a circuit that implements that matrix."""
@@ -24,6 +192,17 @@ class Compiler():
         raise NotImplementedError("Subclasses of Compiler are expected to implement the compile method.")
         return (U, None)
 
+    def compile_iter(self, options=Options()):
+        """Runs the compilation, yielding a dict made by result_record every time a new best result is found, so that the caller can use intermediate results or stop early.  Closing the generator stops the compilation and shuts down its Parallelizer.
+
+        The default implementation yields the result of compile once it finishes, so Compilers that can report intermediate results should override it.
+        """
+        starttime = timer()
+        result = self.compile(options)
+        options = self.options.updated(options)
+        score = options.objective.gen_eval_func(result["structure"], options)(result["parameters"]) if "objective" in options else None
+        yield result_record(result["structure"], result["parameters"], score, circuit_weight(result["structure"]), timer() - starttime, None)
+
 class SearchCompiler(Compiler):
     """This Compiler uses an A* search strategy to synthesize a unitary, as described in the paper Towards Optimal Topology Aware Quantum Circuit Synthesis.
 
@@ -32,11 +211,30 @@ class SearchCompiler(Compiler):
         gateset : The Gateset used for synthesis.
         weight_limit : A limit on the maximum weight for circuits to be expanded for further searching.  See gatesets.py for more information.  The default is None for unlimited.
         heuristic : A heuristic used to order the search tree.  See heuristics.py for more information.
+        parallel_heuristic : If True, the heuristic value of each node is computed by the Parallelizer's workers along with its eval_func value, instead of by the main process.  Set this to False for heuristics that depend on state in the main process.  The default is True.
         solver : A Solver used for optimizing the parameters in parameterized circuits generated by the search tree.
         parallelizer : A Parallelizer used for solving multiple parameterized circuits in parallel.
-        beams : The number of nodes to pop from the search tree at a time.  The default value of -1 will create enough branches to maximize utilization of your CPU.
+        beams : The number of nodes to pop from the search tree at a time.  The default value of -1 lets the beam_controller choose.
+        beam_controller : A BeamController class, which is constructed with the options and the branching factor, and decides how many nodes to pop from the search tree at a time.  The default, beam_controllers.AdaptiveBeams, adjusts the number from the solve times measured in each layer to keep the workers busy, unless beams is 1 or more.  beam_controllers.FixedBeams pops num_tasks // branching_factor nodes when beams is -1.  See beam_controllers.py for more information.
+        max_beams : The most nodes that AdaptiveBeams pops at a time.  The default of None allows up to twice as many as it takes to give every worker a successor.
+        beam_slack : Nodes popped at the same time by AdaptiveBeams can have heuristic values at most this much higher than the first one.  For the astar heuristic, 1.0 is the same as one more unit of weight.  None removes the limit.  The default is 1.0.
+        transposition_table : If True, successors that are equivalent to a circuit already in the search tree, because they only differ in the order of layers acting on disjoint qudits, are skipped instead of solved.  This changes which nodes are solved and the order they are visited in, so it can change the result.  The default is False.
+        max_queue_size : The maximum number of nodes to keep in the search queue.  When the queue grows larger, the nodes with the worst heuristic values are evicted, which trades optimality for a fixed memory footprint.  The default is None, for unlimited.
+        queue_spill_file : A path to a file where nodes evicted from the search queue are stored, so that they can be read back if the search gets to them.  This keeps exact search modes like djikstra exact while bounding memory usage.  The default is None, which discards evicted nodes.
+        async_search : If True, the search keeps num_tasks solves running at all times, pushing each result onto the search tree as soon as it finishes and expanding the next best node whenever a worker frees up, instead of waiting for every node popped in an iteration to finish.  In this mode beams is an upper limit on the number of nodes being expanded at once.  The default is False.
+        warm_start : If True, each child node is optimized starting from its parent's parameters, with the new layer's single-qudit gates set near the identity.  The default is False, which starts each child from random parameters.
+        warm_start_restarts : The number of additional random-start solves to run for each warm-started child, keeping whichever result is best.  The default is 0.
+        multifidelity_iterations : If set to a number, each child node is first evaluated with a cheap solve capped at this many iterations, which is used to rank it in the search queue.  A node only gets a full solve when it is popped from the queue, after which it is pushed back with its new value, or when its cheap solve already beats the best value found so far.  An iteration is one accepted step of the optimizer, as for the "max_iterations" feature of Solver.supported_features.  This is supported by LeastSquares_Jac_Solver, BFGS_Jac_Solver, and LockstepMultiStart_Solver, and by the other multistart solvers when their inner_solver supports it, but not by the native solvers from qsrs, so a warning is given and the option is ignored with other solvers.  The default is None, which gives every child a full solve.
+        solve_cutoff : If set to a number, the solve for a child node is aborted when its value is predicted to end more than solve_cutoff times the value of its parent, keeping the best parameters found so far.  The time this saves is logged at the end of the compilation.  This is supported by LeastSquares_Jac_Solver and BFGS_Jac_Solver, and by MultiStart_Solver and NaiveMultiStart_Solver when their inner_solver supports it, but not by the native solvers from qsrs, so a warning is logged and the option is ignored with other solvers.  LeapCompiler passes the parent's value to the solves of its sub-compilations in the same way, but LEAPReoptimizing_PostProcessor doesn't, so it has no effect there.  The default is None, which runs every solve to completion.
+        analytic_synthesis : If True, 1- and 2-qubit targets are synthesized analytically with the minimal number of CNOTs, instead of by searching, when the gateset is supported by analytic.synthesize, the objective is a MatrixDistanceObjective, and the result is within weight_limit.  The default is True.
+        result_store : A caches.ResultStore that is checked for a result for the target, compiled with the same gateset, threshold, and weight_limit, before searching, and that the result is written back to afterwards.  The default is None.
+        lower_bound : A function that returns a lower bound on the weight of any circuit that implements the target.  When it is above 0, the search starts from every circuit at that weight, built without solving the shallower circuits, because none of them can reach the target.  Each of these starting circuits gets a full solve when it is popped from the search queue, like a node from a multifidelity_iterations solve, which starts from the root's parameters if warm_start is set, and from random parameters otherwise.  See lower_bounds.py for more information.  The default is lower_bounds.entanglement_lower_bound.
+        max_seeds : The largest number of starting circuits created from the lower_bound.  If there would be more circuits at the lower bound, the search starts from the deepest weight that has at most this many.  The default is 256.
+        shared_bound : A portfolio.SharedBound shared with other compilers running at once.  New best results are reported to it, nodes that are not below the weight of the best solution it holds are not pushed onto the search queue, and the search stops when it is cancelled.  This is set by portfolio.PortfolioCompiler.  The default is None.
+        solve_cache : A caches.SolveCache that stores the parameters found by the solver, so that a circuit structure that was already solved for the same target, up to a global phase, with the same solver settings is not solved again.  The number of cache hits is logged at the end of the compilation.  The default is None, for no caching.
         objective : An Objective used for scoring the quality of a parameterization for both synthesis and search.
-        timeout : An uper limit on the amount of time the compiler will spend trying to synthesize a circuit.  The default is float('inf'), for unlimited.
+        timeout : An uper limit on the amount of time the compiler will spend trying to synthesize a circuit.  Solves that are still running when it runs out are stopped with the best parameters found so far, so the compiler returns shortly after, when the solver supports the "deadline" feature of Solver.supported_features.  Other solvers, such as the native solvers from qsrs, run those solves to completion, and a warning is given.  The default is float('inf'), for unlimited.
+        deadline : The time, as returned by time.time(), at which the compiler stops searching and returns the best result so far, in the same way as when the timeout runs out.  The earlier of the two is used.  The default is None, for no deadline.
         checkpoint : The compiler will use this Checkpoint to save intermediate state, and will resume from this Checkpoint if there was an existing state.
         logger : A qsearch.logging.Logger that will be used for logging the synthesis process.
 
@@ -53,6 +251,21 @@ class SearchCompiler(Compiler):
 
     def compile(self, options=Options()):
         """
+        Args:
+            options: See class level documentation for the options SearchCompiler uses
+
+        Returns:
+            dict : The best result, with its "structure" and "parameters".
+        """
+        for record in self.compile_iter(options):
+            pass
+        return {'structure': record['structure'], 'parameters': record['parameters']}
+
+    def compile_iter(self, options=Options()):
+        """Runs the compilation, yielding a dict made by result_record every time a new best result is found, with the "structure", "parameters", "score", "weight", the "time" elapsed, and the number of "nodes" solved.  The last record yielded is the result of the compilation.
+
+        The caller can stop consuming records at any time, and closing the generator shuts down the Parallelizer.
+
         Args:
             options: See class level documentation for the options SearchCompiler uses
         """
@@ -67,11 +280,26 @@ class SearchCompiler(Compiler):
 
         starttime = timer() #NOTE because all of this setup gets included in the total time, stopping and restarting the project may lead to time durations that are not representative of the runtime under normal conditions.
         h = options.heuristic
-        qudits = int(np.round(np.log(np.shape(U)[0])/np.log(options.gateset.d)))
+        qudits = utils.qudit_count(np.shape(U)[0], options.gateset.d)
 
         if options.gateset.d**qudits != np.shape(U)[0]:
             raise ValueError("The target matrix of size {} is not compatible with qudits of size {}.".format(np.shape(U)[0], self.options.gateset.d))
 
+        store = options.result_store
+        if store is not None:
+            stored = store.get(options.target, options)
+            if stored is not None:
+                logger.logprint("Found a result for this target in the result store.")
+                yield result_record(stored["structure"], stored["parameters"], options.objective.gen_eval_func(stored["structure"], options)(stored["parameters"]), circuit_weight(stored["structure"]), timer() - starttime, 0)
+                return
+
+        if options.analytic_synthesis:
+            result = analytic.synthesize_for(U, options)
+            if result is not None:
+                logger.logprint("Synthesized the target analytically with {} CNOTs.".format(len(result["structure"]._subgates) - 1))
+                yield result_record(result["structure"], result["parameters"], options.objective.gen_eval_func(result["structure"], options)(result["parameters"]), circuit_weight(result["structure"]), timer() - starttime, 0)
+                return
+
         I = gates.IdentityGate(d=options.gateset.d)
 
         initial_layer = options.gateset.initial_layer(qudits)
@@ -79,87 +307,223 @@ class SearchCompiler(Compiler):
         if branching_factor <= 0:
             logger.logprint("This gateset has no branching factor so only an initial optimization will be run.")
             root = initial_layer
-            result = options.solver.solve_for_unitary(options.backend.prepare_circuit(root, options), options)
-            return {"structure":root, "parameters":result[1]}
+            result, _ = cached_solve(root, options.backend.prepare_circuit(root, options), options)
+            yield result_record(root, result[1], options.objective.gen_eval_func(root, options)(result[1]), 0, timer() - starttime, 1)
+            return
 
+        # the deadline is set before the parallelizer is created, so that it is sent to the workers along with the rest of the options
+        deadline = compile_deadline(options)
+        options.deadline = deadline
+        check_solver_features(options)
         parallel = options.parallelizer(options)
         # TODO move these print statements somewhere like parallelizers possibly
         logger.logprint("There are {} processors available to Pool.".format(options.num_tasks))
         logger.logprint("The branching factor is {}.".format(branching_factor))
-        beams = int(options.beams)
-        if beams < 1 and branching_factor > 0:
-            beams = int(options.num_tasks // branching_factor)
-        if beams < 1:
-            beams = 1
+        controller = options.beam_controller(options, branching_factor)
+        beams = controller.beams
         if beams > 1:
             logger.logprint("The beam factor is {}.".format(beams))
 
         recovered_state = checkpoint.recover()
-        queue = []
+        queue = SearchQueue()
         best_weight = 0
         best_value = 0
         best_pair  = 0
         tiebreaker = 0
         rectime = 0
+        nodes = 0
         if recovered_state == None:
             if isinstance(initial_layer, ProductGate):
                 root = initial_layer
             else:
                 root = ProductGate(initial_layer)
             root = ProductGate(initial_layer)
-            result = options.solver.solve_for_unitary(options.backend.prepare_circuit(root, options), options)
+            result, _ = cached_solve(root, options.backend.prepare_circuit(root, options), options)
             best_value = options.objective.gen_eval_func(root, options)(result[1])
             best_pair = (root, result[1])
             logger.logprint("New best! {} at weight 0".format(best_value))
+            nodes += 1
+            record = result_record(*best_pair, best_value, 0, timer() - starttime, nodes)
             if weight_limit == 0:
-                return best_pair
+                parallel.done()
+                yield record
+                return
 
-            queue = [(h(*best_pair, 0, options), 0, best_value, -1, result[1], root)]
+            queue = SearchQueue([(h(*best_pair, 0, options), 0, best_value, -1, result[1], root)], max_size=options.max_queue_size, spill_file=options.queue_spill_file)
             #         heuristic      weight  distance tiebreaker parameters structure
             #             0            1      2         3         4        5
+            bound = options.lower_bound(U, options) if options.lower_bound is not None and best_value >= options.threshold else 0
+            if weight_limit is not None:
+                bound = min(bound, weight_limit)
+            if bound > 0:
+                seeds = seed_structures(root, options.gateset, bound, options.max_seeds)
+                logger.logprint("The target needs at least weight {}, so the search starts from {} circuits at weight {}.".format(bound, len(seeds), seeds[0][1]))
+                if seeds[0][1] > 0:
+                    queue.clear()
+                    for structure, weight in seeds:
+                        # seeds have not been solved yet, so they are marked as low fidelity to get a full solve when they are popped, and until then they are ordered by the root's value at their own weight, which leaves scoring them to the workers
+                        parameters = seed_parameters(root, result[1], structure) if options.warm_start else np.zeros(0)
+                        queue.push(h(*best_pair, weight, options), weight, best_value, tiebreaker, parameters, structure, LOW_FIDELITY)
+                        tiebreaker += 1
             checkpoint.save((options, queue, best_weight, best_value, best_pair, tiebreaker, timer()-starttime))
         else:
             options, queue, best_weight, best_value, best_pair, tiebreaker, rectime = recovered_state
+            options.deadline = deadline # the deadline saved in the checkpoint was for the previous run
             if options.load_error:
                 logger.logprint("Failed to recover state from checkpoint.  Resolve the issue or delete the checkpoint to finish the compilation.", 0)
                 raise options.load_error
+            if not isinstance(queue, SearchQueue):
+                queue = SearchQueue(queue, max_size=options.max_queue_size, spill_file=options.queue_spill_file) # checkpoints saved by older versions store the queue as a list
             logger.logprint("Recovered state with best result {} at weight {}".format(best_value, best_weight))
+            record = result_record(*best_pair, best_value, best_weight, rectime, nodes)
 
         options.generate_cache() # Cache the results of smart_default settings, such as the default solver, before entering the main loop where the options will get pickled and the smart_default functions called many times because later caching won't persist cause of pickeling and multiple processes.
+        transpositions = set(gatesets.canonical_hash(structure) for structure in queue.structures()) if options.transposition_table else None
+        solve_stats = SolveStatistics()
+        shared = options.shared_bound
         try:
-            while len(queue) > 0:
-                if timer() - starttime > options.timeout:
-                    break
-                if best_value < options.threshold:
-                    queue = []
-                    break
-                popped = []
-                for _ in range(0, beams):
-                    if len(queue) == 0:
+            yield record # the parallelizer is shut down by the finally block if the caller stops here
+            if options.async_search:
+                # keep num_tasks solves in flight, and expand the best node in the queue as soon as a worker frees up instead of waiting for a whole layer to finish
+                max_expanding = beams if int(options.beams) >= 1 else float('inf')
+                pending = deque() # successors that are waiting for a free worker
+                in_flight = dict() # maps each submitted Future to the tiebreaker of the node it is a successor of
+                expanding = dict() # maps the tiebreaker of each node being expanded to a list of [node, number of unfinished successors]
+                while len(queue) > 0 or len(pending) > 0 or len(in_flight) > 0:
+                    if timer() - starttime > options.timeout or deadline_passed(options):
+                        break
+                    if shared is not None and shared.cancelled:
+                        break
+                    if best_value < options.threshold:
+                        queue.clear()
+                        break
+                    while len(in_flight) < options.num_tasks:
+                        if len(pending) == 0:
+                            if len(queue) == 0 or len(expanding) >= max_expanding:
+                                break
+                            tup = queue.pop(with_fidelity=True)
+                            logger.logprint("Popped a node with score: {} at weight: {}".format((tup[2]), tup[1]), verbosity=2)
+                            if tup[6] == LOW_FIDELITY:
+                                # nodes from cheap solves get a full solve before they are expanded, and are pushed back onto the queue with their new value
+                                expanding[tup[3]] = [tup, 1]
+                                pending.append((tup[3], full_fidelity_step(tup[5], tup[1], 0, tup[4])))
+                                continue
+                            successors = drop_transpositions(options.gateset.successors(tup[5]), transpositions)
+                            if len(successors) == 0:
+                                continue
+                            expanding[tup[3]] = [tup, len(successors)]
+                            pending.extend((tup[3], successor_step(tup, successor, options)) for successor in successors)
+                        key, new_step = pending.popleft()
+                        in_flight[parallel.submit(new_step)] = key
+                    # the solves stop themselves at the deadline, so waiting past it only takes as long as the slowest one takes to notice
+                    finished, _ = wait(in_flight, timeout=None if deadline is None else max(0, deadline - time()), return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        key = in_flight.pop(future)
+                        step, result, current_weight, weight, current_value, score, stats = future.result()
+                        solve_stats.record(stats)
+                        nodes += 1
+                        new_weight = current_weight + weight
+                        promote = stats["fidelity"] == LOW_FIDELITY and current_value < best_value
+                        if (current_value < best_value and (best_value >= options.threshold or new_weight <= best_weight)) or (current_value < options.threshold and new_weight < best_weight):
+                            best_value = current_value
+                            best_pair = (step, result[1])
+                            best_weight = new_weight
+                            logger.logprint("New best! score: {} at weight: {}".format(best_value, new_weight))
+                            if shared is not None:
+                                shared.report(step, result[1], best_value, best_weight)
+                            yield result_record(step, result[1], best_value, best_weight, rectime+(timer()-starttime), nodes)
+                        if promote:
+                            # cheap solves that beat the best value so far get their full solve right away
+                            expanding[key][1] += 1
+                            pending.appendleft((key, full_fidelity_step(step, current_weight, weight, result[1])))
+                        elif (weight_limit is None or new_weight < weight_limit) and (shared is None or shared.allows(new_weight)):
+                            # solves stopped at the deadline are marked as low fidelity, so they get a full solve if the compilation is resumed from the checkpoint
+                            queue.push(score if score is not None else h(step, result[1], new_weight, options), new_weight, current_value, tiebreaker, result[1], step, LOW_FIDELITY if stats.get("expired") else stats["fidelity"])
+                            tiebreaker+=1
+                        expanding[key][1] -= 1
+                        if expanding[key][1] == 0:
+                            del expanding[key]
+                            # nodes that are still being expanded are saved as if they were never popped, so they get expanded again on recovery
+                            saved_queue = queue.copy()
+                            for entry in expanding.values():
+                                saved_queue.push(*entry[0], evict=False)
+                            checkpoint.save((options, saved_queue, best_weight, best_value, best_pair, tiebreaker, rectime+(timer()-starttime)))
+                            logger.logprint("The search queue holds {} nodes in {} bytes, and has evicted {} nodes".format(len(queue), queue.nbytes(), queue.evictions), verbosity=2)
+                for future in in_flight:
+                    future.cancel()
+            else:
+                while len(queue) > 0:
+                    if timer() - starttime > options.timeout or deadline_passed(options):
+                        break
+                    if shared is not None and shared.cancelled:
+                        break
+                    if best_value < options.threshold:
+                        queue.clear()
+                        break
+                    popped = []
+                    for _ in range(0, controller.beams):
+                        if len(queue) == 0 or (len(popped) > 0 and not controller.admits(popped[0][0], queue.min_heuristic())):
+                            break
+                        tup = queue.pop(with_fidelity=True)
+                        popped.append(tup)
+                        logger.logprint("Popped a node with score: {} at weight: {}".format((tup[2]), tup[1]), verbosity=2)
+
+                    then = timer()
+                    # nodes from cheap solves get a full solve before they are expanded, and are pushed back onto the queue with their new value
+                    new_steps = [full_fidelity_step(current_tup[5], current_tup[1], 0, current_tup[4]) for current_tup in popped if current_tup[6] == LOW_FIDELITY]
+                    new_steps += [successor_step(current_tup, successor, options) for current_tup in popped if current_tup[6] == FULL_FIDELITY for successor in drop_transpositions(options.gateset.successors(current_tup[5]), transpositions)]
+                    expired = False
+                    layer = parallelizers.LayerStatistics(options.num_tasks)
+                    while len(new_steps) > 0 and not expired:
+                        promoted = []
+                        for step, result, current_weight, weight, current_value, score, stats in layer.measure(parallel.solve_circuits_parallel(new_steps)):
+                            solve_stats.record(stats)
+                            nodes += 1
+                            new_weight = current_weight + weight
+                            promote = stats["fidelity"] == LOW_FIDELITY and current_value < best_value
+                            if (current_value < best_value and (best_value >= options.threshold or new_weight <= best_weight)) or (current_value < options.threshold and new_weight < best_weight):
+                                best_value = current_value
+                                best_pair = (step, result[1])
+                                best_weight = new_weight
+                                logger.logprint("New best! score: {} at weight: {}".format(best_value, new_weight))
+                                if shared is not None:
+                                    shared.report(step, result[1], best_value, best_weight)
+                                yield result_record(step, result[1], best_value, best_weight, rectime+(timer()-starttime), nodes)
+                            if promote:
+                                # cheap solves that beat the best value so far get their full solve right away
+                                promoted.append(full_fidelity_step(step, current_weight, weight, result[1]))
+                            elif (weight_limit is None or new_weight < weight_limit) and (shared is None or shared.allows(new_weight)):
+                                queue.push(score if score is not None else h(step, result[1], new_weight, options), new_weight, current_value, tiebreaker, result[1], step, LOW_FIDELITY if stats.get("expired") else stats["fidelity"])
+                                tiebreaker+=1
+                            if deadline_passed(options):
+                                # the rest of the layer is dropped, and the tasks that haven't started are cancelled when the parallelizer is done
+                                expired = True
+                                break
+                        new_steps = promoted
+                    if expired:
+                        # the popped nodes were not fully expanded, so they are saved as if they were never popped
+                        saved_queue = queue.copy()
+                        for tup in popped:
+                            saved_queue.push(*tup, evict=False)
+                        checkpoint.save((options, saved_queue, best_weight, best_value, best_pair, tiebreaker, rectime+(timer()-starttime)))
+                        logger.logprint("Stopped the search in the middle of a layer because the deadline passed.")
                         break
-                    tup = heapq.heappop(queue)
-                    popped.append(tup)
-                    logger.logprint("Popped a node with score: {} at weight: {}".format((tup[2]), tup[1]), verbosity=2)
-
-                then = timer()
-                new_steps = [(successor[0], current_tup[1], successor[1]) for current_tup in popped for successor in options.gateset.successors(current_tup[5])]
-                for step, result, current_weight, weight in parallel.solve_circuits_parallel(new_steps):
-                    current_value = options.objective.gen_eval_func(step, options)(result[1])
-                    new_weight = current_weight + weight
-                    if (current_value < best_value and (best_value >= options.threshold or new_weight <= best_weight)) or (current_value < options.threshold and new_weight < best_weight):
-                        best_value = current_value
-                        best_pair = (step, result[1])
-                        best_weight = new_weight
-                        logger.logprint("New best! score: {} at weight: {}".format(best_value, new_weight))
-                    if weight_limit is None or new_weight < weight_limit:
-                        heapq.heappush(queue, (h(step, result[1], new_weight, options), new_weight, current_value, tiebreaker, result[1], step))
-                        tiebreaker+=1
-                logger.logprint("Layer completed after {} seconds".format(timer() - then), verbosity=2)
-                checkpoint.save((options, queue, best_weight, best_value, best_pair, tiebreaker, rectime+(timer()-starttime)))
+                    layer.finish()
+                    controller.record_layer(layer, len(popped))
+                    logger.logprint("Layer completed after {} seconds, with the workers busy {:.0%} of the time".format(timer() - then, layer.utilization), verbosity=2)
+                    if controller.beams != len(popped) and len(queue) > 0:
+                        logger.logprint("Popping up to {} nodes in the next layer".format(controller.beams), verbosity=2)
+                    logger.logprint("The search queue holds {} nodes in {} bytes, and has evicted {} nodes".format(len(queue), queue.nbytes(), queue.evictions), verbosity=2)
+                    checkpoint.save((options, queue, best_weight, best_value, best_pair, tiebreaker, rectime+(timer()-starttime)))
         finally:
             parallel.done()
 
+        if queue.evictions > 0:
+            logger.logprint("Evicted {} nodes from the search queue, and read {} of them back from disk.".format(queue.evictions, queue.reloads))
+        queue.delete_spill_file()
+        solve_stats.log(logger)
         logger.logprint("Finished compilation at weight {} with score {} after {} seconds.".format(best_weight, best_value, rectime+(timer()-starttime)))
         parallel.done()
-        return {'structure': best_pair[0], 'parameters': best_pair[1]}
+        if store is not None:
+            store.put(options.target, {'structure': best_pair[0], 'parameters': best_pair[1]}, options)
 
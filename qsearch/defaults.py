@@ -9,7 +9,7 @@ Attributes:
     stateprep_defaults : A dictionary containing defaults for stateprep synthesis.
 """
 
-from . import utils, gatesets, solvers, backends, parallelizers, heuristics, logging, checkpoints, assemblers, comparison, objectives, compiler
+from . import utils, gatesets, solvers, backends, parallelizers, heuristics, logging, checkpoints, assemblers, comparison, objectives, compiler, lower_bounds, beam_controllers
 from functools import partial
 import numpy as np
 
@@ -90,9 +90,27 @@ standard_defaults = {
         "threshold":1e-10,
         "gateset":gatesets.Default(),
         "beams":-1,
+        "beam_controller":beam_controllers.AdaptiveBeams,
+        "max_beams":None,
+        "beam_slack":1.0,
+        "async_search":False,
+        "transposition_table":False,
+        "max_queue_size":None,
+        "queue_spill_file":None,
+        "warm_start":False,
+        "warm_start_restarts":0,
+        "solve_cutoff":None,
+        "multifidelity_iterations":None,
+        "solve_cache":None,
+        "result_store":None,
+        "analytic_synthesis":True,
+        "lower_bound":lower_bounds.entanglement_lower_bound,
+        "max_seeds":256,
+        "shared_bound":None,
         "delta": 0,
         "weight_limit":None,
         "search_type":"astar",
+        "parallel_heuristic":True,
         "statefile":None,
         "objective":objectives.MatrixDistanceObjective(),
         "backend":backends.SmartDefaultBackend(),
@@ -103,6 +121,7 @@ standard_defaults = {
         "write_location" : None,
         "unitary_preprocessor": utils.nearest_unitary,
         "timeout" : float('inf'),
+        "deadline" : None,
         "blas_threads" : None,
         "verbosity" : 1,
         "stdout_enabled" : True,
@@ -5,6 +5,7 @@ Through the use of KroneckerGate and ProductGate, Gates can be formed for comple
 """
 
 import numpy as np
+import threading
 from . import utils, unitaries
 from hashlib import md5
 
@@ -13,6 +14,29 @@ try:
 except ImportError:
     native_from_object = None
 
+def _monomial_form(U):
+    # if U has exactly one nonzero entry in each row and in each column, returns (p, c) such that row i has the entry c[i] in column p[i], and otherwise returns None
+    U = np.asarray(U)
+    p = np.argmax(np.abs(U), axis=1)
+    c = U[np.arange(U.shape[0]), p]
+    if np.count_nonzero(U) != U.shape[0] or np.count_nonzero(c) != U.shape[0] or len(np.unique(p)) != U.shape[0]:
+        return None
+    return (p, c)
+
+def _stack(rows, batch):
+    # builds an array of shape (batch, len(rows), len(rows[0])) from a nested list of entries, each of which is either a scalar or an array of shape (batch,)
+    out = np.empty((batch, len(rows), len(rows[0])), dtype='complex128')
+    for i, row in enumerate(rows):
+        for j, entry in enumerate(row):
+            out[:, i, j] = entry
+    return out
+
+def _rot_z_batch(theta):
+    return _stack([[np.exp(-1j*theta/2), 0], [0, np.exp(1j*theta/2)]], len(theta))
+
+def _rot_z_jac_batch(theta):
+    return _stack([[-1j/2*np.exp(-1j*theta/2), 0], [0, 1j/2*np.exp(1j*theta/2)]], len(theta))
+
 class Gate():
     """This class shows the framework for working with quantum gates in Qsearch."""
     def __init__(self):
@@ -54,6 +78,41 @@ class Gate():
             return (self.matrix(v), []) # A constant gate (one with no parameters) has no jacobian
         raise NotImplementedError("Subclasses of Gate are required to implement the mat_jac(v) method in order to be used with gradient optimizers.")
 
+    def matrix_batch(self, V):
+        """Generates matrices for many vectors of input parameters at once.
+
+        The default implementation calls matrix(v) for each row of V, and subclasses can override it with a vectorized version.
+
+        Args:
+            V : A numpy array of real floating point numbers with shape (B, self.num_inputs), where each row is a vector that could be passed to matrix(v).
+
+        Returns:
+            np.ndarray : An array of shape (B, D, D) with dtype="complex128", where entry i is equal to matrix(V[i]).
+        """
+        V = np.asarray(V, dtype='float64')
+        if self.num_inputs == 0:
+            return np.repeat(np.asarray(self.matrix([]), dtype='complex128')[np.newaxis], len(V), axis=0)
+        return np.array([self.matrix(v) for v in V], dtype='complex128').reshape((len(V), self.dimension, self.dimension))
+
+    def mat_jac_batch(self, V):
+        """Generates matrices and jacobians for many vectors of input parameters at once.
+
+        The default implementation calls mat_jac(v) for each row of V, and subclasses can override it with a vectorized version.
+
+        Args:
+            V : A numpy array of real floating point numbers with shape (B, self.num_inputs), where each row is a vector that could be passed to mat_jac(v).
+
+        Returns:
+            tuple : A tuple of an array of shape (B, D, D) equal to matrix_batch(V), and an array of shape (B, self.num_inputs, D, D), where entry [i, j] is the jacobian with respect to V[i, j].
+        """
+        V = np.asarray(V, dtype='float64')
+        if self.num_inputs == 0:
+            return (self.matrix_batch(V), np.zeros((len(V), 0, self.dimension, self.dimension), dtype='complex128'))
+        matjacs = [self.mat_jac(v) for v in V]
+        U = np.array([M for M, _ in matjacs], dtype='complex128').reshape((len(V), self.dimension, self.dimension))
+        J = np.array([Js for _, Js in matjacs], dtype='complex128').reshape((len(V), self.num_inputs, self.dimension, self.dimension))
+        return (U, J)
+
     def assemble(self, v, i=0):
         """Generates an array of tuples as an intermediate format before being processed by an Assembler for conversion to other circuit formats.
 
@@ -79,11 +138,66 @@ class Gate():
         """
         raise NotImplementedError("Subclasses of Gate are required to implement the assemble(v, i) method.")
 
+    @property
+    def structural_digest(self):
+        """An md5 digest of the structure of this gate, which is the same across Python sessions.  For most gates this is the digest of repr(self), computed once and then cached, while KroneckerGate and ProductGate build theirs from the digests of their subgates."""
+        digest = getattr(self, "_digest", None)
+        if digest is None:
+            digest = md5(repr(self).encode()).digest()
+            self._digest = digest
+        return digest
+
     def __eq__(self, other):
-        return repr(self) == repr(other)
+        if not isinstance(other, Gate):
+            return repr(self) == repr(other)
+        return self.structural_digest == other.structural_digest
 
     def __hash__(self):
-        return int(md5(repr(self).encode()).hexdigest(), 16) # using md5 rather than the default python has method ensures that hashes don't change when restarting python, which can be a problem if hashes are saved as part of intermediate states
+        return int.from_bytes(self.structural_digest, 'big') # using md5 rather than the default python has method ensures that hashes don't change when restarting python, which can be a problem if hashes are saved as part of intermediate states
+
+    @property
+    def dimension(self):
+        """The size of the unitary matrices generated by this gate, which is d**self.qudits.  This is computed once and then cached, and subclasses may set self._dimension in their initializer to avoid evaluating the matrix at all."""
+        dimension = getattr(self, "_dimension", None)
+        if dimension is None:
+            dimension = self.matrix(np.zeros(self.num_inputs)).shape[0]
+            self._dimension = dimension
+        return dimension
+
+    @property
+    def permutation(self):
+        """For a constant gate whose matrix is a permutation matrix, such as CNOTGate, an array p such that row i of the matrix has its 1 in column p[i].  This is None for every other gate.  It is computed once and then cached, and is used by EvaluationPlan to apply these gates by reordering rows instead of multiplying matrices."""
+        permutation = getattr(self, "_permutation", None)
+        if permutation is None:
+            permutation = False
+            if self.num_inputs == 0:
+                form = _monomial_form(self.matrix([]))
+                if form is not None and np.all(form[1] == 1):
+                    permutation = form[0]
+            self._permutation = permutation
+        return None if permutation is False else permutation
+
+    @property
+    def is_diagonal(self):
+        """Whether the matrix generated by this gate is diagonal for every vector of parameters, as it is for CZGate and ZGate.  This is checked from the matrix for constant gates, while parameterized gates with diagonal matrices set self._diagonal to True in their initializer.  It is used by EvaluationPlan to apply these gates by scaling rows instead of multiplying matrices."""
+        diagonal = getattr(self, "_diagonal", None)
+        if diagonal is None:
+            diagonal = False
+            if self.num_inputs == 0:
+                form = _monomial_form(self.matrix([]))
+                diagonal = form is not None and np.array_equal(form[0], np.arange(len(form[0])))
+            self._diagonal = diagonal
+        return diagonal
+
+    @property
+    def layers(self):
+        """A tuple of the gates that this gate is composed of.  For gates other than KroneckerGate and ProductGate, this is a tuple containing just the gate itself."""
+        return (self,)
+
+    @property
+    def parameter_offsets(self):
+        """A tuple of the indices into the parameter vector where the parameters for each entry in layers start, followed by num_inputs, so that the parameters of layers[i] are v[parameter_offsets[i]:parameter_offsets[i+1]]."""
+        return (0, self.num_inputs)
 
     def copy(self):
         return self
@@ -114,6 +228,7 @@ class IdentityGate(Gate):
         self.num_inputs=0
         self._I = np.array(np.eye(d**qudits), dtype='complex128')
         self.qudits = qudits
+        self._dimension = d**qudits
         self._d = d
 
     def matrix(self, v):
@@ -143,6 +258,20 @@ class XGate(Gate):
         J1 = unitaries.rot_x_jac(v[0])
         return U, [J1]
 
+    def matrix_batch(self, V):
+        theta = np.asarray(V, dtype='float64')[:, 0]
+        c = np.cos(theta/2)
+        s = np.sin(theta/2)
+        return _stack([[c, -1j*s], [-1j*s, c]], len(theta))
+
+    def mat_jac_batch(self, V):
+        theta = np.asarray(V, dtype='float64')[:, 0]
+        c = np.cos(theta/2)
+        s = np.sin(theta/2)
+        U = _stack([[c, -1j*s], [-1j*s, c]], len(theta))
+        J1 = _stack([[-1/2*s, -1j/2*c], [-1j/2*c, -1/2*s]], len(theta))
+        return (U, J1[:, np.newaxis])
+
     def assemble(self, v, i=0):
         return [("gate", "X", (v[0],), (i,))]
 
@@ -163,6 +292,20 @@ class YGate(Gate):
         J1 = unitaries.rot_y_jac(v[0])
         return U, [J1]
 
+    def matrix_batch(self, V):
+        theta = np.asarray(V, dtype='float64')[:, 0]
+        c = np.cos(theta/2)
+        s = np.sin(theta/2)
+        return _stack([[c, -s], [s, c]], len(theta))
+
+    def mat_jac_batch(self, V):
+        theta = np.asarray(V, dtype='float64')[:, 0]
+        c = np.cos(theta/2)
+        s = np.sin(theta/2)
+        U = _stack([[c, -s], [s, c]], len(theta))
+        J1 = _stack([[-1/2*s, -1/2*c], [1/2*c, -1/2*s]], len(theta))
+        return (U, J1[:, np.newaxis])
+
     def assemble(self, v, i=0):
         return [("gate", "Y", (v[0],), (i,))]
 
@@ -174,6 +317,7 @@ class ZGate(Gate):
     def __init__(self):
         self.num_inputs = 1
         self.qudits = 1
+        self._diagonal = True
 
     def matrix(self, v):
         return unitaries.rot_z(v[0])
@@ -183,6 +327,13 @@ class ZGate(Gate):
         J1 = unitaries.rot_z_jac(v[0])
         return U, [J1]
 
+    def matrix_batch(self, V):
+        return _rot_z_batch(np.asarray(V, dtype='float64')[:, 0])
+
+    def mat_jac_batch(self, V):
+        theta = np.asarray(V, dtype='float64')[:, 0]
+        return (_rot_z_batch(theta), _rot_z_jac_batch(theta)[:, np.newaxis])
+
     def assemble(self, v, i=0):
         return [("gate", "Z", (v[0],), (i,))]
 
@@ -254,6 +405,21 @@ class ZXZXZGate(Gate):
         U = np.dot(self._rot_z, self._out)
         return (U, [J1, J2, J3])
 
+    def matrix_batch(self, V):
+        V = np.asarray(V, dtype='float64')
+        U = np.matmul(self._x90, _rot_z_batch(V[:, 0]))
+        U = np.matmul(self._x90, np.matmul(_rot_z_batch(V[:, 1]), U))
+        return np.matmul(_rot_z_batch(V[:, 2]), U)
+
+    def mat_jac_batch(self, V):
+        V = np.asarray(V, dtype='float64')
+        Z = [_rot_z_batch(V[:, i]) for i in range(3)]
+        dZ = [_rot_z_jac_batch(V[:, i]) for i in range(3)]
+        def product(Z0, Z1, Z2):
+            return np.matmul(Z2, np.matmul(self._x90, np.matmul(Z1, np.matmul(self._x90, Z0))))
+        J = np.stack([product(dZ[0], Z[1], Z[2]), product(Z[0], dZ[1], Z[2]), product(Z[0], Z[1], dZ[2])], axis=1)
+        return (product(*Z), J)
+
     def assemble(self, v, i=0):
         out = []
         v = np.array(v)%(2*np.pi) # confine the range of what we print to come up with nicer numbers at no loss of generality
@@ -303,6 +469,20 @@ class XZXZGate(Gate):
         U = np.dot(self._rot_z, self._out)
         return (U, [J1, J2])
 
+    def matrix_batch(self, V):
+        V = np.asarray(V, dtype='float64')
+        U = np.matmul(self._x90, np.matmul(_rot_z_batch(V[:, 0]), self._x90))
+        return np.matmul(_rot_z_batch(V[:, 1]), U)
+
+    def mat_jac_batch(self, V):
+        V = np.asarray(V, dtype='float64')
+        Z0 = _rot_z_batch(V[:, 0])
+        Z1 = _rot_z_batch(V[:, 1])
+        inner = np.matmul(self._x90, np.matmul(Z0, self._x90))
+        J1 = np.matmul(Z1, np.matmul(self._x90, np.matmul(_rot_z_jac_batch(V[:, 0]), self._x90)))
+        J2 = np.matmul(_rot_z_jac_batch(V[:, 1]), inner)
+        return (np.matmul(Z1, inner), np.stack([J1, J2], axis=1))
+
     def assemble(self, v, i=0):
         out = []
         v = np.array(v)%(2*np.pi) # confine the range of what we print to come up with nicer numbers at no loss of generality
@@ -345,6 +525,26 @@ class U3Gate(Gate):
         J3 = np.array([[0, -st *(-sl + 1j * cl)], [0, ct *(-sl * cp - cl * sp + 1j * -sl * sp + 1j * cl * cp)]], dtype='complex128')
         return (U, [J1, J2, J3])
 
+    def matrix_batch(self, V):
+        V = np.asarray(V, dtype='float64')
+        ct = np.cos(V[:, 0]/2)
+        st = np.sin(V[:, 0]/2)
+        ep = np.exp(1j * V[:, 1])
+        el = np.exp(1j * V[:, 2])
+        return _stack([[ct, -st * el], [st * ep, ct * ep * el]], len(V))
+
+    def mat_jac_batch(self, V):
+        V = np.asarray(V, dtype='float64')
+        ct = np.cos(V[:, 0]/2)
+        st = np.sin(V[:, 0]/2)
+        ep = np.exp(1j * V[:, 1])
+        el = np.exp(1j * V[:, 2])
+        U = _stack([[ct, -st * el], [st * ep, ct * ep * el]], len(V))
+        J1 = _stack([[-0.5*st, -0.5*ct * el], [0.5*ct * ep, -0.5*st * ep * el]], len(V))
+        J2 = _stack([[0, 0], [1j * st * ep, 1j * ct * ep * el]], len(V))
+        J3 = _stack([[0, -1j * st * el], [0, 1j * ct * ep * el]], len(V))
+        return (U, np.stack([J1, J2, J3], axis=1))
+
     def assemble(self, v, i=0):
         v = np.array(v)%(2*np.pi) # confine the range to nice numbers
         return [("gate", "U3", (v[0], v[1], v[2]), (i,))]
@@ -374,6 +574,21 @@ class U2Gate(Gate):
         J2 = initial * np.array([[0, -1j * e1], [0, 1j * e3]])
         return (U, [J1, J2])
 
+    def matrix_batch(self, V):
+        V = np.asarray(V, dtype='float64')
+        return 1/np.sqrt(2) * _stack([[1, -np.exp(1j * V[:, 1])], [np.exp(1j * V[:, 0]), np.exp(1j * (V[:, 0] + V[:, 1]))]], len(V))
+
+    def mat_jac_batch(self, V):
+        V = np.asarray(V, dtype='float64')
+        initial = 1/np.sqrt(2)
+        e1 = np.exp(1j * V[:, 1])
+        e2 = np.exp(1j * V[:, 0])
+        e3 = np.exp(1j * (V[:, 0] + V[:, 1]))
+        U = initial * _stack([[1, -e1], [e2, e3]], len(V))
+        J1 = initial * _stack([[0, 0], [1j * e2, 1j * e3]], len(V))
+        J2 = initial * _stack([[0, -1j * e1], [0, 1j * e3]], len(V))
+        return (U, np.stack([J1, J2], axis=1))
+
     def assemble(self, v, i=0):
         v = np.array(v)%(2*np.pi) # confine the range to nice numbers
         return [("gate", "U3", (np.pi/2, v[0], v[1]), (i,))]
@@ -389,6 +604,7 @@ class U1Gate(Gate):
     def __init__(self):
         self.num_inputs = 1
         self.qudits = 1
+        self._diagonal = True
 
     def matrix(self, v):
         return np.exp(1j*v[0]/2) * unitaries.rot_z(v[0])
@@ -398,6 +614,16 @@ class U1Gate(Gate):
         J1 = 1j/2 * np.exp(1j*v[0]/2) * unitaries.rot_z(v[0]) + np.exp(1j*v[0]/2) * unitaries.rot_z_jac(v[0])
         return (U, [J1])
 
+    def matrix_batch(self, V):
+        theta = np.asarray(V, dtype='float64')[:, 0]
+        return _stack([[1, 0], [0, np.exp(1j*theta)]], len(theta))
+
+    def mat_jac_batch(self, V):
+        theta = np.asarray(V, dtype='float64')[:, 0]
+        U = _stack([[1, 0], [0, np.exp(1j*theta)]], len(theta))
+        J1 = _stack([[0, 0], [0, 1j*np.exp(1j*theta)]], len(theta))
+        return (U, J1[:, np.newaxis])
+
     def assemble(self, v, i=0):
         v = np.array(v)%(2*np.pi) # confine the range to nice numbers
         return [("gate", "U3", (0, 0, v[0]), (i,))]
@@ -414,9 +640,9 @@ class SingleQutritGate(Gate):
         self.num_inputs = 8
         self.qudits = 1
 
-    def matrix(self, v):
-        # for reference see the original implementation, qt_arb_rot in utils.py, which is now deprecated
-        # this was re-written to be computationally more efficient and more readable
+    def _factors(self, v):
+        # the sines, cosines, and phases that the matrix and its jacobians are built from
+        # v can be a single vector of parameters, or the transpose of a batch of them, in which case each factor is an array
         s1 = np.sin(v[0])
         c1 = np.cos(v[0])
         s2 = np.sin(v[1])
@@ -435,86 +661,84 @@ class SingleQutritGate(Gate):
         p5 = np.exp(1j * v[7])
         m5 = np.exp(-1j * v[7])
 
-        return np.array([
-            [c1*c2*p1, s1*p3, c1*s2*p4],
-            [s2*s3*m4*m5 - s1*c2*c3*p1*p2*m3, c1*c3*p2, -c2*s3*m1*m5 - s1*s2*c3*p2*m3*p4],
-            [-s1*c2*s3*p1*m3*p5 - s2*c3*m2*m4, c1*s3*p5, c2*c3*m1*m2 - s1*s2*s3*m3*p4*p5]
-            ], dtype = 'complex128')
-
-    def mat_jac(self, v):
-        s1 = np.sin(v[0])
-        c1 = np.cos(v[0])
-        s2 = np.sin(v[1])
-        c2 = np.cos(v[1])
-        s3 = np.sin(v[2])
-        c3 = np.cos(v[2])
-        
-        p1 = np.exp(1j * v[3])
-        m1 = np.exp(-1j * v[3])
-        p2 = np.exp(1j * v[4])
-        m2 = np.exp(-1j * v[4])
-        p3 = np.exp(1j * v[5])
-        m3 = np.exp(-1j * v[5])
-        p4 = np.exp(1j * v[6])
-        m4 = np.exp(-1j * v[6])
-        p5 = np.exp(1j * v[7])
-        m5 = np.exp(-1j * v[7])
+        return (s1, c1, s2, c2, s3, c3, p1, m1, p2, m2, p3, m3, p4, m4, p5, m5)
 
-        U = np.array([
+    def _rows(self, v):
+        # for reference see the original implementation, qt_arb_rot in utils.py, which is now deprecated
+        # this was re-written to be computationally more efficient and more readable
+        s1, c1, s2, c2, s3, c3, p1, m1, p2, m2, p3, m3, p4, m4, p5, m5 = self._factors(v)
+        return [
             [c1*c2*p1, s1*p3, c1*s2*p4],
             [s2*s3*m4*m5 - s1*c2*c3*p1*p2*m3, c1*c3*p2, -c2*s3*m1*m5 - s1*s2*c3*p2*m3*p4],
             [-s1*c2*s3*p1*m3*p5 - s2*c3*m2*m4, c1*s3*p5, c2*c3*m1*m2 - s1*s2*s3*m3*p4*p5]
-            ], dtype = 'complex128')
+            ]
+
+    def _jac_rows(self, v):
+        s1, c1, s2, c2, s3, c3, p1, m1, p2, m2, p3, m3, p4, m4, p5, m5 = self._factors(v)
 
-        Jt1 = np.array([
+        Jt1 = [
             [-s1*c2*p1, c1*p3, -s1*s2*p4],
             [-c1*c2*c3*p1*p2*m3, -s1*c3*p2, -c1*s2*c3*p2*m3*p4],
             [-c1*c2*s3*p1*m3*p5, -s1*s3*p5, -c1*s2*s3*m3*p4*p5]
-            ], dtype = 'complex128')
+            ]
 
-        Jt2 = np.array([
+        Jt2 = [
             [-c1*s2*p1, 0, c1*c2*p4],
             [c2*s3*m4*m5 + s1*s2*c3*p1*p2*m3, 0, s2*s3*m1*m5 - s1*c2*c3*p2*m3*p4],
             [s1*s2*s3*p1*m3*p5 -c2*c3*m2*m4, 0, -s2*c3*m1*m2 - s1*c2*s3*m3*p4*p5]
-            ], dtype = 'complex128')
+            ]
 
-        Jt3 = np.array([
+        Jt3 = [
             [0, 0, 0],
             [s2*c3*m4*m5 + s1*c2*s3*p1*p2*m3, -c1*s3*p2, -c2*c3*m1*m5 + s1*s2*s3*p2*m3*p4],
             [-s1*c2*c3*p1*m3*p5 + s2*s3*m2*m4, c1*c3*p5, -c2*s3*m1*m2 - s1*s2*c3*m3*p4*p5]
-            ], dtype = 'complex128')
+            ]
 
-        Je1 = np.array([
+        Je1 = [
             [1j*c1*c2*p1, 0, 0],
             [-1j*s1*c2*c3*p1*p2*m3, 0, 1j*c2*s3*m1*m5],
             [-1j*s1*c2*s3*p1*m3*p5, 0, -1j*c2*c3*m1*m2]
-            ], dtype = 'complex128')
+            ]
 
-        Je2 = np.array([
+        Je2 = [
             [0, 0, 0],
             [-1j*s1*c2*c3*p1*p2*m3, 1j*c1*c3*p2, -1j*s1*s2*c3*p2*m3*p4],
             [1j*s2*c3*m2*m4, 0, -1j*c2*c3*m1*m2]
-            ], dtype = 'complex128')
+            ]
 
-        Je3 = np.array([
+        Je3 = [
             [0, 1j*s1*p3, 0],
             [1j*s1*c2*c3*p1*p2*m3, 0, 1j*s1*s2*c3*p2*m3*p4],
             [1j*s1*c2*s3*p1*m3*p5, 0, 1j*s1*s2*s3*m3*p4*p5]
-            ], dtype = 'complex128')
+            ]
 
-        Je4 = np.array([
+        Je4 = [
             [0, 0, 1j*c1*s2*p4],
             [-1j*s2*s3*m4*m5, 0, -1j*s1*s2*c3*p2*m3*p4],
             [1j*s2*c3*m2*m4, 0, -1j*s1*s2*s3*m3*p4*p5]
-            ], dtype = 'complex128')
+            ]
 
-        Je5 = np.array([
+        Je5 = [
             [0, 0, 0],
             [-1j*s2*s3*m4*m5, 0, 1j*c2*s3*m1*m5],
             [-1j*s1*c2*s3*p1*m3*p5, 1j*c1*s3*p5, -1j*s1*s2*s3*m3*p4*p5]
-            ], dtype = 'complex128')
+            ]
 
-        return (U, [Jt1, Jt2, Jt3, Je1, Je2, Je3, Je4, Je5])
+        return [Jt1, Jt2, Jt3, Je1, Je2, Je3, Je4, Je5]
+
+    def matrix(self, v):
+        return np.array(self._rows(v), dtype = 'complex128')
+
+    def mat_jac(self, v):
+        return (np.array(self._rows(v), dtype = 'complex128'), [np.array(rows, dtype = 'complex128') for rows in self._jac_rows(v)])
+
+    def matrix_batch(self, V):
+        V = np.asarray(V, dtype='float64')
+        return _stack(self._rows(V.T), len(V))
+
+    def mat_jac_batch(self, V):
+        V = np.asarray(V, dtype='float64')
+        return (_stack(self._rows(V.T), len(V)), np.stack([_stack(rows, len(V)) for rows in self._jac_rows(V.T)], axis=1))
 
     def assemble(self, v, i=0):
         return [("gate", "QUTRIT", (*v,), (i,))]
@@ -817,11 +1041,11 @@ class CUGate(Gate):
     def assemble(self, v, i=0):
         gatename = self.gatename
         gateparams = self.gateparams
-        indices = (i, i+1) if not flipped else (i+1, i)
+        indices = (i, i+1) if not self.flipped else (i+1, i)
         return [("gate", gatename, gateparams, indices)]
 
     def __repr__(self):
-        return "CUGate(" + str(repr(self._U)) + ("" if self.name is None else ", name={}".format(repr(self.name))) + ("flipped=True" if self.flipped else "") + ")"
+        return "CUGate(" + str(repr(self._U)) + ("" if self.gatename is None else ", gatename={}".format(repr(self.gatename))) + (", flipped=True" if self.flipped else "") + ")"
 
 class CNOTRootGate(Gate):
     """Represents the sqrt(CNOT) gate.  Two sqrt(CNOT) gates in a row will form a CNOT gate."""
@@ -842,6 +1066,271 @@ class CNOTRootGate(Gate):
     def __repr__(self):
         return "CNOTRootGate()"
 
+def _composite_structure(gate):
+    # computes the structural metadata of a KroneckerGate or ProductGate, which is cached until its list of subgates is replaced
+    # the cache holds [subgates, layers, parameter offsets, dimension, digest, md5 state, evaluation plan], where the last four are filled in when they are first needed
+    cache = getattr(gate, "_structure_cache", None)
+    if cache is None or cache[0] is not gate._subgates:
+        offsets = [0]
+        for subgate in gate._subgates:
+            offsets.append(offsets[-1] + subgate.num_inputs)
+        cache = [gate._subgates, tuple(gate._subgates), tuple(offsets), None, None, None, None]
+        gate._structure_cache = cache
+    return cache
+
+def _composite_digest_state(gate):
+    # returns the md5 state after hashing the type of gate and the digests of all its subgates, so that gates formed by appending to it can continue from there
+    cache = _composite_structure(gate)
+    if cache[5] is None:
+        hasher = md5(type(gate).__name__.encode())
+        for subgate in gate._subgates:
+            hasher.update(subgate.structural_digest)
+        cache[4] = hasher.digest()
+        cache[5] = hasher
+    return cache[5]
+
+def _set_composite_digest(gate, hasher):
+    cache = _composite_structure(gate)
+    cache[4] = hasher.digest()
+    cache[5] = hasher
+
+def _evaluation_plan(gate):
+    # returns the EvaluationPlan for a KroneckerGate or ProductGate, or None if the gate can't be flattened into one
+    cache = _composite_structure(gate)
+    if cache[6] is None:
+        try:
+            cache[6] = EvaluationPlan(gate)
+        except ValueError:
+            cache[6] = False # remember the failure so that the gate falls back to walking its subgates without trying again
+    return cache[6] or None
+
+class _PlanOp():
+    """A single step of an EvaluationPlan, which applies one gate to a contiguous range of qudits."""
+    def __init__(self, gate, left, size, right, start):
+        self.gate = gate
+        self.left = left # the product of the dimensions of the qudits before the ones this op acts on
+        self.size = size # the dimension of the gate's own unitary
+        self.right = right # the product of the dimensions of the qudits after the ones this op acts on
+        self.start = start
+        self.stop = start + gate.num_inputs
+        # kind is "dense", "diagonal" or "permutation", and decides whether the matrices of this op are held as full matrices, as their diagonals, or as an array of row indices
+        self.kind = "diagonal" if gate.is_diagonal else "dense"
+        self.phases = None # for permutation ops, the nonzero entries of the matrix if they are not all 1
+        self.constant = None
+        if gate.num_inputs == 0:
+            U = np.ascontiguousarray(gate.matrix([]), dtype='complex128')
+            form = _monomial_form(U)
+            if gate.permutation is not None:
+                self.kind = "permutation"
+                self.constant = gate.permutation
+            elif form is not None and self.kind != "diagonal":
+                # gates like CPIPhaseGate are a permutation followed by phases, and are applied as a permutation with a diagonal scaling
+                self.kind = "permutation"
+                self.constant, self.phases = form
+            else:
+                self.constant = self.local(U)
+
+    def local(self, M, batched=False):
+        """Returns M, which is a matrix or a jacobian generated by this op's gate, in the form used by this op's kind.  If batched is True, M is a stack of matrices from matrix_batch or mat_jac_batch, and the result has an extra axis so that it broadcasts against the batch of unitaries that it is applied to."""
+        if self.kind == "diagonal":
+            M = np.diagonal(M, axis1=-2, axis2=-1)
+        return M[:, np.newaxis] if batched else M
+
+class EvaluationPlan():
+    """A circuit built from KroneckerGates and ProductGates, flattened into a linear list of ops.
+
+    Each op records which qudits its gate acts on, the slice of the parameter vector that it takes, and its matrix if it is constant, so that matrix and mat_jac can be evaluated in a single loop over preallocated buffers instead of walking the tree of subgates.  IdentityGates are dropped entirely.
+
+    Ops are applied to the accumulated unitary by contracting their matrix with only the axes of the qudits they act on, so a gate on k qudits of a circuit with dimension D costs O(d**k * D**2) rather than the O(D**3) of multiplying by its full Kronecker product.  Constant gates with a permutation matrix, such as CNOTGate, are applied by reordering rows instead, which costs O(D**2) and needs no arithmetic, and diagonal gates such as CZGate and ZGate are applied by scaling rows, which is also O(D**2).  This makes matrix cost O(D**2) times the sum of d**k over the ops.
+
+    The jacobian for a parameter of an op is the product of the ops after it, the derivative of the op, and the ops before it.  The derivative is applied to the product of the ops before it in the same way, but the product of the ops after it is a dense matrix, so the two are multiplied in O(D**3), unless the ops after it can be applied one at a time for less, which is the case for parameters near the end of the circuit.  mat_jac therefore costs O(D**2 * min(D, c)) for each parameter, where c is the sum of d**k over the ops after it, with permutation and diagonal ops counted as 1.
+
+    Plans are built by KroneckerGate and ProductGate the first time they are evaluated, and are not pickled.  A ValueError is raised for circuits that can't be flattened, such as ones that act on qudits of inconsistent sizes.
+    """
+    def __init__(self, gate):
+        self.num_inputs = gate.num_inputs
+        self.qudits = gate.qudits
+        self.dims = [None] * gate.qudits
+        placed = []
+        self._flatten(gate, 0, 0, placed)
+        if None in self.dims:
+            raise ValueError("Every qudit of the circuit must be acted on by some gate.")
+        self.dimension = int(np.prod(self.dims))
+        self.ops = [_PlanOp(subgate, int(np.prod(self.dims[:qudit])), subgate.dimension, int(np.prod(self.dims[qudit+subgate.qudits:])), index) for subgate, qudit, index in placed]
+        # the cost of applying all of the ops after each op one at a time, in units of D**2, which mat_jac compares against the D of a dense product
+        self.after_costs = []
+        cost = 0
+        for op in reversed(self.ops):
+            self.after_costs.append(cost)
+            cost += op.size if op.kind == "dense" else 1
+        self.after_costs.reverse()
+        self._local = threading.local()
+
+    def _flatten(self, gate, qudit, index, placed):
+        # appends (gate, first qudit, first parameter index) for each of the leaf gates of gate in the order that they are applied
+        if isinstance(gate, KroneckerGate):
+            for subgate in gate._subgates:
+                self._flatten(subgate, qudit, index, placed)
+                qudit += subgate.qudits
+                index += subgate.num_inputs
+            return
+        if isinstance(gate, ProductGate):
+            if len(gate._subgates) == 0:
+                raise ValueError("Can't flatten an empty ProductGate.")
+            for subgate in gate._subgates:
+                if subgate.qudits != gate.qudits:
+                    raise ValueError("ProductGate had a size mismatch: expected {} but got {}".format(gate.qudits, subgate.qudits))
+                self._flatten(subgate, qudit, index, placed)
+                index += subgate.num_inputs
+            return
+        if gate.qudits < 1 or qudit + gate.qudits > len(self.dims):
+            raise ValueError("{} does not fit in the circuit.".format(repr(gate)))
+        dimension = gate.dimension
+        d = int(round(dimension ** (1 / gate.qudits)))
+        if d ** gate.qudits != dimension:
+            raise ValueError("{} has a matrix of size {}, which is not a power of {} qudits.".format(repr(gate), dimension, gate.qudits))
+        for i in range(qudit, qudit + gate.qudits):
+            if self.dims[i] is None:
+                self.dims[i] = d
+            elif self.dims[i] != d:
+                raise ValueError("Qudit {} is used with sizes {} and {}.".format(i, self.dims[i], d))
+        if not isinstance(gate, IdentityGate):
+            placed.append((gate, qudit, index))
+
+    def _buffers(self):
+        # the buffers are kept per thread so that a plan can be shared by solvers running in separate threads
+        buffers = getattr(self._local, "buffers", None)
+        if buffers is None:
+            buffers = [np.empty((self.dimension, self.dimension), dtype='complex128') for _ in range(5)]
+            self._local.buffers = buffers
+        return buffers
+
+    def _apply(self, op, M, X, out):
+        # computes op applied after X, meaning (I x M x I) @ X, and writes it to out
+        # X and out may also be stacks of matrices, with M from op.local(..., batched=True)
+        # rather than expanding M to the full dimension, the rows of X are viewed as a tensor with one axis for the qudits that op acts on, and M is contracted with just that axis
+        shape = X.shape[:-2] + (op.left, op.size, op.right * self.dimension)
+        X = X.reshape(shape)
+        view = out.reshape(shape)
+        if op.kind == "permutation":
+            np.take(X, M, axis=-2, out=view) # permutation gates only reorder rows, which needs no arithmetic
+            if op.phases is not None:
+                view *= op.phases[:, np.newaxis]
+        elif op.kind == "diagonal":
+            np.multiply(X, M[..., np.newaxis], out=view) # diagonal gates only scale rows
+        else:
+            np.matmul(M, X, out=view)
+        return out
+
+    def _unapply(self, op, M, X, out):
+        # computes X with op removed from its end, meaning X @ (I x M x I)^dagger, and writes it to out
+        # this contracts the columns of X in the same way, where multiplying by M^dagger on the right is the same as multiplying by conj(M) on the left of the transposed axis
+        shape = X.shape[:-2] + (self.dimension * op.left, op.size, op.right)
+        X = X.reshape(shape)
+        view = out.reshape(shape)
+        if op.kind == "permutation":
+            np.take(X, M, axis=-2, out=view)
+            if op.phases is not None:
+                view *= op.phases.conjugate()[:, np.newaxis]
+        elif op.kind == "diagonal":
+            np.multiply(X, M.conjugate()[..., np.newaxis], out=view)
+        else:
+            np.matmul(M.conjugate(), X, out=view)
+        return out
+
+    def _apply_after(self, index, matjacs, X, scratch):
+        # applies each of the ops after self.ops[index] to X, with the matrices from matjacs, and returns the result, which is either X or scratch
+        for op, (M, _) in zip(self.ops[index+1:], matjacs[index+1:]):
+            scratch = self._apply(op, M, X, scratch)
+            X, scratch = scratch, X
+        return X
+
+    def matrix(self, v):
+        """Returns the same matrix as the gate this plan was built from."""
+        U, scratch, _, _, _ = self._buffers()
+        U[:] = 0
+        np.fill_diagonal(U, 1)
+        for op in self.ops:
+            M = op.constant if op.constant is not None else op.local(op.gate.matrix(v[op.start:op.stop]))
+            scratch = self._apply(op, M, U, scratch)
+            U, scratch = scratch, U
+        return U.copy()
+
+    def mat_jac(self, v):
+        """Returns the same matrix and jacobians as the gate this plan was built from."""
+        A, A2, B, B2, T = self._buffers()
+        matjacs = []
+        for op in self.ops:
+            if op.constant is not None:
+                matjacs.append((op.constant, []))
+            else:
+                M, Js = op.gate.mat_jac(v[op.start:op.stop])
+                matjacs.append((op.local(M), [op.local(J) for J in Js]))
+        A[:] = 0
+        np.fill_diagonal(A, 1)
+        B[:] = A
+        for op, (M, _) in zip(self.ops, matjacs):
+            A2 = self._apply(op, M, A, A2)
+            A, A2 = A2, A
+        # sweep through the ops, keeping the product of the ops before the current one in B and the product of the ones after it in A
+        jacs = []
+        for index, (op, (M, Js)) in enumerate(zip(self.ops, matjacs)):
+            A2 = self._unapply(op, M, A, A2)
+            A, A2 = A2, A
+            for J in Js:
+                if self.after_costs[index] < self.dimension:
+                    jac = self._apply_after(index, matjacs, self._apply(op, J, B, np.empty_like(B)), T)
+                    jacs.append(jac.copy() if jac is T else jac)
+                else:
+                    jacs.append(np.matmul(A, self._apply(op, J, B, T)))
+            B2 = self._apply(op, M, B, B2)
+            B, B2 = B2, B
+        return (B.copy(), jacs)
+
+    def matrix_batch(self, V):
+        """Returns the same matrices as matrix_batch of the gate this plan was built from.  Each op is applied to the whole batch at once."""
+        V = np.asarray(V, dtype='float64')
+        U = np.empty((len(V), self.dimension, self.dimension), dtype='complex128')
+        U[:] = np.eye(self.dimension)
+        scratch = np.empty_like(U)
+        for op in self.ops:
+            M = op.constant if op.constant is not None else op.local(op.gate.matrix_batch(V[:, op.start:op.stop]), batched=True)
+            scratch = self._apply(op, M, U, scratch)
+            U, scratch = scratch, U
+        return U
+
+    def mat_jac_batch(self, V):
+        """Returns the same matrices and jacobians as mat_jac_batch of the gate this plan was built from."""
+        V = np.asarray(V, dtype='float64')
+        A = np.empty((len(V), self.dimension, self.dimension), dtype='complex128')
+        A[:] = np.eye(self.dimension)
+        A2, B, B2, T, T2 = np.empty_like(A), A.copy(), np.empty_like(A), np.empty_like(A), np.empty_like(A)
+        matjacs = []
+        for op in self.ops:
+            if op.constant is not None:
+                matjacs.append((op.constant, []))
+            else:
+                M, Js = op.gate.mat_jac_batch(V[:, op.start:op.stop])
+                matjacs.append((op.local(M, batched=True), [op.local(Js[:, i], batched=True) for i in range(Js.shape[1])]))
+        for op, (M, _) in zip(self.ops, matjacs):
+            A2 = self._apply(op, M, A, A2)
+            A, A2 = A2, A
+        jacs = np.empty((len(V), self.num_inputs, self.dimension, self.dimension), dtype='complex128')
+        index = 0
+        for k, (op, (M, Js)) in enumerate(zip(self.ops, matjacs)):
+            A2 = self._unapply(op, M, A, A2)
+            A, A2 = A2, A
+            for J in Js:
+                if self.after_costs[k] < self.dimension:
+                    jacs[:, index] = self._apply_after(k, matjacs, self._apply(op, J, B, T), T2)
+                else:
+                    np.matmul(A, self._apply(op, J, B, T), out=jacs[:, index])
+                index += 1
+            B2 = self._apply(op, M, B, B2)
+            B, B2 = B2, B
+        return (B, jacs)
+
+
 class KroneckerGate(Gate):
     """Represents the Kronecker product of a list of gates.  This is equivalent to performing those gate in parallel in a quantum circuit."""
     def __init__(self, *subgates):
@@ -854,6 +1343,9 @@ class KroneckerGate(Gate):
         self.qudits = sum([gate.qudits for gate in subgates])
 
     def matrix(self, v):
+        plan = _evaluation_plan(self)
+        if plan is not None:
+            return plan.matrix(v)
         if len(self._subgates) < 2:
             return self._subgates[0].matrix(v)
         matrices = []
@@ -868,6 +1360,9 @@ class KroneckerGate(Gate):
         return U
 
     def mat_jac(self, v):
+        plan = _evaluation_plan(self)
+        if plan is not None:
+            return plan.mat_jac(v)
         if len(self._subgates) < 2:
             return self._subgates[0].mat_jac(v)
         matjacs = []
@@ -887,6 +1382,18 @@ class KroneckerGate(Gate):
 
         return (U, jacs)
 
+    def matrix_batch(self, V):
+        plan = _evaluation_plan(self)
+        if plan is not None:
+            return plan.matrix_batch(V)
+        return super().matrix_batch(V)
+
+    def mat_jac_batch(self, V):
+        plan = _evaluation_plan(self)
+        if plan is not None:
+            return plan.mat_jac_batch(V)
+        return super().mat_jac_batch(V)
+
     def assemble(self, v, i=0):
         out = []
         index = 0
@@ -903,7 +1410,38 @@ class KroneckerGate(Gate):
         Args:
             gate : A Gate to be added to the end of the list of gates in the new KroneckerGate.
         """
-        return KroneckerGate(*self._subgates, gate)
+        result = KroneckerGate(*self._subgates, gate)
+        hasher = _composite_digest_state(self).copy()
+        hasher.update(gate.structural_digest)
+        _set_composite_digest(result, hasher)
+        return result
+
+    @property
+    def dimension(self):
+        cache = _composite_structure(self)
+        if cache[3] is None:
+            cache[3] = int(np.prod([subgate.dimension for subgate in self._subgates]))
+        return cache[3]
+
+    @property
+    def layers(self):
+        return _composite_structure(self)[1]
+
+    @property
+    def parameter_offsets(self):
+        return _composite_structure(self)[2]
+
+    @property
+    def structural_digest(self):
+        cache = _composite_structure(self)
+        if cache[4] is None:
+            _composite_digest_state(self)
+        return cache[4]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("_structure_cache", None) # md5 states and evaluation plans can't be pickled, and the cache is cheap to rebuild
+        return state
 
     def _parts(self):
         return self._subgates
@@ -944,6 +1482,9 @@ class ProductGate(Gate):
         self.qudits = 0 if len(subgates) == 0 else subgates[0].qudits
 
     def matrix(self, v):
+        plan = _evaluation_plan(self)
+        if plan is not None:
+            return plan.matrix(v)
         if len(self._subgates) < 2:
             return self._subgates[0].matrix(v)
         matrices = []
@@ -963,6 +1504,9 @@ class ProductGate(Gate):
         return U
 
     def mat_jac(self, v):
+        plan = _evaluation_plan(self)
+        if plan is not None:
+            return plan.mat_jac(v)
         if len(self._subgates) < 2:
             return self._subgates[0].mat_jac(v)
         submats = []
@@ -1003,6 +1547,18 @@ class ProductGate(Gate):
             
         return (B, jacs)
 
+    def matrix_batch(self, V):
+        plan = _evaluation_plan(self)
+        if plan is not None:
+            return plan.matrix_batch(V)
+        return super().matrix_batch(V)
+
+    def mat_jac_batch(self, V):
+        plan = _evaluation_plan(self)
+        if plan is not None:
+            return plan.mat_jac_batch(V)
+        return super().mat_jac_batch(V)
+
     def assemble(self, v, i=0):
         out = []
         index = 0
@@ -1017,7 +1573,12 @@ class ProductGate(Gate):
         Args:
             gates : A list of Gates to be appended.
         """
-        return ProductGate(*self._subgates, *gates)
+        result = ProductGate(*self._subgates, *gates)
+        hasher = _composite_digest_state(self).copy()
+        for gate in gates:
+            hasher.update(gate.structural_digest)
+        _set_composite_digest(result, hasher)
+        return result
 
     def inserting(self, *gates, depth=-1):
         """Returns a new ProductGate with new `gates` inserted at some index `depth`.
@@ -1026,7 +1587,40 @@ class ProductGate(Gate):
             gates : A list of Gates to be inserted.
             depth : An index in the subgates of the ProductGate after which the new gates will be inserted.  The default value of -1 will insert these gates at the begining of the ProductGate.
         """
-        return ProductGate(*self._subgates[:depth], *gates, *self._subgates[depth:])
+        result = ProductGate(*self._subgates[:depth], *gates, *self._subgates[depth:])
+        # the digests of the subgates are already cached, so this only hashes a few bytes per layer
+        hasher = md5(b"ProductGate")
+        for subgate in result._subgates:
+            hasher.update(subgate.structural_digest)
+        _set_composite_digest(result, hasher)
+        return result
+
+    @property
+    def dimension(self):
+        cache = _composite_structure(self)
+        if cache[3] is None:
+            cache[3] = self._subgates[0].dimension if len(self._subgates) > 0 else 1
+        return cache[3]
+
+    @property
+    def layers(self):
+        return _composite_structure(self)[1]
+
+    @property
+    def parameter_offsets(self):
+        return _composite_structure(self)[2]
+
+    @property
+    def structural_digest(self):
+        cache = _composite_structure(self)
+        if cache[4] is None:
+            _composite_digest_state(self)
+        return cache[4]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("_structure_cache", None) # md5 states and evaluation plans can't be pickled, and the cache is cheap to rebuild
+        return state
 
     def __deepcopy__(self, memo):
         return ProductGate(self._subgates.__deepcopy__(memo))
@@ -20,6 +20,7 @@ Attributes:
 from .gates import *
 from .assemblers import flatten_intermediate
 import numpy as np
+from hashlib import md5
 
 
 
@@ -84,7 +85,7 @@ class Gateset():
         # NOTE: it is safe to assume that the circuit passed in here was produced by the functions of this class
         
         # This is the default implementation, for Gatesets that rely on search_layers
-        qudits = int(np.log(circ.matrix([0]*circ.num_inputs).shape[0])/np.log(self.d))
+        qudits = circ.qudits
         return [(circ.appending(t[0]), t[1]) for t in self.search_layers(qudits)]
 
     def __eq__(self, other):
@@ -146,7 +147,7 @@ class QubitCNOTLinear(Gateset):
 
     def successors(self, circ, qudits=None):
         if qudits is None:
-            qudits = int(np.log(circ.matrix([0]*circ.num_inputs).shape[0])/np.log(self.d))
+            qudits = circ.qudits
         skip_index = find_last_3_cnots_linear(circ)
         return [(circ.appending(layer[0]), layer[1]) for layer in linear_topology(self.cnot, self.single_gate, qudits, self.d, single_alt=self.single_alt, skip_index=skip_index)]
 
@@ -192,7 +193,7 @@ class QubitCZLinear(Gateset):
 
     def successors(self, circ, qudits=None):
         if qudits is None:
-            qudits = int(np.log(circ.matrix([0]*circ.num_inputs).shape[0])/np.log(self.d))
+            qudits = circ.qudits
         skip_index = find_last_3_cnots_linear(circ)
         return [(circ.appending(layer[0]), layer[1]) for layer in linear_topology(self.two_gate, self.single_gate, qudits, self.d, single_alt=self.single_alt, skip_index=skip_index)]
 
@@ -215,7 +216,7 @@ class QubitISwapLinear(Gateset):
 
     def successors(self, circ, qudits=None):
         if qudits is None:
-            qudits = int(np.log(circ.matrix([0]*circ.num_inputs).shape[0])/np.log(self.d))
+            qudits = circ.qudits
         skip_index = find_last_3_cnots_linear(circ)
         return [(circ.appending(layer[0]), layer[1]) for layer in linear_topology(self.two_gate, self.single_gate, qudits, self.d, single_alt=self.single_alt, skip_index=skip_index)]
 
@@ -238,7 +239,7 @@ class QubitXXLinear(Gateset):
 
     def successors(self, circ, qudits=None):
         if qudits is None:
-            qudits = int(np.log(circ.matrix([0]*circ.num_inputs).shape[0])/np.log(self.d))
+            qudits = circ.qudits
         skip_index = find_last_3_cnots_linear(circ)
         return [(circ.appending(layer[0]), layer[1]) for layer in linear_topology(self.two_gate, self.single_gate, qudits, self.d, single_alt=self.single_alt, skip_index=skip_index)]
 
@@ -334,6 +335,56 @@ def find_last_3_cnots_linear(circuit):
         return None
 
 
+def qudit_support(gate):
+    """Returns a frozenset of the indices of the qudits that gate acts on non-trivially."""
+    if isinstance(gate, IdentityGate):
+        return frozenset()
+    if isinstance(gate, NonadjacentCNOTGate):
+        return frozenset((gate.control, gate.target))
+    if isinstance(gate, KroneckerGate):
+        support = set()
+        offset = 0
+        for subgate in gate._subgates:
+            support.update(offset + qudit for qudit in qudit_support(subgate))
+            offset += subgate.qudits
+        return frozenset(support)
+    if isinstance(gate, ProductGate):
+        return frozenset().union(*(qudit_support(subgate) for subgate in gate._subgates))
+    return frozenset(range(gate.qudits))
+
+def canonical_form(circuit):
+    """
+    Computes a canonical form for a ProductGate that is the same for any two circuits that differ only in the order of layers that commute because they act on disjoint qudits.
+
+    This works for any topology, because it only relies on which qudits each layer acts on.  The layers are sorted into the Foata normal form, where each layer is placed in the earliest step after every earlier layer it shares a qudit with, and the layers within a step are sorted.
+
+    Args:
+        circuit : A ProductGate, such as the ansatz circuits generated by the search compilers.
+
+    Returns:
+        tuple : A tuple of steps, each of which is a sorted tuple of the structural digests of the layers in that step.
+    """
+    steps = []
+    levels = dict() # maps each qudit to the first step that can hold a layer acting on that qudit
+    for layer in circuit._subgates:
+        support = qudit_support(layer)
+        level = max((levels.get(qudit, 0) for qudit in support), default=0)
+        if level == len(steps):
+            steps.append([])
+        steps[level].append(layer.structural_digest)
+        for qudit in support:
+            levels[qudit] = level + 1
+    return tuple(tuple(sorted(step)) for step in steps)
+
+def canonical_hash(circuit):
+    """Returns an md5 hex digest of canonical_form(circuit), which is the same for circuits that are equivalent up to the commutation of layers acting on disjoint qudits."""
+    hasher = md5()
+    for step in canonical_form(circuit):
+        hasher.update(b"|".join(step))
+        hasher.update(b";")
+    return hasher.hexdigest()
+
+
 # commonly used defaults
 DefaultQubit = QubitCNOTLinear
 DefaultQutrit = QutritCPIPhaseLinear
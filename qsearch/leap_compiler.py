@@ -11,9 +11,10 @@ from . import solvers as scsolver
 from .options import Options
 from .defaults import standard_defaults, standard_smart_defaults
 from . import parallelizers, backends
-from . import utils, heuristics, gates, logging, gatesets
-from .compiler import Compiler, SearchCompiler
+from . import utils, heuristics, gates, logging, gatesets, analytic
+from .compiler import Compiler, SearchCompiler, SolveStatistics, warm_start_parameters, drop_transpositions, result_record, compile_deadline, deadline_passed, check_solver_features
 from .checkpoints import ChildCheckpoint
+from .caches import cached_solve, circuit_weight
 
 
 def cut_end(circ, depth):
@@ -36,16 +37,23 @@ class LeapCompiler(Compiler):
         heuristic : A heuristic used to order the search tree.  See heuristics.py for more information.
         solver : A Solver used for optimizing the parameters in parameterized circuits generated by the search tree.
         parallelizer : A Parallelizer used for solving multiple parameterized circuits in parallel.
-        beams : The number of nodes to pop from the search tree at a time.  The default value of -1 will create enough branches to maximize utilization of your CPU.
+        beams : The number of nodes to pop from the search tree at a time.  The default value of -1 lets the beam_controller choose.
+        beam_controller : A BeamController class that decides how many nodes to pop from the search tree at a time, which is constructed with the options and the number of search layers.  The default is beam_controllers.AdaptiveBeams, which also uses the max_beams and beam_slack options.  See compiler.SearchCompiler and beam_controllers.py for more information.
+        warm_start : If True, each child node is optimized starting from its parent's parameters, with the new layer's single-qudit gates set near the identity.
+        warm_start_restarts : The number of additional random-start solves to run for each warm-started child, keeping whichever result is best.
+        solve_cutoff : If set to a number, the solve for a child node in a sub-compilation is aborted when its value is predicted to end more than solve_cutoff times the value of its parent.  See compiler.SearchCompiler for more information.  The default is None, which runs every solve to completion.
         error_func : The function that the Solver will attempt to minimize.
         eval_func : The function used by the heuristic in order to guide the search tree.  By default this is equal to error_func.
         error_jac : A function that returns a tuple of the value that error_func would generate and the jacobian of error_func
         error_residuals : A function that returns an array of real-valued residuals to be used by a least-squares-based Solver.
         error_residuals_jac : A function that returns the jacobian of error_residuals (note that it does NOT return a tuple of the residuals and the jacobian).
-        timeout : An uper limit on the amount of time the compiler will spend trying to synthesize a circuit.  The default is float('inf'), for unlimited.
+        timeout : An uper limit on the amount of time the compiler will spend trying to synthesize a circuit.  Solves that are still running when it runs out are stopped with the best parameters found so far, so the compiler returns shortly after, when the solver supports the "deadline" feature of Solver.supported_features.  Other solvers, such as the native solvers from qsrs, run those solves to completion, and a warning is given.  The default is float('inf'), for unlimited.
+        deadline : The time, as returned by time.time(), at which the compiler stops and returns the best result so far, in the same way as when the timeout runs out.  The earlier of the two is used.  The default is None, for no deadline.
         checkpoint : The compiler will use this Checkpoint to save intermediate state, and will resume from this Checkpoint if there was an existing state.
         logger : A qsearch.logging.Logger that will be used for logging the synthesis process.
         min_depth : the minimum amount of searching 
+        analytic_synthesis : If True, 1- and 2-qubit targets are synthesized analytically with the minimal number of CNOTs, instead of by searching, when the gateset is supported by analytic.synthesize, the objective is a MatrixDistanceObjective, and the result is within weight_limit.  The default is True.
+        shared_bound : A portfolio.SharedBound shared with other compilers running at once.  The final result is reported to it, and the compilation stops once it is cancelled, or once the depth reaches the weight of the best solution it holds, which also limits the depth of the nodes each sub-compilation pushes onto its search queue.  The default is None.
     """
     def __init__(self, options=Options()):
         """Run LEAP on the compilation specified in options.
@@ -61,6 +69,18 @@ class LeapCompiler(Compiler):
     def compile(self, options=Options()):
         """Run LEAP on the compilation specified in options.
         
+        Args:
+            options: options for the compilations, see the class level documentation for details.
+        """
+        for record in self.compile_iter(options):
+            pass
+        return {name: record[name] for name in ('structure', 'parameters', 'cut_depths') if name in record}
+
+    def compile_iter(self, options=Options()):
+        """Run LEAP on the compilation specified in options, yielding a dict made by compiler.result_record with the best result so far after each sub-compilation, which also holds the "cut_depths" so far.  The last record yielded is the result of the compilation.
+
+        The caller can stop consuming records at any time, which stops the compilation between sub-compilations.
+
         Args:
             options: options for the compilations, see the class level documentation for details.
         """
@@ -75,9 +95,18 @@ class LeapCompiler(Compiler):
 
         logger = options.logger if "logger" in options else logging.Logger(verbosity=options.verbosity, stdout_enabled=options.stdout_enabled, output_file=options.log_file)
 
+        if options.analytic_synthesis:
+            result = analytic.synthesize_for(U, options)
+            if result is not None:
+                logger.logprint("Synthesized the target analytically with {} CNOTs.".format(len(result["structure"]._subgates) - 1))
+                yield result_record(result["structure"], result["parameters"], options.objective.gen_eval_func(result["structure"], options)(result["parameters"]), circuit_weight(result["structure"]), 0, 0)
+                return
+
         starttime = timer() # note, because all of this setup gets included in the total time, stopping and restarting the project may lead to time durations that are not representative of the runtime under normal conditions
         rectime = 0
-        qudits = int(np.round(np.log(np.shape(U)[0])/np.log(options.gateset.d)))
+        qudits = utils.qudit_count(np.shape(U)[0], options.gateset.d)
+        options.deadline = compile_deadline(options) # passed on to each sub-compilation, which stops in the middle of a layer once it passes
+        check_solver_features(options)
 
         sub_compiler = options.sub_compiler_class if 'sub_compiler_class' in options else SubCompiler
         sc = sub_compiler(options)
@@ -93,27 +122,45 @@ class LeapCompiler(Compiler):
             depths = recovered_state[2]
             rectime = recovered_state[3]
             initial_layer = recovered_state[4]
+        shared = options.shared_bound
+        record = None
         while True:
-            if 'timeout' in options and timer() - starttime > options.timeout:
+            if ('timeout' in options and timer() - starttime > options.timeout) or deadline_passed(options):
                 break
-            opts = options.updated(initial_layer=initial_layer, local_threshold=options.delta * best_value, overall_starttime=starttime, overall_best_value=best_value, checkpoint=child_checkpoint)
+            opts = options.updated(initial_layer=initial_layer, local_threshold=options.delta * best_value, overall_starttime=starttime, overall_best_value=best_value, overall_depth=total_depth, checkpoint=child_checkpoint)
             best_pair, best_value, best_depth = sc.compile(opts)
             # clear child checkpoint for next run
             child_checkpoint.delete()
             total_depth += best_depth
             depths.append(total_depth)
+            record = result_record(*best_pair, best_value, total_depth, rectime+(timer()-starttime), sc.nodes if hasattr(sc, "nodes") else None)
+            record["cut_depths"] = list(depths)
+            yield record
             if best_value < options.threshold:
                 break
             initial_layer = best_pair[0]
             child_checkpoint.save_parent((total_depth, best_value, depths, timer()-starttime, initial_layer))
+            if shared is not None and (shared.cancelled or not shared.allows(total_depth)):
+                break
+        if record is None:
+            # the deadline passed before the first sub-compilation, so the result is the initial layer, or the circuit recovered from the checkpoint
+            root = initial_layer if isinstance(initial_layer, gates.ProductGate) else gates.ProductGate(initial_layer)
+            result, _ = cached_solve(root, options.backend.prepare_circuit(root, options), options)
+            best_pair = (root, result[1])
+            best_value = options.objective.gen_eval_func(root, options)(result[1])
+            record = result_record(*best_pair, best_value, total_depth, rectime+(timer()-starttime), sc.nodes if hasattr(sc, "nodes") else None)
+            record["cut_depths"] = list(depths)
+            yield record
         logger.logprint("Finished all sub-compilations at depth {} with score {} after {} seconds.".format(total_depth, best_value, (timer()-starttime)))
-        return {'structure': best_pair[0], 'parameters': best_pair[1], 'cut_depths': depths}
+        if shared is not None:
+            shared.report(best_pair[0], best_pair[1], best_value, total_depth)
 
 
 class SubCompiler(Compiler):
-    """A modified SearchCompiler for the LeapCompiler to use.
+    """A modified SearchCompiler for the LeapCompiler to use.  The number of circuits it has solved over all of its compilations is kept in nodes.
     """
     def __init__(self, options=Options()):
+        self.nodes = 0
         self.options = Options()
         self.options.set_defaults(**standard_defaults)
         self.options.set_smart_defaults(**standard_smart_defaults)
@@ -132,7 +179,7 @@ class SubCompiler(Compiler):
 
         starttime = timer() # note, because all of this setup gets included in the total time, stopping and restarting the project may lead to time durations that are not representative of the runtime under normal conditions
         h = options.heuristic
-        qudits = int(np.round(np.log(np.shape(U)[0])/np.log(options.gateset.d)))
+        qudits = utils.qudit_count(np.shape(U)[0], options.gateset.d)
 
         if options.gateset.d**qudits != np.shape(U)[0]:
             raise ValueError("The target matrix of size {} is not compatible with qudits of size {}.".format(np.shape(U)[0], self.options.gateset.d))
@@ -145,7 +192,7 @@ class SubCompiler(Compiler):
         if len(search_layers) <= 0:
             logger.logprint("This gateset has no branching factor so only an initial optimization will be run.")
             root = initial_layer
-            result = options.solver.solve_for_unitary(options.backend.prepare_circuit(root, options), options)
+            result, _ = cached_solve(root, options.backend.prepare_circuit(root, options), options)
             value = options.objective.gen_eval_func(root, options)(result[1])
             return ((root, result[1]), value, 0)
 
@@ -154,13 +201,9 @@ class SubCompiler(Compiler):
         # this is good informati
         logger.logprint("There are {} processors available to Pool.".format(options.num_tasks))
         logger.logprint("The branching factor is {}.".format(len(search_layers)))
-        beams = int(options.beams)
-        if beams < 1 and len(search_layers) > 0:
-            beams = int(options.num_tasks // len(search_layers))
-        if beams < 1:
-            beams = 1
-        if beams > 1:
-            logger.logprint("The beam factor is {}.".format(beams))
+        controller = options.beam_controller(options, len(search_layers))
+        if controller.beams > 1:
+            logger.logprint("The beam factor is {}.".format(controller.beams))
 
         recovered_state = checkpoint.recover()
         queue = []
@@ -174,9 +217,10 @@ class SubCompiler(Compiler):
                 root = initial_layer
             else:
                 root = gates.ProductGate(initial_layer)
-            result = options.solver.solve_for_unitary(options.backend.prepare_circuit(root, options), options)
+            result, _ = cached_solve(root, options.backend.prepare_circuit(root, options), options)
             best_value = options.objective.gen_eval_func(root, options)(result[1])
             best_pair = (root, result[1])
+            self.nodes += 1
             logger.logprint("New best! {} at depth 0".format(best_value))
             if depth == 0:
                 return (best_pair, best_value, 0)
@@ -190,27 +234,34 @@ class SubCompiler(Compiler):
             logger.logprint("Recovered state with best result {} at depth {}".format(best_value, best_depth))
 
         options.generate_cache() # cache the results of smart_default settings, such as the default solver, before entering the main loop where the options will get pickled and the smart_default functions called many times because later caching won't persist cause of pickeling and multiple processes
+        transpositions = set(gatesets.canonical_hash(tup[5]) for tup in queue) if options.transposition_table else None
         previous_bests_depths = []
         previous_bests_values = []
+        solve_stats = SolveStatistics()
         try:
             while len(queue) > 0:
-                if 'timeout' in options and timer() - options.overall_starttime > options.timeout:
+                if ('timeout' in options and timer() - options.overall_starttime > options.timeout) or deadline_passed(options):
+                    break
+                if options.shared_bound is not None and options.shared_bound.cancelled:
                     break
                 if best_value < options.threshold:
                     queue = []
                     break
                 popped = []
-                for _ in range(0, beams):
-                    if len(queue) == 0:
+                for _ in range(0, controller.beams):
+                    if len(queue) == 0 or (len(popped) > 0 and not controller.admits(popped[0][0], queue[0][0])):
                         break
                     tup = heapq.heappop(queue)
                     popped.append(tup)
                     logger.logprint("Popped a node with score: {} at depth: {}".format((tup[2]), tup[1]), verbosity=2)
 
                 then = timer()
-                new_steps = [(current_tup[5].appending(search_layer[0]), current_tup[1], search_layer[1]) for search_layer in search_layers for current_tup in popped]
-                for step, result, current_depth, weight in parallel.solve_circuits_parallel(new_steps):
-                    current_value = options.objective.gen_eval_func(step, options)(result[1])
+                expired = False
+                new_steps = drop_transpositions([(current_tup[5].appending(search_layer[0]), current_tup[1], search_layer[1], warm_start_parameters(current_tup[4], search_layer[0]) if options.warm_start else None, {"bound": current_tup[2]}) for search_layer in search_layers for current_tup in popped], transpositions)
+                layer = parallelizers.LayerStatistics(options.num_tasks)
+                for step, result, current_depth, weight, current_value, score, stats in layer.measure(parallel.solve_circuits_parallel(new_steps)):
+                    solve_stats.record(stats)
+                    self.nodes += 1
                     new_depth = current_depth + weight
                     if (current_value < best_value and (best_value >= options.threshold or new_depth <= best_depth)) or (current_value < options.threshold and new_depth < best_depth):
                         best_value = current_value
@@ -228,17 +279,32 @@ class SubCompiler(Compiler):
                             logger.logprint(f"Predicted best value {predicted_best} for new best with delta {delta}", verbosity=2)
                             if not np.isnan(predicted_best) and best_value < options.overall_best_value and delta < 0 and ('min_depth' not in options or new_depth >= options.min_depth):
                                 parallel.done()
+                                solve_stats.log(logger)
                                 return (best_pair, best_value, best_depth)
                         previous_bests_depths.append(best_depth)
                         previous_bests_values.append(best_value)
 
-                    if depth is None or new_depth < depth:
-                        heapq.heappush(queue, (h(step, result[1], new_depth, options), new_depth, current_value, tiebreaker, result[1], step))
+                    if (depth is None or new_depth < depth) and (options.shared_bound is None or options.shared_bound.allows(options.overall_depth + new_depth)):
+                        heapq.heappush(queue, (score if score is not None else h(step, result[1], new_depth, options), new_depth, current_value, tiebreaker, result[1], step))
                         tiebreaker+=1
-                logger.logprint("Layer completed after {} seconds".format(timer() - then), verbosity=2)
+                    if deadline_passed(options):
+                        # the rest of the layer is dropped, and the tasks that haven't started are cancelled when the parallelizer is done
+                        expired = True
+                        break
+                if expired:
+                    # the popped nodes were not fully expanded, so they are saved as if they were never popped
+                    saved_queue = queue + popped
+                    heapq.heapify(saved_queue)
+                    checkpoint.save((saved_queue, best_depth, best_value, best_pair, tiebreaker, rectime+(timer()-starttime)))
+                    logger.logprint("Stopped the search in the middle of a layer because the deadline passed.")
+                    break
+                layer.finish()
+                controller.record_layer(layer, len(popped))
+                logger.logprint("Layer completed after {} seconds, with the workers busy {:.0%} of the time".format(timer() - then, layer.utilization), verbosity=2)
                 checkpoint.save((queue, best_depth, best_value, best_pair, tiebreaker, rectime+(timer()-starttime)))
         finally:
             parallel.done()
 
+        solve_stats.log(logger)
         logger.logprint("Finished compilation at depth {} with score {} after {} seconds.".format(best_depth, best_value, rectime+(timer()-starttime)))
         return (best_pair, best_value, best_depth)
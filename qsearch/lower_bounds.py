@@ -0,0 +1,111 @@
+"""
+This module computes lower bounds on the weight of any circuit that can implement a target unitary with a given Gateset, which SearchCompiler uses to skip the search depths that provably cannot reach the target.
+
+The bounds come from the operator Schmidt rank of the target across bipartitions of its qudits.  A layer acting on qudits on both sides of a bipartition can multiply the Schmidt rank across it by at most the Schmidt rank of the layer itself, which is 2 for a CNOT, while a layer acting on one side leaves it unchanged.  So a target with Schmidt rank R across a bipartition needs at least log(R)/log(2) CNOTs crossing it.  The bounds for a family of bipartitions add up when every layer of the Gateset crosses only one of them, like the cuts between neighbouring qubits in a linear topology.  For 2-qubit targets on gatesets whose layers are each equivalent to a CNOT up to 1-qubit gates, such as CNOT and CZ gatesets, the exact count from the KAK decomposition is used instead.
+
+The required format for a lower bound is to take in a target unitary and an Options object, and to return a weight that every circuit implementing the target within options.threshold must have, in the same units as the weights of options.gateset.  It is passed to SearchCompiler as the lower_bound option.
+
+Attributes:
+    schmidt_rank : Returns the operator Schmidt rank of a unitary across a bipartition of its qudits.
+    entanglement_lower_bound : The default lower bound, based on Schmidt ranks and KAK invariants.
+    no_lower_bound : A lower bound of 0, which disables skipping search depths.
+"""
+
+import itertools
+import math
+
+import numpy as np
+
+from . import analytic, utils
+from .gatesets import qudit_support
+
+def schmidt_rank(U, part, d=2, cutoff=1e-8):
+    """Returns the operator Schmidt rank of the unitary U across the bipartition of its qudits into part and the rest.
+
+    Args:
+        U : A unitary matrix acting on qudits of size d.
+        part : An iterable of the indices of the qudits on one side of the bipartition.
+        d : The size of the qudits.
+        cutoff : Singular values no larger than this are not counted.
+    """
+    qudits = utils.qudit_count(np.shape(U)[0], d)
+    part = sorted(set(part))
+    rest = [q for q in range(qudits) if q not in part]
+    # axes 0..n-1 index the output qudits and n..2n-1 index the input qudits
+    tensor = np.reshape(U, [d]*(2*qudits))
+    tensor = np.transpose(tensor, part + [qudits + q for q in part] + rest + [qudits + q for q in rest])
+    singular_values = np.linalg.svd(np.reshape(tensor, (d**(2*len(part)), -1)), compute_uv=False)
+    return int(np.sum(singular_values > cutoff))
+
+def _bipartitions(qudits):
+    # every bipartition, given by the side without the last qudit, so that each one appears once
+    for size in range(1, qudits):
+        for part in itertools.combinations(range(qudits - 1), size):
+            yield part
+
+def _family_bound(counts, layers):
+    # counts maps each bipartition in the family to (crossings needed, lowest weight of a crossing layer)
+    # each layer can cross several bipartitions, so the total is divided by the most that any layer crosses
+    crossings = max((sum(1 for part in counts if _crosses(support, part)) for support, _, _ in layers), default=0)
+    if crossings == 0:
+        return 0
+    return sum(needed * weight for needed, weight in counts.values()) / crossings
+
+def _crosses(support, part):
+    return any(q in part for q in support) and any(q not in part for q in support)
+
+def entanglement_lower_bound(U, options, max_qudits=8):
+    """Returns a lower bound on the weight of the circuits built from options.gateset that implement U, from the operator Schmidt ranks of U across every bipartition of its qudits, and from the KAK decomposition for 2-qubit targets when every layer is a CNOT up to 1-qubit gates.
+
+    Args:
+        U : The target unitary.
+        options : An Options object with the gateset and threshold.
+        max_qudits : Targets on more qudits than this get a bound of 0, because the number of bipartitions grows exponentially.
+
+    Returns:
+        The bound, which is 0 when nothing could be proven.
+    """
+    gateset = options.gateset
+    d = gateset.d
+    qudits = utils.qudit_count(np.shape(U)[0], d)
+    if qudits < 2 or qudits > max_qudits:
+        return 0
+    rng = np.random.default_rng(0)
+    layers = []
+    cnot_like = True
+    for layer, weight in gateset.search_layers(qudits):
+        support = qudit_support(layer)
+        # a layer only raises the Schmidt rank across bipartitions that separate its qudits, by at most its own rank across them
+        matrix = layer.matrix(rng.random(layer.num_inputs) * 2 * np.pi)
+        ranks = {part: schmidt_rank(matrix, part, d) for part in _bipartitions(qudits) if _crosses(support, part)}
+        layers.append((support, weight, ranks))
+        cnot_like = cnot_like and d == 2 and qudits == 2 and analytic.cnot_count(matrix) == 1
+    if len(layers) == 0:
+        return 0
+    if cnot_like:
+        # each layer is a CNOT up to 1-qubit gates, so the KAK decomposition gives the exact number of layers needed
+        return analytic.cnot_count(U, tol=max(1e-7, np.sqrt(options.threshold))) * min(weight for _, weight, _ in layers)
+
+    # singular values that a target within the threshold could have instead of exactly 0 are not counted
+    cutoff = 10 * np.sqrt(np.shape(U)[0] * options.threshold) + 1e-8
+    counts = dict()
+    for part in _bipartitions(qudits):
+        rank = schmidt_rank(U, part, d, cutoff)
+        crossing = [(ranks[part], weight) for _, weight, ranks in layers if part in ranks and ranks[part] > 1]
+        if rank <= 1 or len(crossing) == 0:
+            continue
+        needed = math.ceil(math.log(rank) / math.log(max(r for r, _ in crossing)) - 1e-9)
+        counts[part] = (needed, min(weight for _, weight in crossing))
+
+    bound = max((needed * weight for needed, weight in counts.values()), default=0)
+    contiguous = {part: count for part, count in counts.items() if part == tuple(range(len(part)))}
+    # the bipartition that separates the last qudit is stored by the other side
+    single = {part: count for part, count in counts.items() if len(part) == 1 or len(part) == qudits - 1}
+    bound = max(bound, _family_bound(contiguous, layers), _family_bound(single, layers))
+    if all(float(weight).is_integer() for _, weight, _ in layers):
+        bound = math.ceil(bound - 1e-9)
+    return bound
+
+def no_lower_bound(U, options):
+    """A lower bound of 0, which makes SearchCompiler search from the initial layer."""
+    return 0
@@ -2,16 +2,23 @@
 This module defines solvers that use multiple starting points in order to have a higher chance at finding the global minimum.
 """
 from . import utils, logging
-from .solvers import Solver, default_solver
+from .solvers import Solver, SolveDeadline, default_solver, supports, solve_cutoff, max_iterations, monitor_flags, record_monitor_flags
 import numpy as np
 import scipy as sp
 import scipy.optimize
-from qsrs import native_from_object
+try:
+    from qsrs import native_from_object
+except ImportError:
+    native_from_object = None
 import time
 from math import pi, gamma, sqrt
 
 import multiprocessing as mp
+import os
+import uuid
+from multiprocessing import util as mp_util
 import sys
+import threading
 from .persistent_aposmm import initialize_APOSMM, decide_where_to_start_localopt, update_history_dist, add_to_local_H
 
 def distance_for_x(x, options, circuit):
@@ -24,10 +31,16 @@ def distance_for_x(x, options, circuit):
     elif options.inner_solver.distance_metric == "Residuals":
         return np.sum(options.error_residuals(options.target, circuit.matrix(x), np.eye(options.target.shape[0]))**2)
 
+def inner_solver_features(options, features):
+    """Returns the features, out of the ones given, that the inner_solver supports with options."""
+    inner_solver = options.inner_solver if 'inner_solver' in options else default_solver(options)
+    return frozenset(feature for feature in features if supports(inner_solver, feature, options))
+
 def optimize_worker(circuit, options, q, x0, error_func):
     """Worker function used to run the inner solver in parallel"""
     _, xopt = options.inner_solver.solve_for_unitary(circuit, options, x0)
-    q.put((error_func(xopt), xopt))
+    # the worker's copy of the solve_monitor records the aborts of its solve, so they are sent back along with the result
+    q.put((error_func(xopt), xopt, monitor_flags(solve_cutoff(options))))
 
 class MultiStart_Solver(Solver):
     """A higher accuracy solver based on APOSMM https://www.mcs.anl.gov/~jlarson/APOSMM/
@@ -41,6 +54,12 @@ class MultiStart_Solver(Solver):
         self.num_threads = num_threads
         self.ctx = mp.get_context('fork') if sys.platform != 'win32' else mp.get_context()
 
+    def supported_features(self, options):
+        # a forked worker gets its own copy of the solve_monitor, which the inner solver checks as usual, and sends back whether it aborted the solve
+        if self.ctx.get_start_method() != 'fork':
+            return frozenset()
+        return inner_solver_features(options, ("solve_cutoff", "deadline", "max_iterations"))
+
     def solve_for_unitary(self, circuit, options, x0=None):
         """Optimize the given circuit based on the provided options with initial point x0 (optional).
       
@@ -85,29 +104,138 @@ class MultiStart_Solver(Solver):
         update_history_dist(H, n)
         starting_inds = decide_where_to_start_localopt(H, n, initial_sample_size, rk_const, ld, mu, nu)
 
-        starting_points = H['x'][starting_inds[:num_localopt_runs]]
+        starting_points = [2*np.pi*x for x in H['x'][starting_inds[:num_localopt_runs]]]
+        if x0 is not None:
+            # a provided starting point (such as a warm start from the search tree) replaces the least promising APOSMM point
+            starting_points = [np.array(x0)] + starting_points[:num_localopt_runs-1]
+
+        rets = self.optimize_starting_points(circuit, options, starting_points, error_func)
+
+        best_found = np.argmin([r[0] for r in rets])
+        best_val = rets[best_found][0]
+
+        xopt = rets[best_found][1]
 
-        start = time.time()
+        return (circuit.matrix(xopt), xopt)
+
+    def optimize_starting_points(self, circuit, options, starting_points, error_func):
+        """Runs the inner solver from each of the starting points, and returns a list of (error, parameters) tuples."""
         q = self.ctx.Queue()
         processes = []
         rets = []
-        for x0 in starting_points:
-            p = self.ctx.Process(target=optimize_worker, args=(circuit, options, q, 2*np.pi*x0, error_func))
+        for starting_point in starting_points:
+            p = self.ctx.Process(target=optimize_worker, args=(circuit, options, q, starting_point, error_func))
             processes.append(p)
             p.start()
         for p in processes:
-            ret = q.get() # will block
-            rets.append(ret)
+            value, xopt, flags = q.get() # will block
+            record_monitor_flags(solve_cutoff(options), flags)
+            rets.append((value, xopt))
         for p in processes:
             p.join()
-        end = time.time()
+        return rets
 
-        best_found = np.argmin([r[0] for r in rets])
-        best_val = rets[best_found][0]
+def pool_worker(tasks, results):
+    """Worker function used by PooledMultiStart_Solver, which runs the inner solver for each starting point it receives until it receives None.
 
-        xopt = rets[best_found][1]
+    Each task is a tuple of (index, circuit, options, x0), where the circuit and options are None if they are the same as in the worker's previous task.
+    """
+    circuit = options = None
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        index, new_circuit, new_options, x0 = task
+        if new_circuit is not None:
+            circuit = new_circuit
+        if new_options is not None:
+            options = new_options
+        try:
+            _, xopt = options.inner_solver.solve_for_unitary(circuit, options, x0)
+            results.put((index, options.objective.gen_error_func(circuit, options)(xopt), xopt, monitor_flags(solve_cutoff(options))))
+        except Exception as e:
+            results.put((index, None, e, None))
 
-        return (circuit.matrix(xopt), xopt)
+class WorkerPool():
+    """The worker processes started by a PooledMultiStart_Solver in one process, along with their queues."""
+    def __init__(self, ctx, num_threads):
+        self.lock = threading.Lock()
+        self.results = ctx.Queue()
+        self.workers = []
+        for _ in range(num_threads):
+            tasks = ctx.Queue()
+            p = ctx.Process(target=pool_worker, args=(tasks, self.results), daemon=True)
+            p.start()
+            # each worker remembers the last circuit and options it received, so they are only sent again when they change
+            self.workers.append([p, tasks, None, None])
+        self.finalizer = mp_util.Finalize(None, self.stop, exitpriority=10) # stops the workers when this process exits, if done() wasn't called first
+
+    def stop(self):
+        for p, tasks, _, _ in self.workers:
+            tasks.put(None)
+        for p, _, _, _ in self.workers:
+            p.join(timeout=5)
+            if p.is_alive():
+                p.terminate()
+
+# the WorkerPools of this process, keyed by (pool_id of the solver, pid), so that every copy of a solver unpickled in the same process shares one pool
+_pools = {}
+_pools_lock = threading.Lock()
+
+class PooledMultiStart_Solver(MultiStart_Solver):
+    """A MultiStart_Solver that keeps num_threads worker processes running between calls to solve_for_unitary, rather than starting new ones every time.
+
+    The workers are started the first time the solver is used in a process, and receive only a starting point for each local optimization, along with the circuit and options when those change.  Parallelizers like ProcessPoolParallelizer unpickle a new copy of the solver for every task, so the workers are kept in a registry for the process, shared by every copy of the same solver, rather than on the solver itself.  The workers of the master process are shut down by done(), which the Parallelizer calls when a compilation finishes, and the workers of any other process are shut down when that process exits.
+    """
+    def __init__(self, num_threads):
+        super().__init__(num_threads)
+        self.pool_id = uuid.uuid4().hex
+
+    def supported_features(self, options):
+        # the options are pickled to send them to the workers, which works for a SolveDeadline, but a SolveCutoff holds an eval_func that can't be
+        return inner_solver_features(options, ("deadline", "max_iterations"))
+
+    def _pool(self):
+        # returns the WorkerPool of this solver in this process, starting it if needed
+        key = (self.pool_id, os.getpid())
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = WorkerPool(self.ctx, self.num_threads)
+                _pools[key] = pool
+        return pool
+
+    def optimize_starting_points(self, circuit, options, starting_points, error_func):
+        if 'inner_solver' not in options:
+            options.inner_solver = default_solver(options)
+        pool = self._pool()
+        with pool.lock:
+            for i, x0 in enumerate(starting_points):
+                worker = pool.workers[i % len(pool.workers)]
+                worker[1].put((i, None if worker[2] is circuit else circuit, None if worker[3] is options else options, x0))
+                worker[2] = circuit
+                worker[3] = options
+            rets = [None] * len(starting_points)
+            errors = []
+            # every result is read before raising an error, so that none are left on the queue for the next call
+            for _ in starting_points:
+                i, value, xopt, flags = pool.results.get()
+                if value is None:
+                    errors.append(xopt)
+                else:
+                    record_monitor_flags(solve_cutoff(options), flags)
+                    rets[i] = (value, xopt)
+            if len(errors) > 0:
+                raise errors[0]
+        return rets
+
+    def done(self):
+        """Shuts down the worker processes of this process."""
+        with _pools_lock:
+            pool = _pools.pop((self.pool_id, os.getpid()), None)
+        if pool is not None:
+            with pool.lock:
+                pool.finalizer() # calls stop, and unregisters it from running at exit
 
 class NaiveMultiStart_Solver(Solver):
     """A naive but effective multi-start solver which tries to cover as much of the optimization space at once"""
@@ -116,10 +244,16 @@ class NaiveMultiStart_Solver(Solver):
         self.threads = num_threads if num_threads else 1
         self.ctx = mp.get_context('fork') if sys.platform != 'win32' else mp.get_context()
 
+    def supported_features(self, options):
+        if self.ctx.get_start_method() != 'fork':
+            return frozenset()
+        return inner_solver_features(options, ("solve_cutoff", "deadline", "max_iterations"))
+
     def solve_for_unitary(self, circuit, options, x0=None):
         if 'inner_solver' not in options:
             options.inner_solver = default_solver(options)
         U = options.target
+        error_func = options.objective.gen_error_func(circuit, options)
         logger = options.logger if "logger" in options else logging.Logger(verbosity=options.verbosity, stdout_enabled=options.stdout_enabled, output_file=options.log_file)
         n = circuit.num_inputs
         initial_samples = [np.random.uniform((i - 1)/self.threads, i/self.threads, (circuit.num_inputs,)) for i in range(1, self.threads+1)]
@@ -127,12 +261,13 @@ class NaiveMultiStart_Solver(Solver):
         processes = []
         rets = []
         for x0 in initial_samples:
-            p = self.ctx.Process(target=optimize_worker, args=(circuit, options, q, x0))
+            p = self.ctx.Process(target=optimize_worker, args=(circuit, options, q, x0, error_func))
             processes.append(p)
             p.start()
         for p in processes:
-            ret = q.get() # will block
-            rets.append(ret)
+            value, xopt, flags = q.get() # will block
+            record_monitor_flags(solve_cutoff(options), flags)
+            rets.append((value, xopt))
         for p in processes:
             p.join()
 
@@ -142,3 +277,193 @@ class NaiveMultiStart_Solver(Solver):
         xopt = rets[best_found][1]
 
         return (circuit.matrix(xopt), xopt)
+
+def _solve_batch(A, b):
+    # solves each of the linear systems A[i] x = b[i], falling back to least squares for the ones that are singular
+    try:
+        return np.linalg.solve(A, b[..., np.newaxis])[..., 0]
+    except np.linalg.LinAlgError:
+        return np.matmul(np.linalg.pinv(A), b[..., np.newaxis])[..., 0]
+
+def lockstep_least_squares(residuals, residuals_jac, X, max_iterations, ftol=1e-8, xtol=1e-8, deadline=None):
+    """Runs a Levenberg-Marquardt optimization from each row of X at the same time.
+
+    Args:
+        residuals : A function that takes an array of shape (K, n) of parameter vectors and returns an array of shape (K, m) of residuals.
+        residuals_jac : A function that takes an array of shape (K, n) and returns an array of shape (K, m, n) of the jacobians of the residuals.
+        X : An array of shape (K, n) of starting points.
+        max_iterations : The most iterations that any single trajectory will be advanced.
+        ftol : A trajectory stops once an accepted step reduces its cost by less than this fraction.
+        xtol : A trajectory stops once its step is smaller than this, relative to the size of its parameters.
+        deadline : If set, every trajectory stops once the time, as returned by time.time(), passes this.
+
+    Returns:
+        np.ndarray : An array of shape (K, n) of the optimized parameters.
+    """
+    X = np.array(X, dtype='float64')
+    n = X.shape[1]
+    active = np.arange(len(X)) # the rows of X that are still being optimized, while the arrays below hold the state of just those rows
+    x = X.copy()
+    r = residuals(x)
+    J = residuals_jac(x)
+    cost = 0.5 * np.sum(r**2, axis=1)
+    damping = np.full(len(X), 1e-3)
+    for _ in range(max_iterations):
+        if len(active) == 0 or (deadline is not None and time.time() > deadline):
+            break
+        Jt = np.transpose(J, (0, 2, 1))
+        A = np.matmul(Jt, J)
+        g = np.matmul(Jt, r[..., np.newaxis])[..., 0]
+        # Marquardt's scaling damps each parameter in proportion to the curvature along it
+        A[:, np.arange(n), np.arange(n)] += damping[:, np.newaxis] * np.maximum(np.diagonal(A, axis1=1, axis2=2), 1e-12)
+        step = -_solve_batch(A, g)
+        trial = x + step
+        r_trial = residuals(trial)
+        cost_trial = 0.5 * np.sum(r_trial**2, axis=1)
+
+        better = cost_trial < cost
+        done = np.linalg.norm(step, axis=1) <= xtol * (xtol + np.linalg.norm(x, axis=1))
+        done |= better & (cost - cost_trial <= ftol * cost)
+        x[better] = trial[better]
+        r[better] = r_trial[better]
+        cost[better] = cost_trial[better]
+        damping = np.where(better, np.maximum(damping / 10, 1e-12), damping * 10)
+        if np.any(better):
+            J[better] = residuals_jac(x[better])
+        done |= damping > 1e16 # the trajectory has stalled, since no step in any direction reduces its cost
+
+        X[active[done]] = x[done]
+        keep = ~done
+        active, x, r, J, cost, damping = active[keep], x[keep], r[keep], J[keep], cost[keep], damping[keep]
+    X[active] = x
+    return X
+
+def lockstep_bfgs(error_func, error_jac, X, max_iterations, gtol=1e-10, ftol=1e-14, deadline=None):
+    """Runs a BFGS optimization from each row of X at the same time, using a backtracking line search.
+
+    Args:
+        error_func : A function that takes an array of shape (K, n) of parameter vectors and returns an array of shape (K,) of errors.
+        error_jac : A function that takes an array of shape (K, n) and returns a tuple of the errors and an array of shape (K, n) of their gradients.
+        X : An array of shape (K, n) of starting points.
+        max_iterations : The most iterations that any single trajectory will be advanced.
+        gtol : A trajectory stops once the norm of its gradient is smaller than this.
+        ftol : A trajectory stops once an iteration reduces its error by less than this fraction.
+        deadline : If set, every trajectory stops once the time, as returned by time.time(), passes this.
+
+    Returns:
+        np.ndarray : An array of shape (K, n) of the optimized parameters.
+    """
+    X = np.array(X, dtype='float64')
+    n = X.shape[1]
+    active = np.arange(len(X))
+    x = X.copy()
+    f, g = error_jac(x)
+    H = np.repeat(np.eye(n)[np.newaxis], len(X), axis=0) # the approximations of the inverse hessians
+    for _ in range(max_iterations):
+        if len(active) == 0 or (deadline is not None and time.time() > deadline):
+            break
+        p = -np.matmul(H, g[..., np.newaxis])[..., 0]
+        slope = np.sum(g * p, axis=1)
+        reset = slope >= 0 # the approximation is no longer positive definite, so restart from steepest descent
+        H[reset] = np.eye(n)
+        p[reset] = -g[reset]
+        slope[reset] = -np.sum(g[reset]**2, axis=1)
+
+        alpha = np.ones(len(active))
+        searching = np.ones(len(active), dtype=bool)
+        for _ in range(30):
+            s = np.nonzero(searching)[0]
+            if len(s) == 0:
+                break
+            f_trial = error_func(x[s] + alpha[s, np.newaxis] * p[s])
+            sufficient = f_trial <= f[s] + 1e-4 * alpha[s] * slope[s]
+            searching[s[sufficient]] = False
+            alpha[s[~sufficient]] /= 2
+        stalled = searching # the line search found no point with a sufficient decrease
+        alpha[stalled] = 0
+
+        step = alpha[:, np.newaxis] * p
+        x_new = x + step
+        f_new, g_new = error_jac(x_new)
+        y = g_new - g
+        sy = np.sum(step * y, axis=1)
+        update = sy > 1e-12
+        if np.any(update):
+            rho = 1 / sy[update]
+            V = np.eye(n) - rho[:, np.newaxis, np.newaxis] * np.matmul(step[update][:, :, np.newaxis], y[update][:, np.newaxis, :])
+            H[update] = np.matmul(np.matmul(V, H[update]), np.transpose(V, (0, 2, 1))) + rho[:, np.newaxis, np.newaxis] * np.matmul(step[update][:, :, np.newaxis], step[update][:, np.newaxis, :])
+        done = stalled | (np.linalg.norm(g_new, axis=1) <= gtol) | (f - f_new <= ftol * np.maximum(np.abs(f), 1e-300))
+        x, f, g = x_new, f_new, g_new
+
+        X[active[done]] = x[done]
+        keep = ~done
+        active, x, f, g, H = active[keep], x[keep], f[keep], g[keep], H[keep]
+    X[active] = x
+    return X
+
+class LockstepMultiStart_Solver(Solver):
+    """A multi-start solver that runs all of its local optimizations in a single process.
+
+    Rather than starting a process for each starting point like MultiStart_Solver and NaiveMultiStart_Solver, the trajectories are advanced together on a stacked array of parameters, so each iteration evaluates all of them with a few calls to matrix_batch and mat_jac_batch, and trajectories are dropped as they converge or stall.  This avoids oversubscribing the machine when the search already runs in parallel with a Parallelizer.
+
+    The objective needs to provide gen_error_residuals_batch and gen_error_residuals_jac_batch for Levenberg-Marquardt, or gen_error_func_batch and gen_error_jac_batch for BFGS, as MatrixDistanceObjective does.  Otherwise, the inner_solver is run from each starting point in turn.
+
+    When the solve_monitor option holds a SolveDeadline, the trajectories stop at the first iteration after the deadline, keeping the best parameters found so far, which only ever improve.  The max_solver_iterations option caps the iterations of the trajectories in the same way.  When the inner_solver is used instead, no more starting points are tried after the deadline, and the solve that is running stops at the deadline, and at the max_solver_iterations cap, if the inner_solver supports that.
+    """
+    def __init__(self, num_starts, method=None):
+        """
+        Args:
+            num_starts : The number of starting points to optimize from.
+            method : Either "least_squares" for Levenberg-Marquardt or "bfgs".  By default, least squares is used if the objective provides batched residuals, and BFGS otherwise.
+        """
+        self.num_starts = num_starts if num_starts else 1
+        self.method = method
+
+    def supported_features(self, options):
+        return frozenset(("deadline", "max_iterations"))
+
+    def solve_for_unitary(self, circuit, options, x0=None):
+        n = circuit.num_inputs
+        if n == 0:
+            return (circuit.matrix([]), np.array([]))
+        starting_points = np.random.rand(self.num_starts, n) * 2*np.pi
+        if x0 is not None:
+            starting_points[0] = x0
+        residuals = options.objective.gen_error_residuals_batch(circuit, options)
+        residuals_jac = options.objective.gen_error_residuals_jac_batch(circuit, options)
+        error_func = options.objective.gen_error_func_batch(circuit, options)
+        error_jac = options.objective.gen_error_jac_batch(circuit, options)
+        method = self.method
+        if method is None:
+            method = "least_squares" if residuals is not None and residuals_jac is not None else "bfgs"
+        monitor = solve_cutoff(options)
+        deadline = monitor.deadline if isinstance(monitor, SolveDeadline) else None
+        cap = max_iterations(options)
+
+        if method == "least_squares" and residuals is not None and residuals_jac is not None:
+            iterations = 100 * (n + 1) if cap is None else min(cap, 100 * (n + 1))
+            if options.max_quality_optimization:
+                X = lockstep_least_squares(residuals, residuals_jac, starting_points, iterations, ftol=5e-16, xtol=5e-16, deadline=deadline)
+            else:
+                X = lockstep_least_squares(residuals, residuals_jac, starting_points, iterations, deadline=deadline)
+        elif method == "bfgs" and error_func is not None and error_jac is not None:
+            X = lockstep_bfgs(error_func, error_jac, starting_points, 200 * n if cap is None else min(cap, 200 * n), gtol=options.threshold, deadline=deadline)
+        else:
+            if 'inner_solver' not in options:
+                options.inner_solver = default_solver(options)
+            X = []
+            for x in starting_points:
+                if deadline is not None and len(X) > 0 and time.time() > deadline:
+                    break
+                X.append(options.inner_solver.solve_for_unitary(circuit, options, x)[1])
+            X = np.array(X)
+        if deadline is not None and time.time() > deadline:
+            monitor.expired = True # the trajectories were stopped by the deadline, rather than through the monitor
+
+        if error_func is not None:
+            errors = error_func(X)
+        else:
+            single_error_func = options.objective.gen_error_func(circuit, options)
+            errors = [single_error_func(x) for x in X]
+        xopt = X[np.argmin(errors)]
+        return (circuit.matrix(xopt), xopt)
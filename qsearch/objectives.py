@@ -33,6 +33,21 @@ class Objective:
     def gen_error_residuals_jac(self, circuit, options):
         return None
 
+    # the batch versions of these functions take an array of shape (K, num_inputs) and evaluate all K parameter vectors at once, using matrix_batch and mat_jac_batch
+    # they return None for circuits that don't have those methods, such as the native circuits from the qsrs backend
+    # they are optional, and are used by solvers that run many optimizations in lock-step, such as LockstepMultiStart_Solver
+    def gen_error_func_batch(self, circuit, options):
+        return None
+
+    def gen_error_jac_batch(self, circuit, options):
+        return None
+
+    def gen_error_residuals_batch(self, circuit, options):
+        return None
+
+    def gen_error_residuals_jac_batch(self, circuit, options):
+        return None
+
 
 class MatrixDistanceObjective(Objective):
     def gen_error_func(self, circuit, options):
@@ -60,6 +75,39 @@ class MatrixDistanceObjective(Objective):
             return comparison.matrix_residuals_jac(target, *circuit.mat_jac(parameters))
         return generated_error_residuals_jac
 
+    def gen_error_func_batch(self, circuit, options):
+        if not hasattr(circuit, "matrix_batch"):
+            return None
+        target = options.target
+        def generated_error_func_batch(parameters):
+            return comparison.matrix_distance_squared_batch(target, circuit.matrix_batch(parameters))
+        return generated_error_func_batch
+
+    def gen_error_jac_batch(self, circuit, options):
+        if not hasattr(circuit, "matrix_batch"):
+            return None
+        target = options.target
+        def generated_error_jac_batch(parameters):
+            return comparison.matrix_distance_squared_jac_batch(target, *circuit.mat_jac_batch(parameters))
+        return generated_error_jac_batch
+
+    def gen_error_residuals_batch(self, circuit, options):
+        if not hasattr(circuit, "matrix_batch"):
+            return None
+        target = options.target
+        I = np.eye(options.target.shape[0])
+        def generated_error_residuals_batch(parameters):
+            return comparison.matrix_residuals_batch(target, circuit.matrix_batch(parameters), I)
+        return generated_error_residuals_batch
+
+    def gen_error_residuals_jac_batch(self, circuit, options):
+        if not hasattr(circuit, "matrix_batch"):
+            return None
+        target = options.target
+        def generated_error_residuals_jac_batch(parameters):
+            return comparison.matrix_residuals_jac_batch(target, *circuit.mat_jac_batch(parameters))
+        return generated_error_residuals_jac_batch
+
 class StateprepObjective(Objective):
     def gen_error_func(self, circuit, options):
         target = options.target
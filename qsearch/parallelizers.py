@@ -9,14 +9,23 @@ Attributes:
     ProcessPoolParallelizer : A Parallelizer based on concurrent.futures.ProcessPoolExecutor
     MPIParallelizer : A distributed MPI based Parallelizer
     SequentialParallelizer : Mostly for debugging purposes, a Parallelizer that runs tasks one at a time.
+    SharedParallelizer : A Parallelizer that runs tasks on the workers of another Parallelizer, for compilations running at once.
+    LayerStatistics : Measures how busy the workers of a Parallelizer were while solving a layer of search nodes.
 """
 
 from multiprocessing import get_context, cpu_count
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, Future
 from functools import partial
+from copy import copy
+from timeit import default_timer as timer
+from time import time
 import signal
 import sys
 
+from . import solvers as scsolver
+from .caches import cached_solve
+from .queues import LOW_FIDELITY, FULL_FIDELITY
+
 try:
     from mpi4py import MPI
 except ImportError:
@@ -32,24 +41,131 @@ def default_num_tasks(options):
     return cpu_count()
 
 def evaluate_step(tup, options):
-    step, depth, weight = tup
-    return (step, options.solver.solve_for_unitary(options.backend.prepare_circuit(step, options), options), depth, weight)
+    """Solves for the parameters of a single search node, and scores the result so the master process doesn't have to.
+
+    Args:
+        tup : (step, depth, weight, x0) or (step, depth, weight, x0, settings), where settings is a dict that may hold a "bound", such as the value of the node's parent, which the solve is aborted early for being predicted to end well above when the solve_cutoff option is set, and a "fidelity", which is queues.LOW_FIDELITY for a solve capped at multifidelity_iterations iterations.  A low fidelity solve is run as a full solve when the solver doesn't support the "max_iterations" feature of Solver.supported_features.
+
+    Returns:
+        tuple : (step, result, depth, weight, value, score, stats), where value is the result of the eval_func, score is the heuristic value for the node, or None if parallel_heuristic is disabled, and stats is a dict with the "solve_time" spent, whether the solve was "aborted" by the solve_cutoff, whether it was stopped because the deadline option "expired", the "fidelity" of the solve, and whether the result was "cached" in the solve_cache.
+    """
+    step, depth, weight, x0 = tup[:4]
+    settings = tup[4] if len(tup) > 4 and tup[4] is not None else {}
+    start = timer()
+    circuit = options.backend.prepare_circuit(step, options)
+    eval_func = options.objective.gen_eval_func(step, options)
+    fidelity = settings.get("fidelity", FULL_FIDELITY)
+    if fidelity == LOW_FIDELITY:
+        if scsolver.supports(options.solver, "max_iterations", options):
+            options = options.updated(max_solver_iterations=options.multifidelity_iterations)
+        else:
+            fidelity = FULL_FIDELITY # the solver can't be capped, so this is a full solve, which shouldn't be repeated
+    monitor = None
+    if options.solve_cutoff is not None and settings.get("bound") is not None and scsolver.supports(options.solver, "solve_cutoff", options):
+        monitor = scsolver.SolveCutoff(eval_func, settings["bound"], options.solve_cutoff)
+    if options.deadline is not None and scsolver.supports(options.solver, "deadline", options):
+        monitor = scsolver.SolveDeadline(options.deadline, monitor)
+    if monitor is not None:
+        result, cached = cached_solve(step, circuit, options.updated(solve_monitor=monitor), x0)
+    else:
+        result, cached = cached_solve(step, circuit, options, x0)
+    # solves in other processes, such as the ones run by a MultiStart_Solver, stop at the deadline with their own copy of the monitor, so the time is checked here instead
+    expired = options.deadline is not None and time() > options.deadline
+    value = eval_func(result[1])
+    if x0 is not None and options.warm_start_restarts > 0 and fidelity == FULL_FIDELITY and not cached and not expired:
+        # warm starts can get stuck in the parent's local minimum, so optionally also try some random starting points
+        for _ in range(options.warm_start_restarts):
+            if value < options.threshold or (options.deadline is not None and time() > options.deadline):
+                break
+            restart = options.solver.solve_for_unitary(circuit, options)
+            restart_value = eval_func(restart[1])
+            if restart_value < value:
+                value = restart_value
+                result = restart
+    score = options.heuristic(step, result[1], depth + weight, options) if options.parallel_heuristic else None
+    cutoff = monitor.monitor if isinstance(monitor, scsolver.SolveDeadline) else monitor
+    stats = {"solve_time": timer() - start, "aborted": cutoff is not None and cutoff.aborted, "expired": expired, "fidelity": fidelity, "cached": cached}
+    return (step, result, depth, weight, value, score, stats)
+
+class LayerStatistics():
+    """Measures how busy the workers of a Parallelizer were while solving one layer of search nodes, from the solve_time that evaluate_step reports for each node."""
+    def __init__(self, num_tasks):
+        """
+        Args:
+            num_tasks : The number of workers of the Parallelizer.
+        """
+        self.num_tasks = num_tasks
+        self.solve_times = []
+        self.start = timer()
+        self.wall_time = None
+
+    def measure(self, results):
+        """Yields each result from results, such as the ones from Parallelizer.solve_circuits_parallel, recording its solve time."""
+        for result in results:
+            self.solve_times.append(result[6]["solve_time"])
+            yield result
+
+    def finish(self):
+        """Records the end of the layer."""
+        self.wall_time = timer() - self.start
+
+    @property
+    def tasks(self):
+        return len(self.solve_times)
+
+    @property
+    def mean_time(self):
+        return sum(self.solve_times) / len(self.solve_times) if len(self.solve_times) > 0 else 0.0
+
+    @property
+    def max_time(self):
+        return max(self.solve_times, default=0.0)
+
+    @property
+    def utilization(self):
+        """The fraction of the time from the start of the layer to finish that the workers spent solving."""
+        wall_time = self.wall_time if self.wall_time is not None else timer() - self.start
+        if wall_time <= 0:
+            return 0.0
+        return min(1.0, sum(self.solve_times) / (self.num_tasks * wall_time))
 
 def single_task(opts):
     return 1
 
 def process_initializer():
     signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # forked workers inherit the SIGTERM handler that Project.run installs, which should only run in the master process
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
 
 class Parallelizer():
-    """Base class for all Parallelizers. Parallelizers calculate the value of multiple search nodes in parallel."""
+    """Base class for all Parallelizers. Parallelizers calculate the value of multiple search nodes in parallel.
+
+    When the deadline option is set, evaluate_step stops the solves that are still running once it passes, returning the best parameters found so far, so the compiler can return within a bounded time of the deadline.  This needs a Solver that supports the "deadline" feature of Solver.supported_features, and with other Solvers, such as the native solvers from qsrs, the solves that are running at the deadline run to completion.  Tasks that haven't started by then are dropped when the compiler calls done.
+    """
     def solve_circuits_parallel(self, tuples):
         """Calculate the value of search tree nodes in parallel."""
         return None
 
+    def submit(self, tup):
+        """Start calculating the value of a single search tree node, and return a concurrent.futures.Future for the result.
+
+        The default implementation calculates the value immediately using solve_circuits_parallel, so Parallelizers that can run tasks asynchronously should override it.
+        """
+        future = Future()
+        future.set_running_or_notify_cancel()
+        try:
+            future.set_result(next(iter(self.solve_circuits_parallel([tup]))))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
     def done(self):
-        """Finalize/Clean up any state needed to run the Parallelizer."""
-        pass
+        """Finalize/Clean up any state needed to run the Parallelizer.  This also calls done() on the Solver, so that Solvers which keep worker processes between calls can shut them down."""
+        options = getattr(self, "options", None)
+        if options is not None and "solver" in options:
+            solver_done = getattr(options.solver, "done", None) # native solvers don't have this
+            if solver_done is not None:
+                solver_done()
 
 class LokyParallelizer(Parallelizer):
     """A parallelizer based on Loky, a "deadlock-free" ProcessPoolExecutor.
@@ -59,11 +175,15 @@ class LokyParallelizer(Parallelizer):
     def __init__(self, options):
         options.set_smart_defaults(num_tasks=default_num_tasks)
         self.executor = get_reusable_executor(max_workers=options.num_tasks)
+        self.options = options
         self.process_func = partial(evaluate_step, options=options)
 
     def solve_circuits_parallel(self, tuples):
         return self.executor.map(self.process_func, tuples)
 
+    def submit(self, tup):
+        return self.executor.submit(self.process_func, tup)
+
 class MultiprocessingParallelizer(Parallelizer):
     """A Parallelizer based on muliprocessing. Note this cannot be used with the MultiStart_Solvers!"""
     def __init__(self, options):
@@ -74,14 +194,23 @@ class MultiprocessingParallelizer(Parallelizer):
         options.set_smart_defaults(num_tasks=default_num_tasks)
         self.pool = ctx.Pool(options.num_tasks, initializer=process_initializer)
         self.process_func = partial(evaluate_step, options=options)
+        self.options = options
 
     def solve_circuits_parallel(self, tuples):
         yield from self.pool.imap_unordered(self.process_func, tuples)
 
+    def submit(self, tup):
+        future = Future()
+        # the task can't be recalled once it is handed to the pool, so the future is marked as running right away
+        future.set_running_or_notify_cancel()
+        self.pool.apply_async(self.process_func, (tup,), callback=future.set_result, error_callback=future.set_exception)
+        return future
+
     def done(self):
         self.pool.close()
         self.pool.terminate()
         self.pool.join()
+        super().done()
 
 class ProcessPoolParallelizer(Parallelizer):
     """A Parallelizer based on concurrent.futures.ProcessPoolExecutor."""
@@ -94,12 +223,20 @@ class ProcessPoolParallelizer(Parallelizer):
             self.pool = ProcessPoolExecutor(options.num_tasks, initializer=process_initializer)
 
         self.process_func = partial(evaluate_step, options=options)
+        self.options = options
 
     def solve_circuits_parallel(self, tuples):
         return self.pool.map(self.process_func, tuples)
 
+    def submit(self, tup):
+        return self.pool.submit(self.process_func, tup)
+
     def done(self):
-        self.pool.shutdown()
+        if sys.version_info >= (3, 9, 0):
+            self.pool.shutdown(cancel_futures=True)
+        else:
+            self.pool.shutdown()
+        super().done()
 
 class MPIParallelizer(Parallelizer):
     """A distributed MPI based Parallelizer.
@@ -122,6 +259,7 @@ class MPIParallelizer(Parallelizer):
             self.tasks = self.comm.size
         eval = partial(evaluate_step, options)
         eval = self.comm.bcast(eval, root=0)
+        self.options = options
 
     def solve_circuits_parallel(self, tuples):
         # NOTE WELL: this should be kept in sync with the mpi_worker code in utils.py
@@ -145,6 +283,7 @@ class MPIParallelizer(Parallelizer):
 
     def done(self):
         self.comm.bcast(True, root=0)
+        super().done()
 
 class SequentialParallelizer(Parallelizer):
     """A Paralleizer that isn't, it runs tasks one at a time (mostly for debugging).
@@ -152,6 +291,30 @@ class SequentialParallelizer(Parallelizer):
     def __init__(self, options):
         options.set_smart_defaults(num_tasks=single_task)
         self.process_func = partial(evaluate_step, options=options)
+        self.options = options
 
     def solve_circuits_parallel(self, tuples):
         return map(self.process_func, tuples)
+
+class SharedParallelizer(Parallelizer):
+    """A Parallelizer that runs its tasks on the workers of another Parallelizer, with its own options, so that several compilations running at once in different threads can share one pool of workers.
+
+    Calling done does not shut down the workers, which is left to whoever created the other Parallelizer.  This works with any Parallelizer that evaluates its tasks with a process_func, which is every one in this module except MPIParallelizer.
+    """
+    def __init__(self, parallelizer, options):
+        if not hasattr(parallelizer, "process_func"):
+            raise ValueError("{} can't be shared because it doesn't evaluate tasks with a process_func.".format(type(parallelizer).__name__))
+        options.set_defaults(num_tasks=parallelizer.options.num_tasks)
+        self.parallelizer = copy(parallelizer)
+        self.parallelizer.options = options
+        self.parallelizer.process_func = partial(evaluate_step, options=options)
+        self.options = options
+
+    def solve_circuits_parallel(self, tuples):
+        return self.parallelizer.solve_circuits_parallel(tuples)
+
+    def submit(self, tup):
+        return self.parallelizer.submit(tup)
+
+    def done(self):
+        pass
@@ -0,0 +1,200 @@
+"""
+This module provides PortfolioCompiler, which runs several compilation strategies at once on a shared pool of workers, and returns the best result from any of them.
+
+Whether A* search, greedy search, or LEAP finishes first depends on the target, and there is no good way to tell ahead of time.  PortfolioCompiler runs each strategy in its own thread, with the solves from all of them going to the same Parallelizer.  The strategies share a SharedBound, which holds the lowest weight solution found so far, so each strategy stops expanding nodes that can no longer lead to a lower weight solution.  When a strategy finds a solution at the weight given by the lower_bound option, which is provably optimal, the other strategies are cancelled.
+
+Attributes:
+    PortfolioCompiler : A Compiler that runs several strategies at once and returns the best result.
+    SharedBound : The best solution found by the strategies of a PortfolioCompiler, which they use to prune and cancel their searches.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from timeit import default_timer as timer
+
+from .options import Options
+from .defaults import standard_defaults, standard_smart_defaults
+from .compiler import Compiler, SearchCompiler
+from .leap_compiler import LeapCompiler
+from .checkpoints import FileCheckpoint
+from .caches import circuit_weight
+from . import parallelizers, logging
+
+default_strategies = [
+        (SearchCompiler, {"search_type": "astar"}),
+        (SearchCompiler, {"search_type": "greedy"}),
+        (LeapCompiler, {}),
+        ]
+
+class SharedBound():
+    """The lowest weight solution found so far by the compilers in a portfolio, which is shared between their threads.
+
+    A compiler passed a SharedBound as the shared_bound option reports each new best result to it, stops pushing nodes onto its search queue that are not below the weight of the best solution, and stops searching once the SharedBound is cancelled.  When a SharedBound is pickled, such as when it is sent to worker processes along with the rest of the options, only the best solution is kept.
+    """
+    def __init__(self, threshold, lower_bound=0):
+        """
+        Args:
+            threshold : The value below which a result counts as a solution.
+            lower_bound : A lower bound on the weight of any solution.  A solution at this weight can't be improved on, so reporting one cancels the SharedBound.
+        """
+        self.threshold = threshold
+        self.lower_bound = lower_bound
+        self.weight = float('inf')
+        self.result = None
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+
+    def report(self, structure, parameters, value, weight):
+        """Records a result found by one of the compilers, if it is a solution with a lower weight than the best one so far.
+
+        Returns:
+            bool : True if the result became the best solution.
+        """
+        if value >= self.threshold:
+            return False
+        with self._lock:
+            if weight >= self.weight:
+                return False
+            self.weight = weight
+            self.result = {"structure": structure, "parameters": parameters}
+        if weight <= self.lower_bound:
+            self.cancel()
+        return True
+
+    def allows(self, weight):
+        """Returns True if a node at weight could still lead to a solution with a lower weight than the best one so far."""
+        return weight < self.weight
+
+    def cancel(self):
+        """Tells every compiler sharing this SharedBound to stop searching."""
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['_cancelled'] = self.cancelled
+        return state
+
+    def __setstate__(self, state):
+        cancelled = state.pop('_cancelled')
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        if cancelled:
+            self._cancelled.set()
+
+class _SharedWorkers():
+    # used as the parallelizer option of each strategy, so that every Parallelizer the strategies create runs on the same workers
+    def __init__(self, parallelizer):
+        self.parallelizer = parallelizer
+
+    def __call__(self, options):
+        return parallelizers.SharedParallelizer(self.parallelizer, options)
+
+    def __getstate__(self):
+        # the workers themselves can't be pickled, and the copies of the options sent to them don't need to create Parallelizers
+        return {"parallelizer": None}
+
+class PortfolioCompiler(Compiler):
+    """This Compiler runs several compilation strategies at once, sharing one Parallelizer and the best solution found so far between them, and returns the best result from any of them.
+
+    Options:
+        target (required) : The unitary matrix to be synthesized, in the form of a numpy ndarray with dtype="complex128".
+        strategies : A list of tuples of (compiler_class, overrides), where compiler_class is a Compiler class such as SearchCompiler or leap_compiler.LeapCompiler, and overrides is a dict of options that are set for that strategy only.  The default runs SearchCompiler with search_type "astar" and "greedy", and LeapCompiler.
+        parallelizer : The Parallelizer whose workers are shared by all of the strategies.  It must be one that evaluates its tasks with a process_func, which every Parallelizer other than MPIParallelizer does.
+        lower_bound : A function that returns a lower bound on the weight of any circuit that implements the target.  A solution at this weight is provably optimal, so the other strategies are cancelled once one is found.  See lower_bounds.py for more information.
+        result_store : A caches.ResultStore that is checked for a result for the target before running the strategies, and that the result is written back to afterwards.  The default is None.
+        logger : A qsearch.logging.Logger that will be used for logging the synthesis process.
+
+    Every other option is passed on to the strategies.  Each strategy gets its own Checkpoint that doesn't save anything, because their states can't be recovered independently.  If queue_spill_file is set, each strategy spills to its own file, named by appending the index of the strategy to it.
+    """
+    def __init__(self, options=Options()):
+        """
+        Args:
+            options: See class level documentation for the options PortfolioCompiler uses
+        """
+        self.options = Options()
+        self.options.set_defaults(**standard_defaults)
+        self.options.set_smart_defaults(**standard_smart_defaults)
+        self.options.set_defaults(strategies=default_strategies)
+        self.options = self.options.updated(options)
+
+    def compile(self, options=Options()):
+        """
+        Args:
+            options: See class level documentation for the options PortfolioCompiler uses
+
+        Returns:
+            dict : The result dict of the best strategy, which is the lowest weight solution if any strategy found one, and otherwise the closest result.
+        """
+        options = self.options.updated(options)
+        options.make_required("target")
+        logger = options.logger if "logger" in options else logging.Logger(verbosity=options.verbosity, stdout_enabled=options.stdout_enabled, output_file=options.log_file)
+        starttime = timer()
+        U = options.unitary_preprocessor(options.target)
+
+        store = options.result_store
+        if store is not None:
+            stored = store.get(options.target, options)
+            if stored is not None:
+                logger.logprint("Found a result for this target in the result store.")
+                return stored
+
+        bound = options.lower_bound(U, options) if options.lower_bound is not None else 0
+        shared = SharedBound(options.threshold, bound)
+        parallel = options.parallelizer(options)
+        workers = _SharedWorkers(parallel)
+        strategies = options.strategies
+        names = ["{}({})".format(compiler_class.__name__, ", ".join("{}={}".format(name, value) for name, value in overrides.items())) for compiler_class, overrides in strategies]
+        logger.logprint("Running {} strategies at once: {}".format(len(strategies), ", ".join(names)))
+
+        def run(index, compiler_class, overrides):
+            opts = options.updated(parallelizer=workers, shared_bound=shared, checkpoint=FileCheckpoint(Options()), result_store=None, logger=logger)
+            if opts.queue_spill_file is not None:
+                # the strategies' search queues can't share a spill file
+                opts.queue_spill_file = "{}.{}".format(opts.queue_spill_file, index)
+            opts = opts.updated(**overrides)
+            return compiler_class(opts).compile(opts)
+
+        results = []
+        errors = []
+        try:
+            executor = ThreadPoolExecutor(len(strategies))
+            try:
+                futures = {executor.submit(run, i, *strategy): name for i, (strategy, name) in enumerate(zip(strategies, names))}
+                for future in as_completed(futures):
+                    name = futures[future]
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        logger.logprint("Strategy {} failed with {}: {}".format(name, type(e).__name__, e))
+                        errors.append(e)
+                        continue
+                    value = options.objective.gen_eval_func(result["structure"], options)(result["parameters"])
+                    weight = circuit_weight(result["structure"])
+                    logger.logprint("Strategy {} finished with score {} at weight {} after {} seconds.".format(name, value, weight, timer() - starttime))
+                    results.append((name, result, value, weight))
+                    shared.report(result["structure"], result["parameters"], value, weight)
+            except BaseException:
+                # a KeyboardInterrupt or other error in this thread doesn't reach the strategies' threads, so they are cancelled rather than waited for
+                shared.cancel()
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+            executor.shutdown()
+        finally:
+            parallel.done()
+
+        if len(results) == 0:
+            raise errors[0]
+        solutions = [entry for entry in results if entry[2] < options.threshold]
+        if len(solutions) > 0:
+            name, result, value, weight = min(solutions, key=lambda entry: entry[3])
+        else:
+            name, result, value, weight = min(results, key=lambda entry: entry[2])
+        logger.logprint("Finished compilation with the result from {}, with score {} at weight {} after {} seconds.".format(name, value, weight, timer() - starttime))
+        if store is not None:
+            store.put(options.target, result, options)
+        return result
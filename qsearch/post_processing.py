@@ -21,9 +21,10 @@ from . import solvers as scsolver
 from .options import Options
 from .defaults import standard_defaults, standard_smart_defaults
 from . import parallelizers, backends
-from . import utils, heuristics, gates, logging, gatesets
-from .compiler import Compiler, SearchCompiler
+from . import utils, heuristics, gates, logging, gatesets, analytic
+from .compiler import Compiler, SearchCompiler, warm_start_parameters, drop_transpositions, compile_deadline, deadline_passed, check_solver_features
 from .checkpoints import ChildCheckpoint
+from .caches import cached_solve, circuit_weight
 
 class PostProcessor():
     """This class is used to modify circuits that have already been synthesized."""
@@ -65,7 +66,7 @@ class BasicSingleQubitReduction_PostProcessor(PostProcessor):
             while len(components) > 1:
                 newstr = components[0] + identitystr + "".join([component + gate for component in components[1:-1]]) + components[-1]
                 newcirc = eval(newstr)
-                mat, xopt = options.solver.solve_for_unitary(newcirc, options)
+                (mat, xopt), _ = cached_solve(newcirc, newcirc, options)
                 if options.objective.gen_eval_func(newcirc, options)(xopt) < options.threshold:
                     components = [components[0] + identitystr + components[1]] + components[2:]
                     finalx = xopt
@@ -109,7 +110,8 @@ class LEAPReoptimizing_PostProcessor(Compiler, PostProcessor):
     """A PostProcessor that re-optimizes LeapCompiler-compiled circuits via search.
 
     This PostProcessor puts "holes" in the circuit where LEAP fixed prefixes and runs
-    qsearch on those holes to reduce the total number of gates.
+    qsearch on those holes to reduce the total number of gates.  Its solves aren't given a
+    bound, so the solve_cutoff option has no effect here.
     """
     def __init__(self, options=Options()):
         self.options = Options()
@@ -121,7 +123,14 @@ class LEAPReoptimizing_PostProcessor(Compiler, PostProcessor):
         """Re-optimize a LEAP circuit. Pass "depth" to indicate the size to re-synthesize.
         It is recommended to call like:
         `project.post_process(post_processing.LEAPReoptimizing_PostProcessor(), solver=multistart_solvers.MultiStart_Solver(8), parallelizer=parallelizers.ProcessPoolParallelizer, depth=7)`
+
+        When the analytic_synthesis option is enabled and analytic.synthesize_for has a result for the target, the circuit is replaced by the analytic result if that uses no more CNOTs.
         """
+        if "analytic_synthesis" in options and options.analytic_synthesis:
+            U = options.unitary_preprocessor(options.target) if "unitary_preprocessor" in options else options.target
+            exact = analytic.synthesize_for(U, options)
+            if exact is not None and circuit_weight(exact["structure"]) <= circuit_weight(result["structure"]):
+                return exact
         if str(result['structure']).count('CNOT') <= (options.weight_limit if 'weight_limit' in options and options.weight_limit else options.reoptimize_size):
             return result
         if 'cut_depths' not in result:
@@ -147,8 +156,10 @@ class LEAPReoptimizing_PostProcessor(Compiler, PostProcessor):
         logger = options.logger if "logger" in options else logging.Logger(verbosity=options.verbosity, stdout_enabled=options.stdout_enabled, output_file=options.log_file)
 
         overall_startime = timer() # note, because all of this setup gets included in the total time, stopping and restarting the project may lead to time durations that are not representative of the runtime under normal conditions
-        qudits = int(np.round(np.log(np.shape(U)[0])/np.log(options.gateset.d)))
+        qudits = utils.qudit_count(np.shape(U)[0], options.gateset.d)
 
+        options.deadline = compile_deadline(options)
+        check_solver_features(options)
         parallel = options.parallelizer(options)
         recovered_outer = child_checkpoint.recover_parent()
         if recovered_outer is None:
@@ -164,7 +175,7 @@ class LEAPReoptimizing_PostProcessor(Compiler, PostProcessor):
             overall_best_pair, start_depth, midpoints, start_point, overall_best_value = recovered_outer
         try:
             while True:
-                if 'timeout' in options and timer() - overall_startime > options.timeout:
+                if ('timeout' in options and timer() - overall_startime > options.timeout) or deadline_passed(options):
                     break
                 best_circuit = overall_best_pair[0]
                 best_circuit_depth = len(best_circuit._subgates) - 1
@@ -173,13 +184,13 @@ class LEAPReoptimizing_PostProcessor(Compiler, PostProcessor):
                 else:
                     insertion_points = range(start_point,best_circuit_depth)
                 for point in insertion_points:
-                    if 'timeout' in options and timer() - overall_startime > options.timeout:
+                    if ('timeout' in options and timer() - overall_startime > options.timeout) or deadline_passed(options):
                         break
                     startime = timer() # note, because all of this setup gets included in the total time, stopping and restarting the project may lead to time durations that are not representative of the runtime under normal conditions
                     window_size = depth or options.reoptimize_size
                     root = ProductGate(*best_circuit._subgates[:point], *best_circuit._subgates[point + window_size:])
                     h = options.heuristic
-                    qudits = int(np.round(np.log(np.shape(U)[0])/np.log(options.gateset.d)))
+                    qudits = utils.qudit_count(np.shape(U)[0], options.gateset.d)
 
                     if options.gateset.d**qudits != np.shape(U)[0]:
                         raise ValueError("The target matrix of size {} is not compatible with qudits of size {}.".format(np.shape(U)[0], self.options.gateset.d))
@@ -192,7 +203,7 @@ class LEAPReoptimizing_PostProcessor(Compiler, PostProcessor):
                     if len(search_layers) <= 0:
                         logger.logprint("This gateset has no branching factor so only an initial optimization will be run.")
                         root = initial_layer
-                        result = options.solver.solve_for_unitary(options.backend.prepare_circuit(root, options), options)
+                        result, _ = cached_solve(root, options.backend.prepare_circuit(root, options), options)
                         return (root, result[1])
 
                     # TODO move these print statements somewhere else
@@ -215,7 +226,14 @@ class LEAPReoptimizing_PostProcessor(Compiler, PostProcessor):
                     tiebreaker = 0
                     rectime = 0
                     if recovered_state == None:
-                        result = options.solver.solve_for_unitary(options.backend.prepare_circuit(root, options), options)
+                        x0 = None
+                        if options.warm_start:
+                            # start the root from the current best parameters, with the parameters for the removed window cut out
+                            offsets = best_circuit.parameter_offsets
+                            window_start = offsets[min(point, len(offsets) - 1)]
+                            window_end = offsets[min(point + window_size, len(offsets) - 1)]
+                            x0 = np.concatenate((overall_best_pair[1][:window_start], overall_best_pair[1][window_end:]))
+                        result, _ = cached_solve(root, options.backend.prepare_circuit(root, options), options, x0)
                         best_value = options.objective.gen_eval_func(root, options)(result[1])
                         best_pair = (root, result[1])
                         logger.logprint("New best! {} at depth 0".format(best_value))
@@ -231,9 +249,10 @@ class LEAPReoptimizing_PostProcessor(Compiler, PostProcessor):
                         logger.logprint("Recovered state with best result {} at depth {}".format(best_value, best_depth))
 
                     options.generate_cache() # cache the results of smart_default settings, such as the default solver, before entering the main loop where the options will get pickled and the smart_default functions called many times because later caching won't persist cause of pickeling and multiple processes
+                    transpositions = set(gatesets.canonical_hash(tup[5]) for tup in queue) if options.transposition_table else None
 
                     while len(queue) > 0:
-                        if 'timeout' in options and timer() - overall_startime > options.timeout:
+                        if ('timeout' in options and timer() - overall_startime > options.timeout) or deadline_passed(options):
                             break
                         if best_value < options.threshold:
                             queue = []
@@ -247,9 +266,8 @@ class LEAPReoptimizing_PostProcessor(Compiler, PostProcessor):
                             logger.logprint("Popped a node with score: {} at depth: {}".format((tup[2]), tup[1]), verbosity=2)
 
                         then = timer()
-                        new_steps = [(current_tup[5].inserting(search_layer[0], depth=point), current_tup[1], search_layer[1]) for search_layer in search_layers for current_tup in popped]
-                        for step, result, current_depth, weight in parallel.solve_circuits_parallel(new_steps):
-                            current_value = options.objective.gen_eval_func(step, options)(result[1])
+                        new_steps = drop_transpositions([(current_tup[5].inserting(search_layer[0], depth=point), current_tup[1], search_layer[1], warm_start_parameters(current_tup[4], search_layer[0], current_tup[5].parameter_offsets[point]) if options.warm_start else None) for search_layer in search_layers for current_tup in popped], transpositions)
+                        for step, result, current_depth, weight, current_value, score, stats in parallel.solve_circuits_parallel(new_steps):
                             new_depth = current_depth + weight
                             if (current_value < best_value and (best_value >= options.threshold or new_depth <= best_depth)) or (current_value < options.threshold and new_depth < best_depth):
                                 best_value = current_value
@@ -257,8 +275,13 @@ class LEAPReoptimizing_PostProcessor(Compiler, PostProcessor):
                                 best_depth = new_depth
                                 logger.logprint("New best! score: {} at depth: {}".format(best_value, new_depth))
                             if depth is None or new_depth < depth - 1:
-                                heapq.heappush(queue, (h(step, result[1], new_depth, options), new_depth, current_value, tiebreaker, result[1], step))
+                                heapq.heappush(queue, (score if score is not None else h(step, result[1], new_depth, options), new_depth, current_value, tiebreaker, result[1], step))
                                 tiebreaker+=1
+                            if deadline_passed(options):
+                                break
+                        if deadline_passed(options):
+                            # the window's checkpoint is left as it was after the last completed layer
+                            break
                         logger.logprint("Layer completed after {} seconds".format(timer() - then), verbosity=2)
                         if (options.weight_limit is not None and best_depth >= options.weight_limit - 1) or ('reoptimize_size' in options and best_depth >= options.reoptimize_size - 1):
                             break
@@ -287,6 +310,8 @@ class LEAPReoptimizing_PostProcessor(Compiler, PostProcessor):
                         child_checkpoint.save(None)
                         child_checkpoint.save_parent((overall_best_pair, start_depth, midpoints, start_point, overall_best_value))
                         continue
+                if ('timeout' in options and timer() - overall_startime > options.timeout) or deadline_passed(options):
+                    break
                 if new_circuit_depth >= best_circuit_depth:
                     break
         finally:
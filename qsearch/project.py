@@ -9,6 +9,8 @@ import os
 import shutil
 import sys
 import pickle
+import signal
+import threading
 from multiprocessing import freeze_support
 from .compiler import SearchCompiler
 from . import solvers as scsolver
@@ -24,6 +26,12 @@ try:
 except ImportError:
     MPI = None
 
+class TerminationRequested(KeyboardInterrupt):
+    """Raised in the main thread when the process receives SIGTERM while a Project is running, so that the compilation stops the same way it does for Ctrl+C."""
+
+def _raise_termination(signum, frame):
+    raise TerminationRequested()
+
 class Project_Status(Enum):
     PROGRESS = 1
     COMPLETE = 2
@@ -204,7 +212,20 @@ class Project:
         self.options.set_smart_defaults(**smart_defaults)
 
     def run(self):
-        """Runs all of the compilations in the Project."""
+        """Runs all of the compilations in the Project.
+
+        If the process receives SIGTERM while this runs in the main thread, such as when a batch scheduler preempts the job, the current compilation is stopped the same way as for Ctrl+C, and its checkpoint is kept so that calling run again resumes it.
+        """
+        if threading.current_thread() is not threading.main_thread():
+            # signal handlers can only be installed from the main thread
+            return self._run()
+        previous = signal.signal(signal.SIGTERM, _raise_termination)
+        try:
+            return self._run()
+        finally:
+            signal.signal(signal.SIGTERM, previous if previous is not None else signal.SIG_DFL)
+
+    def _run(self):
         freeze_support()
         self.aborted = False
         self.logger.logprint("Started running project {}".format(self.name))
@@ -219,6 +240,17 @@ class Project:
 
             if self._compilation_status(name) == Project_Status.COMPLETE:
                 continue
+            store = runopt.result_store
+            if store is not None:
+                stored = store.get(runopt.target, runopt)
+                if stored is not None:
+                    self.logger.logprint("Found a result for {} in the result store.".format(name))
+                    cdict.update(**stored)
+                    cdict["time"] = 0
+                    self._compilations[name] = cdict
+                    self._save()
+                    continue
+                runopt.result_store = None # the result gets written back below, so the compiler doesn't need to look it up again
             sublogger = logging.Logger(runopt.stdout_enabled, os.path.join(self.folder, "{}-log.txt".format(name)), runopt.verbosity)
             runopt.logger = sublogger
             self.logger.logprint("Starting compilation of {}".format(name))
@@ -228,25 +260,23 @@ class Project:
                 starttime = time()
                 try:
                     result = compiler.compile(runopt)
-                except KeyboardInterrupt:
-                    self.aborted = True
-                    self.logger.logprint("\nStopping due to Ctrl+C...\n")
-                    self.status()
+                except KeyboardInterrupt as e:
+                    self._stop(e)
                     return
             else:
                 with threadpool_limits(limits=blas_threads, user_api='blas'):
                     starttime = time()
                     try:
                         result = compiler.compile(runopt)
-                    except KeyboardInterrupt:
-                        self.aborted = True
-                        self.logger.logprint("\nStopping due to Ctrl+C...\n")
-                        self.status()
+                    except KeyboardInterrupt as e:
+                        self._stop(e)
                         return
             endtime = time()
             self.logger.logprint("Finished compilation of {}".format(name))
             cdict.update(**result)
             cdict["time"] = endtime - starttime
+            if store is not None:
+                store.put(runopt.target, result, runopt)
             self._compilations[name] = cdict
             self._save()
             self.logger.logprint("Recorded results from compilation.", verbosity=2)
@@ -256,6 +286,11 @@ class Project:
             self.status(logger=self.logger)
         self.logger.logprint("Finished running project {}".format(self.name))
 
+    def _stop(self, interrupt):
+        self.aborted = True
+        self.logger.logprint("\nStopping due to {}...\n".format("SIGTERM" if isinstance(interrupt, TerminationRequested) else "Ctrl+C"))
+        self.status()
+
     def post_process(self, postprocessor, name=None, options=None, **xtraargs):
         """Post-processes the specified compilation, or all compilations if name is None, using the specified postprocessor.
 
@@ -0,0 +1,393 @@
+"""
+This module defines SearchQueue, the priority queue used by SearchCompiler to store the nodes of the search tree.
+
+Search nodes are stored in a compact form so that long searches do not run out of memory, and so that the queue can be checkpointed quickly.  Each node stores its circuit structure as a tuple of indices into a table of the distinct layers that have been seen, and its parameters are kept in a single contiguous array.  The ProductGate for a node is only rebuilt when the node is popped.
+
+The queue can also be given a maximum size, in which case the worst nodes are evicted when it grows too large.  Evicted nodes are either dropped, or spilled to a file on disk and read back once they are the best nodes left, which keeps exact search modes like djikstra exact.
+
+Attributes:
+    ParameterStore : Stores many parameter vectors in a single contiguous array.
+    MinMaxHeap : A double-ended priority queue that can remove both its smallest and its largest item.
+    SearchQueue : A priority queue of search nodes, which accepts and returns the same tuples as were used with heapq in SearchCompiler.
+    LOW_FIDELITY : The fidelity of a node whose parameters came from an iteration-capped solve, which needs a full solve before it is expanded.
+    FULL_FIDELITY : The fidelity of a node whose parameters came from a full solve.
+"""
+
+import os
+import pickle
+import sys
+import numpy as np
+
+from .gates import ProductGate
+
+LOW_FIDELITY = 0
+FULL_FIDELITY = 1
+
+class ParameterStore():
+    """Stores many parameter vectors in a single contiguous numpy array, referred to by integer handles.  The handles of removed vectors are reused, so the memory used grows with the number of vectors stored at once rather than the number ever added."""
+    def __init__(self, capacity=1024):
+        self._data = np.empty(capacity, dtype='float64')
+        self._size = 0
+        self._live = 0
+        self._starts = np.empty(64, dtype='int64')
+        self._lengths = np.empty(64, dtype='int64')
+        self._handles = 0
+        self._free = [] # handles that were removed, and can be given out again
+
+    def add(self, v):
+        """Copies the parameter vector v into the store, and returns a handle that can be used to retrieve it."""
+        v = np.asarray(v, dtype='float64').ravel()
+        if self._size + len(v) > len(self._data):
+            self._data = np.resize(self._data, max(2*len(self._data), self._size + len(v)))
+        if len(self._free) > 0:
+            handle = self._free.pop()
+        else:
+            if self._handles == len(self._starts):
+                self._starts = np.resize(self._starts, 2*len(self._starts))
+                self._lengths = np.resize(self._lengths, 2*len(self._lengths))
+            handle = self._handles
+            self._handles += 1
+        self._data[self._size:self._size+len(v)] = v
+        self._starts[handle] = self._size
+        self._lengths[handle] = len(v)
+        self._size += len(v)
+        self._live += len(v)
+        return handle
+
+    def get(self, handle):
+        """Returns a copy of the parameter vector stored under handle."""
+        start = self._starts[handle]
+        return self._data[start:start+self._lengths[handle]].copy()
+
+    def remove(self, handle):
+        """Frees the space used by the parameter vector stored under handle, which may be returned by add again.  The space is reclaimed once more than half of the array is unused."""
+        self._live -= self._lengths[handle]
+        self._lengths[handle] = -1
+        self._free.append(handle)
+        if self._size > 1024 and 2*self._live < self._size:
+            self._compact()
+
+    def _compact(self):
+        data = np.empty(max(1024, 2*self._live), dtype='float64')
+        size = 0
+        for handle in np.nonzero(self._lengths[:self._handles] >= 0)[0]:
+            start = self._starts[handle]
+            length = self._lengths[handle]
+            data[size:size+length] = self._data[start:start+length]
+            self._starts[handle] = size
+            size += length
+        self._data = data
+        self._size = size
+
+    def copy(self):
+        other = ParameterStore.__new__(ParameterStore)
+        other._data = self._data[:max(self._size, 1)].copy()
+        other._size = self._size
+        other._live = self._live
+        other._starts = self._starts[:max(self._handles, 1)].copy()
+        other._lengths = self._lengths[:max(self._handles, 1)].copy()
+        other._handles = self._handles
+        other._free = list(self._free)
+        return other
+
+    def __getstate__(self):
+        # trim the unused capacity so that checkpoints stay small
+        state = self.__dict__.copy()
+        state['_data'] = self._data[:self._size]
+        state['_starts'] = self._starts[:self._handles]
+        state['_lengths'] = self._lengths[:self._handles]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if '_free' not in state:
+            # checkpoints from before handles were reused
+            self._free = [int(handle) for handle in np.nonzero(self._lengths[:self._handles] < 0)[0]]
+        if len(self._data) == 0:
+            self._data = np.empty(1024, dtype='float64')
+        if len(self._starts) == 0:
+            self._starts = np.empty(64, dtype='int64')
+            self._lengths = np.empty(64, dtype='int64')
+
+    @property
+    def nbytes(self):
+        return self._data.nbytes + self._starts.nbytes + self._lengths.nbytes
+
+
+class MinMaxHeap():
+    """A double-ended priority queue, implemented as a min-max heap, which can remove both its smallest and its largest item in O(log n) time."""
+    def __init__(self, items=()):
+        self._items = []
+        for item in items:
+            self.push(item)
+
+    def _is_min_level(self, i):
+        return (i+1).bit_length() % 2 == 1
+
+    def _swap(self, i, j):
+        a = self._items
+        a[i], a[j] = a[j], a[i]
+
+    def push(self, item):
+        """Adds item to the heap."""
+        a = self._items
+        a.append(item)
+        i = len(a) - 1
+        if i == 0:
+            return
+        parent = (i-1) // 2
+        if self._is_min_level(i):
+            if a[parent] < a[i]:
+                self._swap(i, parent)
+                self._bubble_up(parent, lambda x, y: x > y)
+            else:
+                self._bubble_up(i, lambda x, y: x < y)
+        else:
+            if a[i] < a[parent]:
+                self._swap(i, parent)
+                self._bubble_up(parent, lambda x, y: x < y)
+            else:
+                self._bubble_up(i, lambda x, y: x > y)
+
+    def _bubble_up(self, i, better):
+        a = self._items
+        while i > 2:
+            grandparent = ((i-1)//2 - 1) // 2
+            if not better(a[i], a[grandparent]):
+                break
+            self._swap(i, grandparent)
+            i = grandparent
+
+    def _trickle_down(self, i, better):
+        a = self._items
+        n = len(a)
+        while 2*i + 1 < n:
+            descendants = [c for c in (2*i+1, 2*i+2, 4*i+3, 4*i+4, 4*i+5, 4*i+6) if c < n]
+            m = descendants[0]
+            for c in descendants[1:]:
+                if better(a[c], a[m]):
+                    m = c
+            if not better(a[m], a[i]):
+                break
+            self._swap(i, m)
+            if m <= 2*i + 2:
+                break
+            parent = (m-1) // 2
+            if better(a[parent], a[m]):
+                self._swap(m, parent)
+            i = m
+
+    def _remove(self, i):
+        a = self._items
+        item = a[i]
+        last = a.pop()
+        if i < len(a):
+            a[i] = last
+            self._trickle_down(i, (lambda x, y: x < y) if self._is_min_level(i) else (lambda x, y: x > y))
+        return item
+
+    def min(self):
+        """Returns the smallest item without removing it."""
+        return self._items[0]
+
+    def _max_index(self):
+        a = self._items
+        if len(a) <= 2:
+            return len(a) - 1
+        return 1 if a[2] < a[1] else 2
+
+    def max(self):
+        """Returns the largest item without removing it."""
+        return self._items[self._max_index()]
+
+    def pop_min(self):
+        """Removes and returns the smallest item."""
+        return self._remove(0)
+
+    def pop_max(self):
+        """Removes and returns the largest item."""
+        return self._remove(self._max_index())
+
+    def copy(self):
+        other = MinMaxHeap()
+        other._items = list(self._items)
+        return other
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+
+class SearchQueue():
+    """A priority queue of search nodes, ordered the same way as the heapq based queue SearchCompiler used to use.
+
+    Nodes are pushed and popped as tuples of (heuristic, weight, value, tiebreaker, parameters, structure), where structure is a ProductGate.  Each node also records the fidelity of the solve that produced it, which is FULL_FIDELITY unless it is given to push, and is appended to the tuple by pop when with_fidelity is True.
+    """
+    def __init__(self, entries=(), max_size=None, spill_file=None):
+        """
+        Args:
+            entries : Nodes to initially add to the queue.
+            max_size : The maximum number of nodes to keep in memory, or None for unlimited.  When there are more, the nodes with the worst heuristic values are evicted.
+            spill_file : A path to a file where evicted nodes are written, so they can be read back if the search gets to them.  The default of None discards evicted nodes.
+        """
+        self._heap = MinMaxHeap()
+        self._layers = []
+        self._layer_indices = dict()
+        self._ids = dict()
+        self._store = ParameterStore()
+        self._entry_bytes = 0
+        self.max_size = max_size
+        self.spill_file = spill_file
+        self._spill_start = 0 # the offset in spill_file of the first node that hasn't been read back
+        self._spill_end = 0 # the offset in spill_file just past the last node written by this queue
+        self._spilled = 0
+        self._spilled_min = None
+        self.evictions = 0
+        self.reloads = 0
+        for entry in entries:
+            self.push(*entry)
+
+    def _intern(self, layer):
+        index = self._ids.get(id(layer))
+        if index is not None:
+            return index
+        key = layer.structural_digest
+        index = self._layer_indices.get(key)
+        if index is None:
+            index = len(self._layers)
+            self._layers.append(layer)
+            self._layer_indices[key] = index
+            # self._layers keeps every interned layer alive, so its id can't be reused by another object
+            self._ids[id(layer)] = index
+        return index
+
+    def _entry_size(self, entry):
+        return sys.getsizeof(entry) + sys.getsizeof(entry[5])
+
+    def push(self, heuristic, weight, value, tiebreaker, parameters, structure, fidelity=FULL_FIDELITY, evict=True):
+        """Adds a node to the queue.  If evict is False, the queue may temporarily grow beyond max_size."""
+        indices = tuple(self._intern(layer) for layer in structure._subgates)
+        self._insert((heuristic, weight, value, tiebreaker, self._store.add(parameters), indices, fidelity), evict)
+
+    def _insert(self, entry, evict=True):
+        self._entry_bytes += self._entry_size(entry)
+        self._heap.push(entry)
+        if evict and self.max_size is not None:
+            while len(self._heap) > max(self.max_size, 1):
+                self._evict(self._heap.pop_max())
+
+    def _evict(self, entry):
+        self.evictions += 1
+        self._entry_bytes -= self._entry_size(entry)
+        parameters = self._store.get(entry[4])
+        self._store.remove(entry[4])
+        if self.spill_file is None:
+            return
+        with open(self.spill_file, "ab") as f:
+            f.seek(self._spill_end)
+            f.truncate()
+            pickle.dump((entry[0], entry[1], entry[2], entry[3], parameters) + tuple(entry[5:]), f, pickle.HIGHEST_PROTOCOL)
+            self._spill_end = f.tell()
+        self._spilled += 1
+        if self._spilled_min is None or entry[:4] < self._spilled_min:
+            self._spilled_min = entry[:4]
+
+    def _reload(self):
+        # read back every spilled node, and then re-insert them, which may spill the worst ones again
+        entries = []
+        try:
+            with open(self.spill_file, "rb") as f:
+                f.seek(self._spill_start)
+                while f.tell() < self._spill_end:
+                    entries.append(pickle.load(f))
+        except FileNotFoundError:
+            pass # the spilled nodes are lost if the file was deleted, such as when resuming a finished compilation
+        self._spill_start = self._spill_end
+        self._spilled = 0
+        self._spilled_min = None
+        self.reloads += len(entries)
+        for entry in entries:
+            self._insert(entry[:4] + (self._store.add(entry[4]),) + tuple(entry[5:]))
+
+    def _reload_if_needed(self):
+        # the best node may be one that was spilled
+        if self._spilled > 0 and (len(self._heap) == 0 or self._spilled_min < self._heap.min()[:4]):
+            self._reload()
+
+    def min_heuristic(self):
+        """Returns the heuristic value of the node that pop would return next, without removing it."""
+        self._reload_if_needed()
+        return self._heap.min()[0]
+
+    def pop(self, with_fidelity=False):
+        """Removes the node with the lowest heuristic value from the queue and returns it as a tuple of (heuristic, weight, value, tiebreaker, parameters, structure), or (heuristic, weight, value, tiebreaker, parameters, structure, fidelity) if with_fidelity is True."""
+        self._reload_if_needed()
+        entry = self._heap.pop_min()
+        tup = self._materialize(entry)
+        if with_fidelity:
+            tup += (entry[6] if len(entry) > 6 else FULL_FIDELITY,) # entries saved by older versions don't record their fidelity
+        return tup
+
+    def _materialize(self, entry):
+        self._entry_bytes -= self._entry_size(entry)
+        parameters = self._store.get(entry[4])
+        self._store.remove(entry[4])
+        return (entry[0], entry[1], entry[2], entry[3], parameters, self.structure(entry[5]))
+
+    def structure(self, indices):
+        """Builds the ProductGate for a tuple of layer indices."""
+        return ProductGate(*[self._layers[index] for index in indices])
+
+    def structures(self):
+        """Returns a generator over the ProductGates of every node held in memory, without removing them."""
+        return (self.structure(entry[5]) for entry in self._heap)
+
+    def clear(self):
+        """Removes every node from the queue."""
+        self._heap = MinMaxHeap()
+        self._store = ParameterStore()
+        self._entry_bytes = 0
+        self._spill_start = self._spill_end
+        self._spilled = 0
+        self._spilled_min = None
+
+    def delete_spill_file(self):
+        """Deletes the spill file along with any nodes that are still in it."""
+        if self.spill_file is not None:
+            try:
+                os.remove(self.spill_file)
+            except FileNotFoundError:
+                pass
+        self._spill_start = 0
+        self._spill_end = 0
+        self._spilled = 0
+        self._spilled_min = None
+
+    def copy(self):
+        """Returns a copy of the queue that can be modified independently, except that they share the spill file, so only one of them should evict nodes."""
+        other = SearchQueue.__new__(SearchQueue)
+        other.__dict__.update(self.__dict__)
+        other._heap = self._heap.copy()
+        other._layers = list(self._layers)
+        other._layer_indices = dict(self._layer_indices)
+        other._ids = dict(self._ids)
+        other._store = self._store.copy()
+        return other
+
+    def nbytes(self):
+        """Returns an estimate of the memory used by the queue, in bytes."""
+        return sys.getsizeof(self._heap._items) + self._entry_bytes + self._store.nbytes
+
+    def __len__(self):
+        return len(self._heap) + self._spilled
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_ids'] # object ids don't survive pickling
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._ids = {id(layer) : index for index, layer in enumerate(self._layers)}
@@ -2,6 +2,7 @@
 Defines Solver, a class used to wrap various numerical optimizers for finding parameters such that an ansatz circuit is a solution to a target unitary.
 """
 import sys
+from time import time
 
 import numpy as np
 import scipy as sp
@@ -27,7 +28,7 @@ def default_solver(options, x0=None):
 
     # check if Rust works on the layers
     gateset = options.gateset
-    qudits = 0 if "target" not in options else int(np.log(options.target.shape[0]) // np.log(gateset.d))
+    qudits = 0 if "target" not in options else utils.qudit_count(options.target.shape[0], gateset.d)
     if "target" not in options:
         objectives_opt.target = np.eye(2, dtype='complex128')
     layers = [(gateset.initial_layer(qudits), 0)] + gateset.search_layers(qudits)
@@ -85,12 +86,158 @@ def default_solver(options, x0=None):
         return BFGS_Jac_Solver()
     # the default will have been chosen from LeastSquares, BFGS, or COBYLA
 
+class SolveAborted(Exception):
+    """Raised from inside a Solver's objective functions by a SolveCutoff or SolveDeadline to stop a solve early.  It holds the best parameters seen so far."""
+    def __init__(self, x, reason="it was not predicted to get close to its bound"):
+        super().__init__("The solve was aborted because {}.".format(reason))
+        self.x = x
+
+class SolveCutoff():
+    """Watches the progress of a solve, and aborts it when its value is predicted to end well above a bound, such as the value of the parent node in the search tree.
+
+    Every window evaluations of the Solver's objective, the eval_func is evaluated at the current parameters.  The rate at which the best value improved over the last two windows is then applied once for every window the solve has already run for, which extrapolates it over twice as many more windows as that, and if that prediction is still more than factor times the bound, SolveAborted is raised.
+    """
+    def __init__(self, eval_func, bound, factor, window=10):
+        self.eval_func = eval_func
+        self.bound = bound
+        self.factor = factor
+        self.window = window
+        self.calls = 0
+        self.history = []
+        self.best_value = float('inf')
+        self.best_x = None
+        self.aborted = False
+
+    def check(self, x):
+        """Records an evaluation at x, raising SolveAborted if the solve looks hopeless."""
+        self.calls += 1
+        if self.calls % self.window != 0:
+            return
+        value = self.eval_func(x)
+        if value < self.best_value:
+            self.best_value = value
+            self.best_x = np.array(x)
+        self.history.append(self.best_value)
+        if len(self.history) < 3:
+            return
+        previous = self.history[-3]
+        rate = self.best_value / previous if previous > 0 else 0
+        predicted = self.best_value * rate ** len(self.history)
+        if predicted > self.factor * self.bound:
+            self.aborted = True
+            raise SolveAborted(self.best_x)
+
+    def wrap(self, f):
+        """Returns a version of the objective function f that calls check on every evaluation."""
+        def checked(x, *args):
+            self.check(x)
+            return f(x, *args)
+        return checked
+
+def objective_value(output):
+    # the value of an objective function's output, which is a number, a tuple of a number and its gradient, or an array of residuals
+    if isinstance(output, tuple):
+        output = output[0]
+    if np.ndim(output) > 0:
+        return np.sum(np.square(output))
+    return output
+
+class SolveDeadline():
+    """Aborts a solve once the time, as returned by time.time(), passes a deadline, with the best parameters found so far.  It can wrap another monitor such as a SolveCutoff, which gets checked as well, so a Solver only needs to support one monitor.
+    """
+    def __init__(self, deadline, monitor=None):
+        self.deadline = deadline
+        self.monitor = monitor
+        self.expired = False
+        self.best_value = float('inf')
+        self.best_x = None
+
+    @property
+    def aborted(self):
+        return self.expired or (self.monitor is not None and self.monitor.aborted)
+
+    def check(self, x):
+        """Records an evaluation at x, raising SolveAborted if the deadline has passed or the wrapped monitor aborts the solve."""
+        if time() > self.deadline:
+            self.expired = True
+            raise SolveAborted(np.array(x) if self.best_x is None else self.best_x, "its deadline passed")
+        if self.monitor is not None:
+            self.monitor.check(x)
+
+    def record(self, x, output):
+        """Keeps track of the parameters x with the best value, from the output of the objective function at x."""
+        value = objective_value(output)
+        if value < self.best_value:
+            self.best_value = value
+            self.best_x = np.array(x)
+
+    def wrap(self, f):
+        """Returns a version of the objective function f that calls check on every evaluation, and records its output."""
+        def checked(x, *args):
+            self.check(x)
+            output = f(x, *args)
+            self.record(x, output)
+            return output
+        return checked
+
+def solve_cutoff(options):
+    # returns the SolveCutoff or SolveDeadline that evaluate_step put in options, if any
+    return options.solve_monitor if "solve_monitor" in options else None
+
+def monitor_flags(monitor):
+    # returns whether the solves checked by a solve_monitor were aborted by a SolveCutoff or stopped by a SolveDeadline, so that a copy of the monitor in another process can send them back
+    if isinstance(monitor, SolveDeadline):
+        return (monitor.monitor is not None and monitor.monitor.aborted, monitor.expired)
+    return (monitor is not None and monitor.aborted, False)
+
+def record_monitor_flags(monitor, flags):
+    # records the flags returned by monitor_flags for a copy of monitor in another process
+    aborted, expired = flags
+    if isinstance(monitor, SolveDeadline):
+        monitor.expired = monitor.expired or expired
+        monitor = monitor.monitor
+    if monitor is not None and aborted:
+        monitor.aborted = True
+
+def max_iterations(options):
+    # returns the iteration cap that evaluate_step put in options for low fidelity solves, if any
+    return options.max_solver_iterations if "max_solver_iterations" in options else None
+
+def capped_jacobian(f, iterations):
+    # Levenberg-Marquardt evaluates the jacobian once at the start and once after each accepted step, at the best parameters so far, so this stops it after that many iterations
+    calls = [0]
+    def capped(x, *args):
+        calls[0] += 1
+        if calls[0] > iterations:
+            raise SolveAborted(np.array(x), "it reached its iteration cap")
+        return f(x, *args)
+    return capped
+
+def supports(solver, feature, options):
+    """Returns True if solver supports feature, as listed by Solver.supported_features.  Solvers that aren't subclasses of Solver, such as the native solvers from qsrs, don't support any."""
+    supported_features = getattr(solver, "supported_features", None) # native solvers don't have this
+    return supported_features is not None and feature in supported_features(options)
+
 class Solver():
     """This class is used to wrap numerical optimizers for circuit solving."""
     def solve_for_unitary(self, circuit, options, x0=None):
         """Finds the best parameters that minimize error_func or error_residuals between the unitary from the circuit and options.target."""
         raise NotImplementedError
 
+    def supported_features(self, options):
+        """Returns the set of optional features that this Solver supports with options.  The Parallelizers only make use of the features that the Solver supports, and the compilers log a warning when an option needs one that it doesn't.
+
+        The features are:
+            solve_cutoff : Stopping the solve with the best parameters found so far when the SolveCutoff in the solve_monitor option raises SolveAborted.
+            deadline : Stopping the solve with the best parameters found so far once the deadline of the SolveDeadline in the solve_monitor option passes.
+            max_iterations : Stopping the solve after the number of iterations in the max_solver_iterations option, where an iteration is one accepted step of the optimizer.
+        """
+        return frozenset()
+
+    def done(self):
+        """Clean up any state, such as worker processes, that the Solver kept between calls to solve_for_unitary.  This is called by the Parallelizer when it is done."""
+        pass
+
     def __eq__(self, other):
         if self is other:
             return True
@@ -111,7 +258,7 @@ class CMA_Solver(Solver):
         except ImportError:
             print("ERROR: Could not find cma, try running pip install quantum_synthesis[cma]", file=sys.stderr)
             sys.exit(1)
-        error_func = options.gen_error_func(circuit, options)
+        error_func = options.objective.gen_error_func(circuit, options)
         initial_guess = 'np.random.rand({})*2*np.pi'.format(circuit.num_inputs) if x0 is None else x0
         xopt, _ = cma.fmin2(error_func, initial_guess, 0.25, {'verb_disp':0, 'verb_log':0, 'bounds' : [0,2*np.pi]}, restarts=2)
         return (circuit.matrix(xopt), xopt)
@@ -133,29 +280,51 @@ class DIY_Solver(Solver):
     def solve_for_unitary(self, circuit, options, x0=None):
         error_func = options.objective.gen_error_func(circuit, options)
         initial_guess = np.array(np.random.rand(circuit.num_inputs))*2*np.pi if x0 is None else x0
-        x = f(error_func, initial_guess)
+        x = self.f(error_func, initial_guess)
+        return (circuit.matrix(x), x)
 
 class BFGS_Jac_Solver(Solver):
     """A solver based on the BFGS implementation in scipy.  It requires gradients."""
+    def supported_features(self, options):
+        return frozenset(("solve_cutoff", "deadline", "max_iterations"))
+
     def solve_for_unitary(self, circuit, options, x0=None):
         error_jac = options.objective.gen_error_jac(circuit, options)
-        result = sp.optimize.minimize(error_jac, np.random.rand(circuit.num_inputs)*2*np.pi if x0 is None else x0, method='BFGS', jac=True, tol=options.threshold)
-        xopt = result.x
+        cutoff = solve_cutoff(options)
+        if cutoff is not None:
+            error_jac = cutoff.wrap(error_jac)
+        try:
+            result = sp.optimize.minimize(error_jac, np.random.rand(circuit.num_inputs)*2*np.pi if x0 is None else x0, method='BFGS', jac=True, tol=options.threshold, options={'maxiter': max_iterations(options)})
+            xopt = result.x
+        except SolveAborted as e:
+            xopt = e.x
         return (circuit.matrix(xopt), xopt)
 
 class LeastSquares_Jac_Solver(Solver):
     """Uses the Leavenberg-Marquardt least-squares optimizer in scipy."""
+    def supported_features(self, options):
+        return frozenset(("solve_cutoff", "deadline", "max_iterations"))
+
     def solve_for_unitary(self, circuit, options, x0=None):
         # This solver is usually faster than BFGS, but has some caveats
         # 1. This solver relies on matrix residuals, and therefore ignores the specified error_func, making it currently not suitable for alternative synthesis goals like stateprep
         # 2. This solver (currently) does not correct for an overall phase, and so may not be able to find a solution for some gates with some gatesets.  It has been tested and works fine with QubitCNOTLinear, so any single-qubit and CNOT-based gateset is likely to work fine.
         error_residuals = options.objective.gen_error_residuals(circuit, options)
         error_residuals_jac = options.objective.gen_error_residuals_jac(circuit, options)
-        if options.max_quality_optimization:
-            result = sp.optimize.least_squares(error_residuals, np.random.rand(circuit.num_inputs)*2*np.pi if x0 is None else x0, error_residuals_jac, method="lm", ftol=5e-16, xtol=5e-16, gtol=1e-15)
-        else:
-            result = sp.optimize.least_squares(error_residuals, np.random.rand(circuit.num_inputs)*2*np.pi if x0 is None else x0, error_residuals_jac, method="lm")
-        xopt = result.x
+        cutoff = solve_cutoff(options)
+        if cutoff is not None:
+            error_residuals = cutoff.wrap(error_residuals)
+        if max_iterations(options) is not None:
+            # max_nfev would count evaluations of the residuals, including the ones for rejected steps, rather than iterations
+            error_residuals_jac = capped_jacobian(error_residuals_jac, max_iterations(options))
+        try:
+            if options.max_quality_optimization:
+                result = sp.optimize.least_squares(error_residuals, np.random.rand(circuit.num_inputs)*2*np.pi if x0 is None else x0, error_residuals_jac, method="lm", ftol=5e-16, xtol=5e-16, gtol=1e-15)
+            else:
+                result = sp.optimize.least_squares(error_residuals, np.random.rand(circuit.num_inputs)*2*np.pi if x0 is None else x0, error_residuals_jac, method="lm")
+            xopt = result.x
+        except SolveAborted as e:
+            xopt = e.x
         return (circuit.matrix(xopt), xopt)
 
     @property
@@ -10,11 +10,15 @@ Attributes:
     matrix_residuals : The default error_residuals.  Returns residuals based on difference between the poduct of the implemented matrix and the hermitian conjugate of the target and the identitiy.
     matrix_residuals_jac : Returns the jacobian of matrix_residuals.  Does not return the value of matrix_residuals as well.
     remap : Remaps a unitary for acting on qudits in a different order.
+    remove_global_phase : Rotates a unitary by a global phase into a canonical form, so that unitaries that differ only by a global phase become equal.
+    phase_invariant_digest : Returns a digest of a unitary that ignores its global phase.
     upgrade_qudits : Upgrades a unitary from a lower qudit size to a larger qudit size.
 """
+from hashlib import md5
 import numpy as np
 import scipy as sp
 import scipy.linalg
+import scipy.optimize
 
 try:
     from mpi4py import MPI
@@ -74,6 +78,24 @@ def nearest_unitary(A):
     except Exception:
         return A
 
+def remove_global_phase(U, decimals=8):
+    """Rotates U by a global phase so that its largest entry, after rounding to decimals places, is a positive real number.  Matrices that differ only by a global phase have the same canonical form, up to rounding."""
+    U = np.asarray(U, dtype='complex128')
+    flat = U.ravel()
+    pivot = flat[np.argmax(np.round(np.abs(flat), decimals))] # rounding first keeps the choice stable between entries of (nearly) equal magnitude
+    if np.abs(pivot) == 0:
+        return U.copy()
+    return U * (np.abs(pivot) / pivot)
+
+def phase_invariant_digest(U, decimals=8):
+    """An md5 digest of the matrix U, which is the same for matrices that differ only by a global phase, after rounding their entries to decimals places."""
+    canonical = remove_global_phase(U, decimals)
+    hasher = md5(repr(canonical.shape).encode())
+    # adding 0.0 turns negative zeros into positive ones, which have different bytes
+    hasher.update((np.round(canonical.real, decimals) + 0.0).tobytes())
+    hasher.update((np.round(canonical.imag, decimals) + 0.0).tobytes())
+    return hasher.digest()
+
 def index_test(i, di, df):
     if i < df:
         return False
@@ -166,7 +188,52 @@ def random_near_identity(n, alpha):
     H = H + H.T.conjugate()
     # generate a unitary matrix from the hermitian matrix that is not far from the identity
     return np.array(sp.linalg.expm(1j * H * alpha))
-    
+
+_identity_parameters = dict()
+
+def near_identity_parameters(gate):
+    """
+    Finds parameters that set every parameterized subgate of a gate as close to the identity as possible.
+
+    Args:
+        gate : A qsearch.gates.Gate.  KroneckerGate and ProductGate are handled by solving each of their subgates separately.
+
+    Returns:
+        np.ndarray : A vector of gate.num_inputs parameters.
+    """
+    subgates = getattr(gate, "_subgates", None)
+    if subgates is not None:
+        if len(subgates) == 0:
+            return np.zeros(0)
+        return np.concatenate([near_identity_parameters(subgate) for subgate in subgates])
+    if gate.num_inputs == 0:
+        return np.zeros(0)
+    key = repr(gate)
+    if key not in _identity_parameters:
+        I = np.eye(gate.dimension, dtype='complex128')
+        distance = lambda v: matrix_distance_squared(I, gate.matrix(v))
+        # the all-zeros and all-pi starting points cover the common gates, and a deterministic set of random starts covers the rest
+        starts = [np.zeros(gate.num_inputs), np.full(gate.num_inputs, np.pi)]
+        starts += list(np.random.RandomState(0).rand(8, gate.num_inputs)*2*np.pi)
+        best = None
+        for start in starts:
+            result = sp.optimize.minimize(distance, start, method='BFGS')
+            if best is None or result.fun < best.fun:
+                best = result
+            if best.fun < 1e-12:
+                break
+        _identity_parameters[key] = np.array(best.x % (2*np.pi))
+    return _identity_parameters[key].copy()
+
+def qudit_count(dimension, d=2):
+    """Returns the number of qudits of size d needed for a unitary of size dimension, using exact integer arithmetic.  If dimension isn't a power of d, the result is rounded up."""
+    qudits = 0
+    size = 1
+    while size < dimension:
+        size *= d
+        qudits += 1
+    return qudits
+
 def remap(U, order, d=2):
     U = np.array(U, dtype='complex128')
 
@@ -0,0 +1,63 @@
+from qsearch import analytic, gatesets, unitaries, compiler, defaults, Options
+from qsearch.utils import matrix_distance_squared
+from qsearch.gates import *
+from scipy.stats import unitary_group
+import numpy as np
+
+gateset = gatesets.QubitCNOTLinear()
+
+def random_local(rng):
+    return np.kron(unitary_group.rvs(2, random_state=rng), unitary_group.rvs(2, random_state=rng))
+
+def check(U, cnots):
+    result = analytic.synthesize(U, gateset)
+    assert result is not None
+    assert matrix_distance_squared(result["structure"].matrix(result["parameters"]), U) < 1e-10
+    assert len(result["structure"]._subgates) - 1 == cnots
+
+def test_zyz_parameters():
+    rng = np.random.default_rng(0)
+    for _ in range(10):
+        U = unitary_group.rvs(2, random_state=rng)
+        assert matrix_distance_squared(U3Gate().matrix(analytic.zyz_parameters(U)), U) < 1e-12
+    for U in [np.eye(2), np.array([[0, 1], [1, 0]]), np.diag([1, -1])]:
+        assert matrix_distance_squared(U3Gate().matrix(analytic.zyz_parameters(U)), U) < 1e-12
+
+def test_cnot_counts():
+    rng = np.random.default_rng(1)
+    cnot = CNOTGate().matrix([])
+    cases = [(np.eye(4), 0), (cnot, 1), (CZGate().matrix([]), 1), (ISwapGate().matrix([]), 2), (unitaries.qft(4), 3)]
+    cases += [(analytic._nonlocal(0.3, 0, 0.2), 2), (analytic._nonlocal(0, 0.7, -0.1), 2), (analytic._nonlocal(np.pi/2 + 0.3, 0.2, np.pi), 2)]
+    cases += [(unitary_group.rvs(4, random_state=rng), 3)]
+    for U, cnots in cases:
+        assert analytic.cnot_count(U) == cnots
+        check(random_local(rng) @ U @ random_local(rng) * np.exp(1j*rng.uniform(0, 2*np.pi)), cnots)
+
+def test_one_qubit():
+    check(unitaries.qft(2), 0)
+
+def test_unsupported():
+    assert analytic.synthesize(unitaries.qft(8), gateset) is None
+    assert analytic.synthesize(unitaries.qft(4), gatesets.QubitCZLinear()) is None
+
+def test_compiler():
+    options = Options(target=unitaries.qft(4), stdout_enabled=False)
+    result = compiler.SearchCompiler(options).compile()
+    assert len(result["structure"]._subgates) == 4
+    assert matrix_distance_squared(result["structure"].matrix(result["parameters"]), unitaries.qft(4)) < 1e-10
+
+def test_stateprep():
+    # the target of a stateprep compilation is the identity, so the analytic result would be wrong for it
+    state = np.array([1, -1]) / np.sqrt(2)
+    options = Options(target_state=state, defaults=defaults.stateprep_defaults, smart_defaults=defaults.stateprep_smart_defaults, stdout_enabled=False)
+    options.target = options.target # compilers require the target to be set explicitly, as Project does
+    assert analytic.synthesize_for(options.target, compiler.SearchCompiler(options).options) is None
+    result = compiler.SearchCompiler(options).compile()
+    output = result["structure"].matrix(result["parameters"]) @ options.initial_state
+    assert np.isclose(np.abs(np.vdot(output, state)), 1)
+
+def test_weight_limit():
+    U = unitaries.qft(4)
+    assert analytic.synthesize_for(U, compiler.SearchCompiler(Options(target=U)).options) is not None
+    assert analytic.synthesize_for(U, compiler.SearchCompiler(Options(target=U, weight_limit=1)).options) is None
+    assert analytic.synthesize_for(U, compiler.SearchCompiler(Options(target=U, weight_limit=3)).options) is not None
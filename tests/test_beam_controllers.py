@@ -0,0 +1,56 @@
+from qsearch import beam_controllers, parallelizers, unitaries, compiler, utils, Options
+from qsearch.defaults import standard_defaults
+
+def beam_options(**xtraargs):
+    options = Options(**xtraargs)
+    options.set_defaults(**standard_defaults)
+    return options
+
+def layer(solve_times, num_tasks):
+    stats = parallelizers.LayerStatistics(num_tasks)
+    list(stats.measure((None,)*6 + ({"solve_time": t},) for t in solve_times))
+    stats.finish()
+    return stats
+
+def test_fixed_beams():
+    assert beam_controllers.FixedBeams(beam_options(num_tasks=8), 3).beams == 2
+    assert beam_controllers.FixedBeams(beam_options(num_tasks=2), 3).beams == 1
+    assert beam_controllers.FixedBeams(beam_options(num_tasks=8, beams=5), 3).beams == 5
+    assert beam_controllers.FixedBeams(beam_options(num_tasks=8), 3).admits(0.0, 100.0)
+
+def test_adaptive_beams_fill_workers():
+    # 2 beams of 3 successors leave 2 of 8 workers idle, while 5 beams fill 2 rounds of solves but for one worker
+    controller = beam_controllers.AdaptiveBeams(beam_options(num_tasks=8), 3)
+    assert controller.beams == 5
+    assert controller.predicted_utilization(5) > controller.predicted_utilization(2)
+    assert beam_controllers.AdaptiveBeams(beam_options(num_tasks=8), 4).beams == 2
+    assert beam_controllers.AdaptiveBeams(beam_options(num_tasks=1), 3).beams == 1
+    assert beam_controllers.AdaptiveBeams(beam_options(num_tasks=8, max_beams=3), 3).beams <= 3
+
+def test_adaptive_beams_uneven_solves():
+    controller = beam_controllers.AdaptiveBeams(beam_options(num_tasks=8), 4)
+    assert controller.beams == 2
+    even = controller.predicted_utilization(2)
+    # one solve taking much longer than the rest leaves the other workers idle, so more rounds of solves are run at once
+    controller.record_layer(layer([1.0]*7 + [8.0], 8), 2)
+    assert controller.beams > 2 and controller.beams <= controller.max_beams
+    assert controller.predicted_utilization(2) < even
+    fixed = beam_controllers.AdaptiveBeams(beam_options(num_tasks=8, beams=2), 4)
+    fixed.record_layer(layer([1.0]*7 + [8.0], 8), 2)
+    assert fixed.beams == 2 and fixed.slack is None
+
+def test_beam_slack():
+    controller = beam_controllers.AdaptiveBeams(beam_options(num_tasks=8), 3)
+    assert controller.admits(1.0, 2.0)
+    assert not controller.admits(1.0, 2.5)
+    assert beam_controllers.AdaptiveBeams(beam_options(num_tasks=8, beam_slack=None), 3).admits(1.0, 100.0)
+
+def test_layer_statistics():
+    stats = layer([0.5, 1.5], 2)
+    assert stats.tasks == 2 and stats.mean_time == 1.0 and stats.max_time == 1.5
+    assert 0.0 <= stats.utilization <= 1.0
+
+def test_adaptive_compile():
+    options = Options(target=unitaries.qft(8), parallelizer=parallelizers.SequentialParallelizer, num_tasks=4, stdout_enabled=False)
+    result = compiler.SearchCompiler(options).compile()
+    assert utils.matrix_distance_squared(result["structure"].matrix(result["parameters"]), unitaries.qft(8)) < 1e-10
@@ -0,0 +1,126 @@
+from qsearch import Project, unitaries, utils, gatesets, caches, parallelizers, solvers, multistart_solvers
+from qsearch.gates import ProductGate
+from qsearch.options import Options
+from qsearch.defaults import standard_defaults, standard_smart_defaults
+import numpy as np
+import pickle
+
+def make_options(target):
+    options = Options(target=target)
+    options.set_defaults(**standard_defaults)
+    options.set_smart_defaults(**standard_smart_defaults)
+    return options
+
+def test_phase_invariant_digest():
+    U = unitaries.qft(4)
+    assert utils.phase_invariant_digest(U) == utils.phase_invariant_digest(np.exp(0.7j) * U)
+    assert utils.phase_invariant_digest(U) != utils.phase_invariant_digest(unitaries.qft(4).T.conj())
+
+def test_solve_cache_key():
+    cache = caches.SolveCache()
+    root = ProductGate(gatesets.QubitCNOTLinear().initial_layer(2))
+    options = make_options(unitaries.qft(4))
+    key = cache.key(root, options)
+    assert key == cache.key(root, make_options(-1j * unitaries.qft(4)))
+    assert key != cache.key(root, options.updated(max_quality_optimization=True))
+    assert key != cache.key(gatesets.QubitCNOTLinear().successors(root)[0][0], options)
+
+def test_solve_cache_lru(tmp_path):
+    cache = caches.SolveCache(max_size=2, path=str(tmp_path / "cache"))
+    for i in range(3):
+        cache.put(str(i), np.full(3, i))
+    assert len(cache) == 2
+    assert cache.get("0")[0] == 0 # evicted from memory, but still on disk
+    assert cache.stats()["disk_hits"] == 1
+    shared = pickle.loads(pickle.dumps(cache))
+    assert len(shared) == 0
+    assert shared.get("2")[0] == 2
+    assert shared.get("3") is None
+    assert shared.hit_rate == 0.5
+
+def test_cached_solve():
+    cache = caches.SolveCache()
+    options = make_options(unitaries.qft(4))
+    options.solve_cache = cache
+    step = ProductGate(gatesets.QubitCNOTLinear().initial_layer(2))
+    first = parallelizers.evaluate_step((step, 0, 1, None), options)
+    second = parallelizers.evaluate_step((step, 0, 1, None), options)
+    assert not first[6]["cached"] and second[6]["cached"]
+    assert np.array_equal(first[1][1], second[1][1])
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+def test_cached_solve_deadline():
+    # a solve stopped by the deadline depends on when it started, so it isn't cached
+    cache = caches.SolveCache()
+    options = make_options(unitaries.qft(4))
+    options.solve_cache = cache
+    options.solver = multistart_solvers.LockstepMultiStart_Solver(4)
+    options.deadline = 0.0
+    step = ProductGate(gatesets.QubitCNOTLinear().initial_layer(2))
+    monitor = solvers.SolveDeadline(options.deadline)
+    caches.cached_solve(step, options.backend.prepare_circuit(step, options), options.updated(solve_monitor=monitor))
+    assert monitor.expired
+    assert parallelizers.evaluate_step((step, 0, 1, None), options)[6]["expired"]
+    assert len(cache) == 0
+
+def test_solve_cache_project(project, check_project):
+    cache = caches.SolveCache()
+    project.add_compilation('qft2', unitaries.qft(4))
+    project['solve_cache'] = cache
+    project['parallelizer'] = parallelizers.SequentialParallelizer
+    project['analytic_synthesis'] = False
+    project.run()
+    misses = cache.misses
+    project.reset()
+    project.run()
+    check_project(project)
+    assert cache.misses == misses and cache.hits >= misses
+
+def test_result_store(tmp_path, check_project):
+    store = caches.ResultStore(str(tmp_path / "store"))
+    first = Project(str(tmp_path / "first"))
+    first.add_compilation('qft2', unitaries.qft(4))
+    first['result_store'] = store
+    first['analytic_synthesis'] = False
+    first.run()
+    assert store.misses == 1 and store.hits == 0
+    second = Project(str(tmp_path / "second"))
+    second.add_compilation('qft2', np.exp(0.3j) * unitaries.qft(4))
+    second['result_store'] = caches.ResultStore(str(tmp_path / "store"))
+    second['analytic_synthesis'] = False
+    second.run()
+    check_project(second)
+    assert second['result_store'].hits == 1
+    assert second['result_store'].get(unitaries.qft(4), second.get_options('qft2').updated(threshold=1e-12)) is None
+
+def test_circuit_weight():
+    root = ProductGate(gatesets.QubitCNOTLinear().initial_layer(3))
+    child = gatesets.QubitCNOTLinear().successors(root)[0][0]
+    assert caches.circuit_weight(root) == 0
+    assert caches.circuit_weight(child.appending(child._subgates[-1])) == 2
+
+def test_result_store_compiler(tmp_path):
+    from qsearch.compiler import SearchCompiler
+    store = caches.ResultStore(str(tmp_path / "store"))
+    options = Options(target=unitaries.qft(4), result_store=store, parallelizer=parallelizers.SequentialParallelizer, analytic_synthesis=False, stdout_enabled=False)
+    first = SearchCompiler(options).compile()
+    second = SearchCompiler(options).compile()
+    assert store.hits == 1
+    assert repr(first["structure"]) == repr(second["structure"])
+
+def test_result_store_stateprep(tmp_path):
+    # every stateprep target of the same size is the identity, so results are kept apart by their target_state
+    from qsearch import defaults
+    store = caches.ResultStore(str(tmp_path / "store"))
+    def stateprep_options(state):
+        options = make_options(np.eye(2, dtype='complex128'))
+        options.update(Options(target_state=state, defaults=defaults.stateprep_defaults, smart_defaults=defaults.stateprep_smart_defaults))
+        return options
+    plus = stateprep_options(np.array([1, 1]) / np.sqrt(2))
+    minus = stateprep_options(np.array([1, -1]) / np.sqrt(2))
+    structure = ProductGate(gatesets.QubitCNOTLinear().initial_layer(1))
+    parameters = np.array([np.pi/2, 0, 0]) # prepares the plus state from the zero state
+    store.put(plus.target, {"structure": structure, "parameters": parameters}, plus)
+    assert store.get(plus.target, plus) is not None
+    assert store.get(minus.target, minus) is None
+    assert store.get(plus.target, make_options(np.eye(2, dtype='complex128'))) is None
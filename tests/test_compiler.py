@@ -0,0 +1,176 @@
+from qsearch import unitaries, utils, gatesets, compiler, parallelizers, solvers, multistart_solvers, Options
+from qsearch.gates import *
+import numpy as np
+from scipy.stats import unitary_group
+from timeit import default_timer as timer
+import pytest
+import sys
+
+def test_near_identity_parameters():
+    layer = gatesets.QubitCNOTLinear().search_layers(3)[0][0]
+    v = utils.near_identity_parameters(layer)
+    expected = np.kron(CNOTGate().matrix([]), np.eye(2))
+    assert utils.matrix_distance_squared(layer.matrix(v), expected) < 1e-10
+
+def test_warm_start_parameters():
+    layer = gatesets.QubitCNOTLinear().search_layers(3)[1][0]
+    parent = np.arange(9, dtype='float64')
+    x0 = compiler.warm_start_parameters(parent, layer)
+    assert len(x0) == 9 + layer.num_inputs
+    assert np.array_equal(x0[:9], parent)
+    x0 = compiler.warm_start_parameters(parent, layer, 3)
+    assert np.array_equal(x0[:3], parent[:3])
+    assert np.array_equal(x0[3+layer.num_inputs:], parent[3:])
+
+def test_warm_start(project, check_project):
+    project.add_compilation('qft3', unitaries.qft(8))
+    project['warm_start'] = True
+    project['warm_start_restarts'] = 1
+    project.run()
+    check_project(project)
+
+def test_async_search(project, check_project):
+    project.add_compilation('qft3', unitaries.qft(8))
+    project['async_search'] = True
+    project.run()
+    check_project(project)
+
+def test_async_search_sequential(project, check_project):
+    project.add_compilation('qft2', unitaries.qft(4))
+    project['async_search'] = True
+    project['parallelizer'] = parallelizers.SequentialParallelizer
+    project['analytic_synthesis'] = False
+    project.run()
+    check_project(project)
+
+def test_max_queue_size(project, check_project, tmp_path):
+    project.add_compilation('qft3', unitaries.qft(8))
+    project['max_queue_size'] = 2
+    project['queue_spill_file'] = str(tmp_path / "spill")
+    project.run()
+    check_project(project)
+    assert not (tmp_path / "spill").exists()
+
+def test_solve_cutoff(project, check_project):
+    project.add_compilation('qft3', unitaries.qft(8))
+    project['solve_cutoff'] = 2.0
+    project['solver'] = solvers.LeastSquares_Jac_Solver() # the native solvers don't support this
+    project.run()
+    check_project(project)
+
+def test_transposition_table(project, check_project):
+    project.add_compilation('qft3', unitaries.qft(8))
+    project['transposition_table'] = True
+    project.run()
+    check_project(project)
+
+def test_check_solver_features():
+    options = compiler.SearchCompiler(Options(target=unitaries.qft(4), solve_cutoff=2.0, solver=solvers.LeastSquares_Jac_Solver())).options
+    compiler.check_solver_features(options)
+    assert options.solve_cutoff == 2.0
+    options = compiler.SearchCompiler(Options(target=unitaries.qft(4), solve_cutoff=2.0, solver=solvers.COBYLA_Solver())).options
+    with pytest.warns(UserWarning):
+        compiler.check_solver_features(options)
+    assert options.solve_cutoff is None
+    options = compiler.SearchCompiler(Options(target=unitaries.qft(4), deadline=0.0, solver=solvers.COBYLA_Solver())).options
+    with pytest.warns(UserWarning):
+        compiler.check_solver_features(options)
+    # the multistart solvers support whatever their inner solver does
+    options = compiler.SearchCompiler(Options(target=unitaries.qft(4), solver=multistart_solvers.MultiStart_Solver(2), inner_solver=solvers.BFGS_Jac_Solver())).options
+    assert solvers.supports(options.solver, "solve_cutoff", options) == (sys.platform != 'win32')
+    assert solvers.supports(multistart_solvers.PooledMultiStart_Solver(2), "deadline", options)
+    assert not solvers.supports(multistart_solvers.PooledMultiStart_Solver(2), "solve_cutoff", options)
+    options.inner_solver = solvers.COBYLA_Solver()
+    assert not solvers.supports(options.solver, "solve_cutoff", options)
+    options = compiler.SearchCompiler(Options(target=unitaries.qft(4), multifidelity_iterations=5, solver=solvers.COBYLA_Solver())).options
+    with pytest.warns(UserWarning):
+        compiler.check_solver_features(options)
+    assert options.multifidelity_iterations is None
+
+def test_solve_statistics():
+    stats = compiler.SolveStatistics()
+    stats.record({"solve_time": 2.0, "aborted": False})
+    stats.record({"solve_time": 4.0, "aborted": False})
+    stats.record({"solve_time": 1.0, "aborted": True})
+    assert stats.saved_time() == 2.0
+
+def test_multifidelity(project, check_project):
+    project.add_compilation('qft3', unitaries.qft(8))
+    project['multifidelity_iterations'] = 5
+    project['solver'] = solvers.LeastSquares_Jac_Solver() # the native solvers don't support this
+    project.run()
+    check_project(project)
+
+def test_multifidelity_async(project, check_project):
+    project.add_compilation('qft2', unitaries.qft(4))
+    project['multifidelity_iterations'] = 5
+    project['solver'] = solvers.LeastSquares_Jac_Solver() # the native solvers don't support this
+    project['async_search'] = True
+    project['analytic_synthesis'] = False
+    project['parallelizer'] = parallelizers.SequentialParallelizer
+    project.run()
+    check_project(project)
+
+def test_seed_structures():
+    gateset = gatesets.QubitCNOTLinear()
+    root = ProductGate(gateset.initial_layer(3))
+    seeds = compiler.seed_structures(root, gateset, 2, 256)
+    assert len(seeds) == 4
+    assert all(weight == 2 and len(structure._subgates) == 3 for structure, weight in seeds)
+    assert compiler.seed_structures(root, gateset, 2, 3)[0][1] == 1
+    x0 = compiler.seed_parameters(root, np.zeros(root.num_inputs), seeds[0][0])
+    assert len(x0) == seeds[0][0].num_inputs
+
+def test_lower_bound(project, check_project):
+    project.add_compilation('qft3', unitaries.qft(8))
+    project['parallelizer'] = parallelizers.SequentialParallelizer
+    project['max_seeds'] = 3
+    project.run()
+    check_project(project)
+
+class StartingPointSolver(solvers.LeastSquares_Jac_Solver):
+    starting_points = []
+    def solve_for_unitary(self, circuit, options, x0=None):
+        StartingPointSolver.starting_points.append(x0)
+        return super().solve_for_unitary(circuit, options, x0)
+
+def test_lower_bound_seeds_cold_start():
+    # without warm_start, the seeds are solved from random parameters like any other node
+    StartingPointSolver.starting_points = []
+    options = Options(target=unitaries.qft(8), lower_bound=lambda U, options: 2, solver=StartingPointSolver(), parallelizer=parallelizers.SequentialParallelizer, analytic_synthesis=False, stdout_enabled=False)
+    compiler.SearchCompiler(options).compile()
+    assert len(StartingPointSolver.starting_points) > 1
+    assert all(x0 is None for x0 in StartingPointSolver.starting_points)
+
+def test_compile_iter():
+    options = Options(target=unitaries.qft(8), parallelizer=parallelizers.SequentialParallelizer, stdout_enabled=False)
+    records = list(compiler.SearchCompiler(options).compile_iter())
+    assert len(records) > 1
+    assert all(set(record) == {"structure", "parameters", "score", "weight", "time", "nodes"} for record in records)
+    assert all(a["score"] > b["score"] for a, b in zip(records, records[1:]) if a["weight"] == b["weight"])
+    assert all(a["nodes"] <= b["nodes"] and a["time"] <= b["time"] for a, b in zip(records, records[1:]))
+    assert records[-1]["score"] < 1e-10
+    assert utils.matrix_distance_squared(records[-1]["structure"].matrix(records[-1]["parameters"]), unitaries.qft(8)) < 1e-10
+
+def test_compile_iter_stop_early():
+    calls = []
+    class CountingParallelizer(parallelizers.SequentialParallelizer):
+        def done(self):
+            calls.append(True)
+            super().done()
+    options = Options(target=unitaries.qft(8), parallelizer=CountingParallelizer, stdout_enabled=False)
+    iterator = compiler.SearchCompiler(options).compile_iter()
+    first = next(iterator)
+    assert first["weight"] == 0 and first["nodes"] == 1
+    iterator.close()
+    assert len(calls) > 0
+
+def test_timeout_within_layer():
+    # a random 4-qubit target can't be reached in a few seconds, so the search is stopped by the timeout partway through a layer
+    target = unitary_group.rvs(16, random_state=np.random.default_rng(0))
+    for async_search in (False, True):
+        options = Options(target=target, timeout=2, async_search=async_search, parallelizer=parallelizers.SequentialParallelizer, lower_bound=None, stdout_enabled=False)
+        start = timer()
+        result = compiler.SearchCompiler(options).compile()
+        assert timer() - start < 6
+        assert utils.matrix_distance_squared(result["structure"].matrix(result["parameters"]), target) < 1
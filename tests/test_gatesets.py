@@ -1,4 +1,7 @@
 from qsearch import gatesets, unitaries, advanced_unitaries, backends
+from qsearch.gates import ProductGate, U3Gate
+from hashlib import md5
+import pickle
 
 def test_qubit_cnot_linear(project, check_project):
     project['gateset'] = gatesets.QubitCNOTLinear()
@@ -30,3 +33,40 @@ def test_adjacency_list(project, check_project):
     project.add_compilation('qft3', unitaries.qft(8))
     project.run()
     check_project(project)
+
+def test_canonical_hash():
+    gateset = gatesets.QubitCNOTLinear()
+    layers = [layer[0] for layer in gateset.search_layers(4)]
+    root = ProductGate(gateset.initial_layer(4))
+    # layers on disjoint qubits commute, so both orders are equivalent
+    assert gatesets.canonical_hash(root.appending(layers[0]).appending(layers[2])) == gatesets.canonical_hash(root.appending(layers[2]).appending(layers[0]))
+    assert gatesets.canonical_hash(root.appending(layers[0]).appending(layers[1])) != gatesets.canonical_hash(root.appending(layers[1]).appending(layers[0]))
+
+def test_canonical_hash_ring():
+    gateset = gatesets.QubitCNOTRing()
+    layers = [layer[0] for layer in gateset.search_layers(4)]
+    root = ProductGate(gateset.initial_layer(4))
+    assert gatesets.canonical_hash(root.appending(layers[1]).appending(layers[3])) == gatesets.canonical_hash(root.appending(layers[3]).appending(layers[1]))
+    assert gatesets.canonical_hash(root.appending(layers[0]).appending(layers[3])) != gatesets.canonical_hash(root.appending(layers[3]).appending(layers[0]))
+
+def test_structural_metadata():
+    gateset = gatesets.QutritCPIPhaseLinear()
+    root = ProductGate(gateset.initial_layer(2))
+    circuit = root.appending(gateset.search_layers(2)[0][0])
+    assert circuit.dimension == 9 == circuit.matrix([0]*circuit.num_inputs).shape[0]
+    assert circuit.layers == tuple(circuit._subgates)
+    assert circuit.parameter_offsets == (0, root.num_inputs, circuit.num_inputs)
+    assert circuit.layers[0].parameter_offsets == (0, 8, 16)
+
+def test_structural_digest():
+    gateset = gatesets.QubitCNOTLinear()
+    root = ProductGate(gateset.initial_layer(3))
+    layers = [layer[0] for layer in gateset.search_layers(3)]
+    appended = root.appending(layers[0]).appending(layers[1])
+    inserted = root.appending(layers[1]).inserting(layers[0], depth=1)
+    rebuilt = ProductGate(*appended._subgates)
+    assert appended == rebuilt == inserted and hash(appended) == hash(rebuilt) == hash(inserted)
+    assert appended != root.appending(layers[1]).appending(layers[0])
+    assert pickle.loads(pickle.dumps(appended)).structural_digest == appended.structural_digest
+    # digests only depend on the structure, so they are the same in every Python session
+    assert U3Gate().structural_digest == md5(b"U3Gate()").digest()
@@ -48,3 +48,74 @@ def test_gradients(gate):
 
     for i in range(gate.num_inputs):
         assert totaldiff[i] < eps
+
+def reference_matrix(gate, v):
+    # evaluates gate by walking its subgates, as KroneckerGate and ProductGate did before they used EvaluationPlan
+    if isinstance(gate, (KroneckerGate, ProductGate)):
+        U = None
+        index = 0
+        for subgate in gate._subgates:
+            M = reference_matrix(subgate, v[index:index+subgate.num_inputs])
+            index += subgate.num_inputs
+            if U is None:
+                U = M
+            elif isinstance(gate, KroneckerGate):
+                U = np.kron(U, M)
+            else:
+                U = np.matmul(M, U)
+        return U
+    return gate.matrix(v)
+
+PLAN_GATES = [gate for gate in RUST_GATES if isinstance(gate, (KroneckerGate, ProductGate))] + [
+    ProductGate(KroneckerGate(ZGate(), U1Gate()), CZGate(), KroneckerGate(U3Gate(), ZGate()), NonadjacentCNOTGate(2, 1, 0)),
+    ProductGate(CPIPhaseGate(), KroneckerGate(SingleQutritGate(), SingleQutritGate()), UpgradedConstantGate(CNOTGate())),
+]
+
+@pytest.mark.parametrize("gate", PLAN_GATES, ids=lambda gate: repr(gate))
+def test_evaluation_plan(gate):
+    plan = EvaluationPlan(gate)
+    v = np.random.rand(gate.num_inputs) * 2 * np.pi
+    U = reference_matrix(gate, v)
+    assert np.allclose(plan.matrix(v), U)
+    M, Js = plan.mat_jac(v)
+    assert np.allclose(M, U)
+    assert len(Js) == gate.num_inputs
+    eps = 1e-6
+    for i in range(gate.num_inputs):
+        v2 = np.copy(v)
+        v2[i] = v[i] + eps
+        U1 = reference_matrix(gate, v2)
+        v2[i] = v[i] - eps
+        U2 = reference_matrix(gate, v2)
+        assert np.allclose((U1 - U2) / (2*eps), Js[i], atol=1e-6)
+    assert np.allclose(plan.matrix(v), U) # the buffers are reused between calls
+
+@pytest.mark.parametrize("gate", [CNOTGate(), NonadjacentCNOTGate(3, 2, 0), CSUMGate(), UpgradedConstantGate(CNOTGate())], ids=lambda gate: repr(gate))
+def test_permutation(gate):
+    U = gate.matrix([])
+    assert np.array_equal(U, np.eye(U.shape[0])[gate.permutation])
+    assert U3Gate().permutation is None
+    assert CZGate().permutation is None
+
+def test_is_diagonal():
+    assert CZGate().is_diagonal
+    assert ZGate().is_diagonal
+    assert U1Gate().is_diagonal
+    assert not CNOTGate().is_diagonal
+    assert not U3Gate().is_diagonal
+
+BATCH_GATES = list(RUST_GATES) + PLAN_GATES[-2:] + [U2Gate(), CZGate(), CPIPhaseGate(), NonadjacentCNOTGate(3, 0, 2)]
+
+@pytest.mark.parametrize("gate", BATCH_GATES, ids=lambda gate: repr(gate))
+def test_batch(gate):
+    V = np.random.rand(4, gate.num_inputs) * 2 * np.pi
+    U = gate.matrix_batch(V)
+    M, Js = gate.mat_jac_batch(V)
+    assert U.shape == (4, gate.dimension, gate.dimension)
+    assert Js.shape == (4, gate.num_inputs, gate.dimension, gate.dimension)
+    for i, v in enumerate(V):
+        M1, Js1 = gate.mat_jac(v)
+        assert np.allclose(U[i], gate.matrix(v))
+        assert np.allclose(M[i], M1)
+        for j in range(gate.num_inputs):
+            assert np.allclose(Js[i, j], Js1[j])
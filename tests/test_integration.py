@@ -1,4 +1,10 @@
-from qsearch import Options, unitaries, backends
+import os
+import signal
+import threading
+import numpy as np
+from scipy.stats import unitary_group
+from qsearch import Options, unitaries, backends, parallelizers
+from qsearch.project import Project_Status
 
 def test_per_compilation_options(project):
     project['backend'] = backends.SmartDefaultBackend()
@@ -19,3 +25,17 @@ def test_project_clear(project):
     project.clear()
     project.add_compilation("qft3", unitaries.qft(8))
     project.run()
+
+def test_sigterm(project):
+    previous = signal.getsignal(signal.SIGTERM)
+    project.add_compilation('random4', unitary_group.rvs(16, random_state=np.random.default_rng(0)))
+    project['parallelizer'] = parallelizers.SequentialParallelizer
+    project['stdout_enabled'] = False
+    timer = threading.Timer(1, os.kill, (os.getpid(), signal.SIGTERM))
+    timer.start()
+    project.run()
+    timer.join()
+    assert project.aborted
+    # the checkpoint is kept so that the next run resumes the compilation
+    assert project._compilation_status('random4') == Project_Status.PROGRESS
+    assert signal.getsignal(signal.SIGTERM) == previous
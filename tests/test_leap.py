@@ -15,6 +15,23 @@ def test_leap_simple(project, check_project):
     check_project(project)
 
 
+def test_leap_compile_iter():
+    options = qsearch.Options(target=unitaries.qft(8), min_depth=6, parallelizer=parallelizers.SequentialParallelizer, stdout_enabled=False)
+    records = list(leap_compiler.LeapCompiler(options).compile_iter())
+    assert len(records) > 0
+    assert all(a["weight"] <= b["weight"] and a["nodes"] <= b["nodes"] for a, b in zip(records, records[1:]))
+    assert records[-1]["cut_depths"][-1] == records[-1]["weight"]
+    assert utils.matrix_distance_squared(records[-1]["structure"].matrix(records[-1]["parameters"]), unitaries.qft(8)) < 1e-10
+
+
+def test_leap_deadline_passed():
+    # no sub-compilation runs once the deadline has passed, so the result is the initial layer
+    options = qsearch.Options(target=unitaries.qft(8), deadline=0.0, analytic_synthesis=False, parallelizer=parallelizers.SequentialParallelizer, stdout_enabled=False)
+    result = leap_compiler.LeapCompiler(options).compile()
+    assert result["cut_depths"] == [0]
+    assert len(result["parameters"]) == result["structure"].num_inputs
+
+
 def test_reoptimize(project, check_project):
     target = unitaries.qft(16)
     project.add_compilation("qft4", target)
@@ -0,0 +1,35 @@
+from qsearch import lower_bounds, unitaries, gatesets, Options
+from qsearch.gates import *
+import numpy as np
+
+def random_circuit(gateset, qudits, layers, rng):
+    circuit = ProductGate(gateset.initial_layer(qudits))
+    for _ in range(layers):
+        successors = gateset.search_layers(qudits)
+        circuit = circuit.appending(successors[rng.integers(len(successors))][0])
+    return circuit.matrix(rng.random(circuit.num_inputs) * 2 * np.pi)
+
+def test_schmidt_rank():
+    assert lower_bounds.schmidt_rank(np.eye(8), [0]) == 1
+    assert lower_bounds.schmidt_rank(CNOTGate().matrix([]), [0]) == 2
+    assert lower_bounds.schmidt_rank(np.kron(CNOTGate().matrix([]), np.eye(2)), [0]) == 2
+    assert lower_bounds.schmidt_rank(np.kron(CNOTGate().matrix([]), np.eye(2)), [2]) == 1
+    assert lower_bounds.schmidt_rank(unitaries.swap, [0]) == 4
+
+def test_known_bounds():
+    options = Options(gateset=gatesets.QubitCNOTLinear(), threshold=1e-10)
+    assert lower_bounds.entanglement_lower_bound(unitaries.qft(4), options) == 3
+    assert lower_bounds.entanglement_lower_bound(unitaries.swap, options) == 3
+    assert lower_bounds.entanglement_lower_bound(np.eye(8), options) == 0
+    assert lower_bounds.entanglement_lower_bound(unitaries.qft(16), options) == 8
+    assert lower_bounds.entanglement_lower_bound(unitaries.qft(2), options) == 0
+    assert lower_bounds.no_lower_bound(unitaries.qft(16), options) == 0
+
+def test_bounds_are_valid():
+    rng = np.random.default_rng(0)
+    for gateset in [gatesets.QubitCNOTLinear(), gatesets.QubitCNOTRing(), gatesets.QubitCZLinear(), gatesets.QubitISwapLinear()]:
+        options = Options(gateset=gateset, threshold=1e-10)
+        for qudits in [2, 3, 4]:
+            for layers in range(6):
+                U = random_circuit(gateset, qudits, layers, rng)
+                assert lower_bounds.entanglement_lower_bound(U, options) <= layers
@@ -1,4 +1,5 @@
-from qsearch import Project, parallelizers, unitaries, utils
+from qsearch import Project, Options, parallelizers, unitaries, utils, gates, solvers
+from qsearch.defaults import standard_defaults, standard_smart_defaults
 
 
 qft3 = unitaries.qft(8)
@@ -6,6 +7,7 @@ qft3 = unitaries.qft(8)
 def test_sequential(project):
     project.add_compilation('qft2', unitaries.qft(4))
     project['parallelizer'] = parallelizers.SequentialParallelizer
+    project['analytic_synthesis'] = False
     project.run()
 
 def test_multiprocessing_parallelizer(project):
@@ -17,3 +19,36 @@ def test_processpool_parallelizer(project):
     project.add_compilation('qft3', qft3)
     project['parallelizer'] = parallelizers.ProcessPoolParallelizer
     project.run()
+
+def test_evaluate_step_scores_in_worker():
+    options = Options(target=unitaries.qft(4))
+    options.set_defaults(**standard_defaults)
+    options.set_smart_defaults(**standard_smart_defaults)
+    step = gates.ProductGate(options.gateset.initial_layer(2))
+    result_step, result, depth, weight, value, score, stats = parallelizers.evaluate_step((step, 0, 1, None), options)
+    assert value == options.objective.gen_eval_func(step, options)(result[1])
+    assert score == options.heuristic(step, result[1], 1, options)
+    options.parallel_heuristic = False
+    assert parallelizers.evaluate_step((step, 0, 1, None), options)[5] is None
+
+def test_evaluate_step_solve_cutoff():
+    options = Options(target=unitaries.qft(4), solve_cutoff=1.0, solver=solvers.LeastSquares_Jac_Solver())
+    options.set_defaults(**standard_defaults)
+    options.set_smart_defaults(**standard_smart_defaults)
+    step = gates.ProductGate(options.gateset.initial_layer(2))
+    # no parameters for this circuit can reach a bound of zero, so the solve gets aborted
+    stats = parallelizers.evaluate_step((step, 0, 1, None, {"bound": 0.0}), options)[6]
+    assert stats["aborted"]
+    stats = parallelizers.evaluate_step((step, 0, 1, None), options)[6]
+    assert not stats["aborted"]
+
+def test_evaluate_step_deadline():
+    options = Options(target=unitaries.qft(8), deadline=0.0, solver=solvers.LeastSquares_Jac_Solver())
+    options.set_defaults(**standard_defaults)
+    options.set_smart_defaults(**standard_smart_defaults)
+    step = gates.ProductGate(options.gateset.initial_layer(3))
+    # the deadline has already passed, so the solve stops at its first evaluation
+    stats = parallelizers.evaluate_step((step, 0, 1, None), options)[6]
+    assert stats["expired"] and not stats["aborted"]
+    options.deadline = None
+    assert not parallelizers.evaluate_step((step, 0, 1, None), options)[6]["expired"]
@@ -0,0 +1,76 @@
+from qsearch import portfolio, compiler, leap_compiler, parallelizers, unitaries, Options
+from qsearch.gates import *
+import pickle
+import time
+import pytest
+import numpy as np
+
+def test_shared_bound():
+    shared = portfolio.SharedBound(1e-10, lower_bound=2)
+    structure = ProductGate(CNOTGate())
+    assert not shared.report(structure, np.zeros(0), 1e-3, 1)
+    assert shared.allows(10)
+    assert shared.report(structure, np.zeros(0), 1e-12, 5)
+    assert not shared.report(structure, np.zeros(0), 1e-12, 6)
+    assert shared.allows(4) and not shared.allows(5)
+    assert not shared.cancelled
+    copy = pickle.loads(pickle.dumps(shared))
+    assert copy.weight == 5 and not copy.cancelled
+    assert shared.report(structure, np.zeros(0), 1e-12, 2)
+    assert shared.cancelled
+    assert pickle.loads(pickle.dumps(shared)).cancelled
+
+def test_shared_parallelizer():
+    options = Options(parallelizer=parallelizers.SequentialParallelizer)
+    base = parallelizers.SequentialParallelizer(options)
+    shared = parallelizers.SharedParallelizer(base, Options(threshold=1))
+    assert shared.options.num_tasks == 1
+    assert shared.parallelizer.process_func.keywords["options"] is shared.options
+    assert base.process_func.keywords["options"] is options
+
+def test_portfolio(project, check_project):
+    project.add_compilation('qft3', unitaries.qft(8))
+    project['compiler_class'] = portfolio.PortfolioCompiler
+    project['parallelizer'] = parallelizers.SequentialParallelizer
+    project.run()
+    check_project(project)
+
+def test_portfolio_multiprocessing(project, check_project):
+    project.add_compilation('qft3', unitaries.qft(8))
+    project['compiler_class'] = portfolio.PortfolioCompiler
+    project['strategies'] = [(compiler.SearchCompiler, {"search_type": "astar"}), (compiler.SearchCompiler, {"search_type": "greedy", "async_search": True})]
+    project['parallelizer'] = parallelizers.MultiprocessingParallelizer
+    project.run()
+    check_project(project)
+
+class InterruptedStrategy(compiler.Compiler):
+    def compile(self, options):
+        raise KeyboardInterrupt()
+
+class WaitingStrategy(compiler.Compiler):
+    cancelled = []
+    def compile(self, options):
+        WaitingStrategy.cancelled.append(options.shared_bound._cancelled.wait(timeout=30))
+        raise RuntimeError("cancelled")
+
+def test_portfolio_interrupted():
+    # the other strategies are cancelled when the compilation is interrupted
+    opts = Options(target=unitaries.qft(4), parallelizer=parallelizers.SequentialParallelizer, strategies=[(WaitingStrategy, {}), (InterruptedStrategy, {})], stdout_enabled=False, log_file=None)
+    with pytest.raises(KeyboardInterrupt):
+        portfolio.PortfolioCompiler().compile(opts)
+    for _ in range(100):
+        if len(WaitingStrategy.cancelled) > 0:
+            break
+        time.sleep(0.1)
+    assert WaitingStrategy.cancelled == [True]
+
+class SpillFileStrategy(compiler.Compiler):
+    spill_files = []
+    def compile(self, options):
+        SpillFileStrategy.spill_files.append(options.queue_spill_file)
+        return {"structure": ProductGate(CNOTGate()), "parameters": np.zeros(0)}
+
+def test_portfolio_spill_files():
+    opts = Options(target=unitaries.qft(4), parallelizer=parallelizers.SequentialParallelizer, strategies=[(SpillFileStrategy, {})] * 2, queue_spill_file="queue.spill", stdout_enabled=False, log_file=None)
+    portfolio.PortfolioCompiler().compile(opts)
+    assert sorted(SpillFileStrategy.spill_files) == ["queue.spill.0", "queue.spill.1"]
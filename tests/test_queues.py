@@ -0,0 +1,77 @@
+from qsearch import gatesets, queues
+from qsearch.gates import ProductGate
+import numpy as np
+import pickle
+
+def test_search_queue_order():
+    gateset = gatesets.QubitCNOTLinear()
+    root = ProductGate(gateset.initial_layer(3))
+    queue = queues.SearchQueue()
+    for i, (child, weight) in enumerate(gateset.successors(root)):
+        queue.push(1.0 - i, weight, 0.5, i, np.full(child.num_inputs, i, dtype='float64'), child)
+    queue.push(5.0, 0, 0.5, -1, np.zeros(root.num_inputs), root)
+    assert len(queue) == 3
+    queue = pickle.loads(pickle.dumps(queue))
+    heuristic, weight, value, tiebreaker, parameters, structure = queue.pop()
+    assert heuristic == 0.0 and tiebreaker == 1
+    assert repr(structure) == repr(gateset.successors(root)[1][0])
+    assert np.array_equal(parameters, np.full(structure.num_inputs, 1.0))
+    assert queue.pop()[3] == 0
+    assert queue.pop()[5].num_inputs == root.num_inputs
+    assert len(queue) == 0
+
+def test_parameter_store_compaction():
+    store = queues.ParameterStore(capacity=4)
+    handles = [store.add(np.arange(i, i+10)) for i in range(500)]
+    for handle in handles[:400]:
+        store.remove(handle)
+    for i, handle in enumerate(handles[400:]):
+        assert np.array_equal(store.get(handle), np.arange(400+i, 410+i))
+
+def test_parameter_store_handle_reuse():
+    store = queues.ParameterStore()
+    live = [store.add(np.arange(10)) for _ in range(10)]
+    for i in range(10000):
+        store.remove(live.pop(0))
+        live.append(store.add(np.full(10, i)))
+    # the bookkeeping only grows with the number of vectors stored at once
+    assert store._handles == 10
+    assert np.array_equal(store.get(live[-1]), np.full(10, 9999))
+    restored = pickle.loads(pickle.dumps(store))
+    assert np.array_equal(restored.get(live[0]), np.full(10, 9990))
+
+def test_min_max_heap():
+    items = list(np.random.RandomState(0).permutation(100))
+    heap = queues.MinMaxHeap(items)
+    assert heap.pop_max() == 99
+    assert heap.pop_min() == 0
+    assert heap.max() == 98 and heap.min() == 1
+    assert len(heap) == 98
+
+def test_search_queue_eviction(tmp_path):
+    root = ProductGate(gatesets.QubitCNOTLinear().initial_layer(2))
+    dropped = queues.SearchQueue(max_size=10)
+    spilled = queues.SearchQueue(max_size=10, spill_file=str(tmp_path / "spill"))
+    order = np.random.RandomState(0).permutation(50)
+    for i in order:
+        dropped.push(float(i), 0, 0.5, int(i), np.full(root.num_inputs, i, dtype='float64'), root)
+        spilled.push(float(i), 0, 0.5, int(i), np.full(root.num_inputs, i, dtype='float64'), root)
+    assert len(dropped) == 10 and dropped.evictions == 40
+    assert [dropped.pop()[3] for _ in range(10)] == list(range(10))
+    assert spilled.min_heuristic() == 0.0
+    # spilled nodes come back in order once they are the best nodes left
+    assert len(spilled) == 50 and spilled.evictions >= 40
+    popped = [spilled.pop() for _ in range(50)]
+    assert [tup[3] for tup in popped] == list(range(50))
+    assert all(np.array_equal(tup[4], np.full(root.num_inputs, tup[3])) for tup in popped)
+    spilled.delete_spill_file()
+
+def test_search_queue_fidelity(tmp_path):
+    root = ProductGate(gatesets.QubitCNOTLinear().initial_layer(2))
+    queue = queues.SearchQueue(max_size=2, spill_file=str(tmp_path / "spill"))
+    queue.push(0.0, 0, 0.5, 0, np.zeros(root.num_inputs), root, queues.LOW_FIDELITY)
+    queue.push(1.0, 0, 0.5, 1, np.zeros(root.num_inputs), root)
+    queue.push(2.0, 0, 0.5, 2, np.zeros(root.num_inputs), root, queues.LOW_FIDELITY)
+    assert len(queue.pop()) == 6
+    assert queue.pop(with_fidelity=True)[6] == queues.FULL_FIDELITY
+    assert queue.pop(with_fidelity=True)[6] == queues.LOW_FIDELITY
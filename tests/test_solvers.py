@@ -1,5 +1,6 @@
-from qsearch import Project, solvers, unitaries, utils, multistart_solvers, parallelizers, compiler, options
+from qsearch import Project, solvers, unitaries, utils, multistart_solvers, parallelizers, compiler, options, gatesets, objectives
 import scipy as sp
+import numpy as np
 import os
 try:
     from qsrs import BFGS_Jac_SolverNative, LeastSquares_Jac_SolverNative
@@ -49,6 +50,89 @@ def test_multistart_bfgs(project):
     project['parallelizer'] = parallelizers.ProcessPoolParallelizer
     project.run()
 
+def test_naive_multistart(project, check_project):
+    project.add_compilation('qft2', unitaries.qft(4))
+    project['solver'] = multistart_solvers.NaiveMultiStart_Solver(2)
+    project['inner_solver'] = solvers.LeastSquares_Jac_Solver()
+    project['parallelizer'] = parallelizers.SequentialParallelizer
+    project.run()
+    check_project(project)
+
+def test_pooled_multistart(project, check_project):
+    solver = multistart_solvers.PooledMultiStart_Solver(2)
+    project.add_compilation('qft3', qft3)
+    project['solver'] = solver
+    project['inner_solver'] = solvers.LeastSquares_Jac_Solver()
+    project['parallelizer'] = parallelizers.SequentialParallelizer
+    project.run()
+    check_project(project)
+    assert (solver.pool_id, os.getpid()) not in multistart_solvers._pools # the Parallelizer shuts the workers down when the compilation is done
+
+class FailingSolver(solvers.Solver):
+    # fails from starting points whose first parameter is 0
+    def solve_for_unitary(self, circuit, options, x0=None):
+        if x0[0] == 0:
+            raise ValueError("failed")
+        return solvers.LeastSquares_Jac_Solver().solve_for_unitary(circuit, options, x0)
+
+def test_pooled_multistart_error():
+    solver = multistart_solvers.PooledMultiStart_Solver(2)
+    gateset = gatesets.QubitCNOTLinear()
+    small = compiler.ProductGate(gateset.initial_layer(2))
+    large = small.appending(gateset.search_layers(2)[0][0])
+    opts = options.Options(target=unitaries.qft(4), threshold=1e-10, max_quality_optimization=False, objective=objectives.MatrixDistanceObjective())
+    try:
+        with pytest.raises(ValueError):
+            solver.optimize_starting_points(small, opts.updated(inner_solver=FailingSolver()), [np.zeros(small.num_inputs)] + [np.ones(small.num_inputs)] * 5, None)
+        # none of the results from the failed call are mistaken for results of the next one
+        rets = solver.optimize_starting_points(large, opts.updated(inner_solver=solvers.LeastSquares_Jac_Solver()), [np.ones(large.num_inputs)] * 4, None)
+        assert all(len(xopt) == large.num_inputs for _, xopt in rets)
+    finally:
+        solver.done()
+
+@pytest.mark.skipif(sys.platform == 'win32', reason="This test currently hangs due to the nested parallel executor")
+def test_pooled_multistart_process_pool(project, check_project):
+    project.add_compilation('qft3', qft3)
+    project['solver'] = multistart_solvers.PooledMultiStart_Solver(2)
+    project['inner_solver'] = solvers.BFGS_Jac_Solver()
+    project['parallelizer'] = parallelizers.ProcessPoolParallelizer
+    project.run()
+    check_project(project)
+
+class RecordingSolver(solvers.Solver):
+    # records the pid of each process that it solves in
+    def __init__(self, path):
+        self.path = path
+    def solve_for_unitary(self, circuit, options, x0=None):
+        open(os.path.join(self.path, str(os.getpid())), "w").close()
+        return solvers.LeastSquares_Jac_Solver().solve_for_unitary(circuit, options, x0)
+
+@pytest.mark.skipif(sys.platform == 'win32', reason="This test currently hangs due to the nested parallel executor")
+def test_pooled_multistart_process_pool_reuse(project, tmp_path):
+    pids = tmp_path / "pids"
+    pids.mkdir()
+    project.add_compilation('qft3', qft3)
+    project['solver'] = multistart_solvers.PooledMultiStart_Solver(2)
+    project['inner_solver'] = RecordingSolver(str(pids))
+    project['parallelizer'] = parallelizers.ProcessPoolParallelizer
+    project['num_tasks'] = 2
+    project['analytic_synthesis'] = False
+    project.run()
+    # the master and each of the 2 parallelizer workers keep one pool of 2 processes for all of their solves
+    assert len(os.listdir(pids)) <= 6
+
+def test_lockstep_multistart_least_squares(project, check_project):
+    project.add_compilation('qft3', qft3)
+    project['solver'] = multistart_solvers.LockstepMultiStart_Solver(4)
+    project.run()
+    check_project(project)
+
+def test_lockstep_multistart_bfgs(project, check_project):
+    project.add_compilation('qft2', unitaries.qft(4))
+    project['solver'] = multistart_solvers.LockstepMultiStart_Solver(4, "bfgs")
+    project.run()
+    check_project(project)
+
 def compile(U, solver):
     with tempfile.TemporaryDirectory() as dir:
         opts = options.Options()
@@ -76,3 +160,82 @@ def test_rust_solver_qft3():
     circ = res['structure']
     v = res['parameters']
     assert utils.matrix_distance_squared(U, circ.matrix(v)) < 1e-10
+
+def test_lockstep_multistart_fallback():
+    # circuits from a native backend don't have matrix_batch, so each starting point is solved with the inner_solver instead
+    class NativeStyleCircuit():
+        def __init__(self, circuit):
+            self.circuit = circuit
+            self.num_inputs = circuit.num_inputs
+        def matrix(self, v):
+            return self.circuit.matrix(v)
+        def mat_jac(self, v):
+            return self.circuit.mat_jac(v)
+    U = unitaries.qft(4)
+    gateset = gatesets.QubitCNOTLinear()
+    structure = compiler.ProductGate(gateset.initial_layer(2))
+    for _ in range(3):
+        structure = structure.appending(gateset.search_layers(2)[0][0])
+    circuit = NativeStyleCircuit(structure)
+    opts = options.Options(target=U, threshold=1e-10, max_quality_optimization=False, objective=objectives.MatrixDistanceObjective(), inner_solver=solvers.LeastSquares_Jac_Solver())
+    assert opts.objective.gen_error_func_batch(circuit, opts) is None
+    assert opts.objective.gen_error_residuals_jac_batch(circuit, opts) is None
+    result = multistart_solvers.LockstepMultiStart_Solver(2).solve_for_unitary(circuit, opts)
+    assert utils.matrix_distance_squared(result[0], U) < 1e-10
+
+def test_solve_deadline_best_parameters():
+    # the deadline passes at the fourth evaluation, after the best one
+    monitor = solvers.SolveDeadline(float('inf'))
+    f = monitor.wrap(lambda x: np.sum(np.square(x)))
+    for x in ([2.0], [0.5], [1.0]):
+        f(np.array(x))
+    monitor.deadline = 0.0
+    with pytest.raises(solvers.SolveAborted) as e:
+        f(np.array([3.0]))
+    assert monitor.expired
+    assert e.value.x[0] == 0.5
+
+def test_lockstep_multistart_deadline():
+    gateset = gatesets.QubitCNOTLinear()
+    structure = compiler.ProductGate(gateset.initial_layer(3))
+    for _ in range(4):
+        structure = structure.appending(gateset.search_layers(3)[0][0])
+    opts = options.Options(target=unitaries.qft(8), threshold=1e-10, max_quality_optimization=False, objective=objectives.MatrixDistanceObjective(), solve_monitor=solvers.SolveDeadline(0.0))
+    solver = multistart_solvers.LockstepMultiStart_Solver(4)
+    assert solvers.supports(solver, "deadline", opts)
+    x0 = np.random.rand(structure.num_inputs)
+    # the deadline has already passed, so the starting point is returned if it is the best one
+    result = solver.solve_for_unitary(structure, opts, x0)
+    error_func = opts.objective.gen_error_func(structure, opts)
+    assert error_func(result[1]) <= error_func(x0)
+    assert len(result[1]) == structure.num_inputs
+
+@pytest.mark.skipif(sys.platform == 'win32', reason="MultiStart_Solver only supports solve_cutoff with forked workers")
+def test_multistart_solve_cutoff_aborted():
+    # the solves are aborted in the worker processes, and the master's copy of the monitor records it
+    structure = compiler.ProductGate(gatesets.QubitCNOTLinear().initial_layer(2))
+    opts = options.Options(target=unitaries.qft(4), threshold=1e-10, max_quality_optimization=False, objective=objectives.MatrixDistanceObjective(), inner_solver=solvers.LeastSquares_Jac_Solver(), verbosity=0, stdout_enabled=False, log_file=None)
+    for solver in (multistart_solvers.MultiStart_Solver(2), multistart_solvers.NaiveMultiStart_Solver(2)):
+        monitor = solvers.SolveCutoff(opts.objective.gen_eval_func(structure, opts), 1e-30, 1.0, window=1)
+        assert solvers.supports(solver, "solve_cutoff", opts)
+        solver.solve_for_unitary(structure, opts.updated(solve_monitor=monitor))
+        assert monitor.aborted
+
+def test_least_squares_iteration_cap():
+    gateset = gatesets.QubitCNOTLinear()
+    structure = compiler.ProductGate(gateset.initial_layer(3))
+    for _ in range(4):
+        structure = structure.appending(gateset.search_layers(3)[0][0])
+    opts = options.Options(target=unitaries.qft(8), threshold=1e-10, max_quality_optimization=False, objective=objectives.MatrixDistanceObjective())
+    jacobians = []
+    error_residuals_jac = opts.objective.gen_error_residuals_jac(structure, opts)
+    class CountingObjective(objectives.MatrixDistanceObjective):
+        def gen_error_residuals_jac(self, circuit, options):
+            def counted(x):
+                jacobians.append(x)
+                return error_residuals_jac(x)
+            return counted
+    opts.objective = CountingObjective()
+    solvers.LeastSquares_Jac_Solver().solve_for_unitary(structure, opts.updated(max_solver_iterations=3), np.random.rand(structure.num_inputs))
+    # the jacobian is evaluated at the start and after each iteration, and the evaluation after the third one stops the solve instead
+    assert len(jacobians) == 3